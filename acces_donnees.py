@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Base de données par défaut
+FICHIER_BASE = 'marvel.db'
+
+# Attente maximale (en secondes) d'un verrou tenu par une autre connexion
+DELAI_VERROU = 30
+
+# Pragmas appliqués à chaque connexion. Le mode WAL (persistant dans le fichier)
+# laisse les lectures se poursuivre pendant une écriture ; synchronous = NORMAL
+# suffit en WAL (aucune corruption possible, seule la dernière transaction peut
+# être perdue en cas de coupure de courant)
+PRAGMAS_CONNEXION = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -64000',  # ~64 Mo de cache de pages par connexion
+    'PRAGMA mmap_size = 268435456',  # Lecture des pages par projection mémoire (256 Mo)
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA busy_timeout = {DELAI_VERROU * 1000}',
+)
+
+
+def connecter(fichier=FICHIER_BASE, check_same_thread=True):
+    """Ouvre une connexion à la base avec les pragmas de PRAGMAS_CONNEXION (mode WAL)."""
+    conn = sqlite3.connect(fichier, timeout=DELAI_VERROU, check_same_thread=check_same_thread)
+    for pragma in PRAGMAS_CONNEXION:
+        conn.execute(pragma)
+    return conn
+
+
+class AccesDonnees:
+    """Accès partagé à la base : une connexion de lecture par thread et un seul écrivain.
+
+    lecture() retourne la connexion du thread appelant, ouverte au premier
+    appel puis réutilisée. Les écritures sont confiées à ecrire(fonction),
+    exécutée dans le thread écrivain avec sa propre connexion : elles sont
+    sérialisées sans jamais lever « database is locked », et les lecteurs (mode
+    WAL) voient le dernier état validé pendant toute la durée d'une écriture.
+    """
+
+    def __init__(self, fichier=FICHIER_BASE):
+        self.fichier = fichier
+        self._local = threading.local()
+        self._ecrivain = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ecrivain-sqlite')
+        self._connexion_ecrivain = None
+        self._verrou = threading.Lock()
+        self._connexions = []
+
+    def lecture(self):
+        """Connexion de lecture du thread appelant."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False : seul fermer() l'utilise hors de son thread
+            conn = connecter(self.fichier, check_same_thread=False)
+            self._local.conn = conn
+            with self._verrou:
+                self._connexions.append(conn)
+        return conn
+
+    def _executer_ecriture(self, fonction, args, kwargs):
+        if self._connexion_ecrivain is None:
+            self._connexion_ecrivain = connecter(self.fichier, check_same_thread=False)
+        return fonction(self._connexion_ecrivain, *args, **kwargs)
+
+    def ecrire(self, fonction, *args, **kwargs):
+        """Exécute fonction(conn, *args, **kwargs) dans le thread écrivain ; retourne un Future.
+
+        La fonction gère elle-même ses transactions (with conn: ...).
+        """
+        return self._ecrivain.submit(self._executer_ecriture, fonction, args, kwargs)
+
+    def ecrire_et_attendre(self, fonction, *args, **kwargs):
+        """Comme ecrire, mais attend la fin de l'écriture et retourne son résultat (ou relance son exception)."""
+        return self.ecrire(fonction, *args, **kwargs).result()
+
+    def fermer(self):
+        """Attend les écritures en file puis ferme toutes les connexions."""
+        self._ecrivain.shutdown(wait=True)
+        if self._connexion_ecrivain is not None:
+            self._connexion_ecrivain.close()
+        with self._verrou:
+            for conn in self._connexions:
+                conn.close()
+            self._connexions.clear()
+        self._local = threading.local()
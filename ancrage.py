@@ -0,0 +1,298 @@
+import numpy as np
+from scipy.linalg import cho_solve
+from scipy.sparse import csr_matrix, diags
+
+from assemblage import etiqueter_composantes
+from cholesky_creux import FactorisationCholesky, resoudre_equations_normales
+from instrumentation import etape
+from inversion_selective import InversionSelective
+
+# Modes d'ancrage des composantes flottantes
+ANCRAGES = ('reference', 'regularisation')
+
+# Régularisation ajoutée à la diagonale d'une composante flottante, relativement à sa diagonale moyenne
+REGULARISATION_RELATIVE = 1e-8
+
+# Itérations de raffinement (Tikhonov itéré) qui retirent le biais de la régularisation
+ITERATIONS_RAFFINEMENT = 3
+
+
+class AnalyseComposantes:
+    """Composantes connexes du système M x = y et ancrage de celles qui ne contiennent pas le fondamental.
+
+    Les composantes sont les blocs diagonaux de M, déduits des indices de
+    niveaux des transitions (ordre donne la permutation qui rend M
+    bloc-diagonale, bornes les limites des blocs dans cet ordre). Une
+    composante est ancrée si l'une de ses transitions aboutit au fondamental
+    exclu (indice -1) ; sinon elle est flottante et son bloc est singulier
+    (ses énergies ne sont définies qu'à une constante près).
+
+    ancrer(M) rend toutes les composantes définies positives, ce qui permet de
+    factoriser M en une seule fois :
+    - 'reference' ajoute λ = M[r, r] à la diagonale d'un niveau de référence r
+      de chaque composante flottante. La solution vérifie exactement x[r] = 0
+      (les énergies de la composante sont relatives à r) quel que soit λ, et
+      M⁻¹ vaut l'inverse du système où x[r] est fixé, plus 1/λ sur tout le
+      bloc : corriger_variances retire ce terme.
+    - 'regularisation' ajoute λ = REGULARISATION_RELATIVE x (diagonale
+      moyenne) à toute la diagonale du bloc. Quelques itérations de
+      raffinement avec M retirent le biais en O(λ) de la solution, ramenée à
+      une énergie moyenne nulle sur la composante. (M + λ)⁻¹ vaut la
+      pseudo-inverse plus 1/(λ n) sur le bloc, terme bien trop grand pour
+      être retiré sans noyer les variances dans les arrondis :
+      preparer_covariances(M) les recalcule à part sur les blocs flottants.
+
+    La référence d'une composante flottante est le premier des niveaux
+    references qu'elle contient (par exemple le fondamental quand son énergie
+    est libre), sinon son niveau de plus petite clé (nombres quantiques les
+    plus petits dans l'ordre lexicographique) si cles_niveaux est fourni,
+    sinon son niveau de plus petit numéro.
+    """
+
+    def __init__(self, idx_up, idx_low, nombre_niveaux, cles_niveaux=None, references=(), ancrage='reference',
+                 regularisation_relative=REGULARISATION_RELATIVE):
+        if ancrage not in ANCRAGES:
+            raise ValueError(f"Ancrage inconnu : {ancrage}. Valeurs possibles : {ANCRAGES}")
+        idx_up = np.asarray(idx_up, dtype=np.int64)
+        idx_low = np.asarray(idx_low, dtype=np.int64)
+        self.ancrage = ancrage
+        self.regularisation_relative = regularisation_relative
+        self.nombre_niveaux = nombre_niveaux
+
+        with etape('analyse_composantes', lignes=idx_up.shape[0]):
+            self.nombre, self.etiquettes, self.etiquettes_transitions = etiqueter_composantes(
+                idx_up, idx_low, nombre_niveaux)
+
+            # Permutation bloc-diagonale : niveaux rangés par composante, dans l'ordre des numéros
+            self.ordre = np.argsort(self.etiquettes, kind='stable')
+            self.bornes = np.searchsorted(self.etiquettes[self.ordre], np.arange(self.nombre + 1))
+            self.tailles = np.diff(self.bornes)
+
+            # Composantes reliées au fondamental exclu par au moins une transition
+            rattaches = np.concatenate((idx_up[(idx_low < 0) & (idx_up >= 0)], idx_low[(idx_up < 0) & (idx_low >= 0)]))
+            ancrees = np.zeros(self.nombre, dtype=bool)
+            ancrees[self.etiquettes[rattaches]] = True
+            self.flottantes = np.flatnonzero(~ancrees)
+
+            # Référence de chaque composante flottante (-1 pour une composante ancrée)
+            self.references = np.full(self.nombre, -1, dtype=np.int64)
+            if cles_niveaux is not None:
+                premiers = np.lexsort((cles_niveaux, self.etiquettes))[self.bornes[:-1]]
+            else:
+                premiers = self.ordre[self.bornes[:-1]]
+            self.references[self.flottantes] = premiers[self.flottantes]
+            for niveau in np.asarray(references, dtype=np.int64)[::-1]:
+                if niveau >= 0 and not ancrees[self.etiquettes[niveau]]:
+                    self.references[self.etiquettes[niveau]] = niveau
+
+        self.penalites = np.zeros(nombre_niveaux)
+        self.correction = np.zeros(nombre_niveaux)
+        # Covariances des blocs flottants en mode 'regularisation' (preparer_covariances)
+        self._niveaux_flottants = None
+
+    def __getstate__(self):
+        # Les covariances préparées (factorisation SuperLU) ne se transmettent pas à un autre processus
+        etat = self.__dict__.copy()
+        for nom in ('_inversion_flottante', '_moyennes_lignes', '_moyennes_blocs', '_variances_flottantes',
+                    '_position_flottante'):
+            etat.pop(nom, None)
+        etat['_niveaux_flottants'] = None
+        return etat
+
+    @property
+    def nombre_flottantes(self):
+        return self.flottantes.shape[0]
+
+    def ancrer(self, M):
+        """Retourne M (CSR) avec les termes d'ancrage des composantes flottantes ajoutés à sa diagonale.
+
+        Les termes dépendent de la diagonale de M : ancrer doit être rappelée
+        quand M est réassemblée avec d'autres poids.
+        """
+        return (M + diags(self.penalites_ancrage(M.diagonal()))).tocsr()
+
+    def penalites_ancrage(self, diagonale):
+        """Termes d'ancrage à ajouter à la diagonale de M, calculés à partir de cette diagonale.
+
+        Met aussi à jour correction (terme constant ajouté à M⁻¹ sur chaque bloc
+        flottant, retiré en mode 'reference') et invalide preparer_covariances.
+        """
+        self.penalites = np.zeros(self.nombre_niveaux)
+        self.correction = np.zeros(self.nombre_niveaux)
+        self._niveaux_flottants = None
+        if self.nombre_flottantes == 0:
+            return self.penalites
+
+        if self.ancrage == 'reference':
+            niveaux = self.references[self.flottantes]
+            lambdas = np.where(diagonale[niveaux] > 0, diagonale[niveaux], 1.0)
+            self.penalites[niveaux] = lambdas
+            termes = 1 / lambdas
+        else:
+            sommes = np.bincount(self.etiquettes, weights=diagonale, minlength=self.nombre)[self.flottantes]
+            moyennes = sommes / self.tailles[self.flottantes]
+            lambdas = self.regularisation_relative * np.where(moyennes > 0, moyennes, 1.0)
+            par_composante = np.zeros(self.nombre)
+            par_composante[self.flottantes] = lambdas
+            self.penalites = par_composante[self.etiquettes]
+            termes = 1 / (lambdas * self.tailles[self.flottantes])
+
+        # Terme constant ajouté par l'ancrage à M⁻¹ sur chaque bloc flottant
+        par_composante = np.zeros(self.nombre)
+        par_composante[self.flottantes] = termes
+        self.correction = par_composante[self.etiquettes]
+        return self.penalites
+
+    def fixer_jauge(self, x):
+        """Décale chaque composante flottante de x : x[r] = 0 ('reference') ou énergie moyenne nulle ('regularisation').
+
+        Ramène à la jauge de l'ancrage une solution qui ne l'a pas reçu (résolution
+        itérative sur M singulière, où chaque composante flottante garde le
+        décalage atteint par l'algorithme).
+        """
+        x = np.asarray(x, dtype=float)
+        if self.nombre_flottantes == 0:
+            return x
+        flottante = np.zeros(self.nombre, dtype=bool)
+        flottante[self.flottantes] = True
+        if self.ancrage == 'reference':
+            decalages = np.zeros(self.nombre)
+            decalages[self.flottantes] = x[self.references[self.flottantes]]
+        else:
+            decalages = np.bincount(self.etiquettes, weights=x, minlength=self.nombre) / np.maximum(self.tailles, 1)
+        return x - np.where(flottante[self.etiquettes], decalages[self.etiquettes], 0.0)
+
+    def preparer_covariances(self, M):
+        """Covariances des composantes flottantes en mode 'regularisation', à partir de M (sans ancrage).
+
+        Les blocs flottants de M sont factorisés à part, ancrés à leur
+        référence : leur inverse Z est exacte, au terme constant 1/λ près sur
+        chaque bloc. La covariance dans la jauge d'énergie moyenne nulle en est
+        la projection Σ̄ = P Z Pᵀ, P = I - 11ᵀ/n, qui annule ce terme :
+
+            Σ̄[i, j] = Z[i, j] - m[i] - m[j] + m̄
+
+        où m[i] est la moyenne de la ligne i de Z sur son bloc (une seule
+        résolution Z 1 pour tous les blocs, disjoints) et m̄ celle du bloc.
+        À appeler après la résolution, avec la M de ses poids ; sans effet en
+        mode 'reference'.
+        """
+        self._niveaux_flottants = None
+        if self.ancrage != 'regularisation' or self.nombre_flottantes == 0:
+            return
+        flottant = np.zeros(self.nombre, dtype=bool)
+        flottant[self.flottantes] = True
+        niveaux = np.flatnonzero(flottant[self.etiquettes])
+        position = np.full(self.nombre_niveaux, -1, dtype=np.int64)
+        position[niveaux] = np.arange(niveaux.shape[0])
+
+        with etape('covariances_flottantes', lignes=niveaux.shape[0]):
+            M_flottante = csr_matrix(M)[niveaux][:, niveaux]
+            diagonale = M_flottante.diagonal()
+            ancres = position[self.references[self.flottantes]]
+            penalites = np.zeros(niveaux.shape[0])
+            penalites[ancres] = np.where(diagonale[ancres] > 0, diagonale[ancres], 1.0)
+            factorisation = FactorisationCholesky((M_flottante + diags(penalites)).tocsc())
+            self._inversion_flottante = InversionSelective(factorisation)
+            etiquettes = self.etiquettes[niveaux]
+            self._moyennes_lignes = factorisation.resoudre(np.ones(niveaux.shape[0])) / self.tailles[etiquettes]
+            self._moyennes_blocs = (np.bincount(etiquettes, weights=self._moyennes_lignes, minlength=self.nombre)
+                                    / np.maximum(self.tailles, 1))
+            self._variances_flottantes = (self._inversion_flottante.variances() - 2 * self._moyennes_lignes
+                                          + self._moyennes_blocs[etiquettes])
+        self._position_flottante = position
+        self._niveaux_flottants = niveaux
+
+    def _verifier_covariances(self):
+        if self._niveaux_flottants is None:
+            raise ValueError("Ancrage 'regularisation' : appeler preparer_covariances(M) après la résolution.")
+
+    def corriger_variances(self, variances):
+        """Variances des énergies relatives à la référence (ou à la moyenne) de chaque composante flottante."""
+        variances = np.asarray(variances, dtype=float)
+        if self.ancrage == 'reference' or self.nombre_flottantes == 0:
+            return np.maximum(variances - self.correction, 0.0)
+        self._verifier_covariances()
+        variances = variances.copy()
+        variances[self._niveaux_flottants] = self._variances_flottantes
+        return np.maximum(variances, 0.0)
+
+    def corriger_covariances(self, paires, covariances):
+        """Covariances de paires de niveaux, corrigées pour les paires d'une même composante flottante."""
+        paires = np.asarray(paires, dtype=np.int64).reshape(-1, 2)
+        meme_composante = self.etiquettes[paires[:, 0]] == self.etiquettes[paires[:, 1]]
+        if self.ancrage == 'reference' or self.nombre_flottantes == 0:
+            return np.asarray(covariances) - np.where(meme_composante, self.correction[paires[:, 0]], 0.0)
+        self._verifier_covariances()
+        covariances = np.array(covariances, dtype=float)
+        a, b = self._position_flottante[paires[:, 0]], self._position_flottante[paires[:, 1]]
+        flottantes = meme_composante & (a >= 0)
+        if np.any(flottantes):
+            a, b = a[flottantes], b[flottantes]
+            covariances[flottantes] = (self._inversion_flottante.covariances(np.column_stack((a, b)))
+                                       - self._moyennes_lignes[a] - self._moyennes_lignes[b]
+                                       + self._moyennes_blocs[self.etiquettes[paires[flottantes, 0]]])
+        return covariances
+
+    def decrire(self, codec=None, cles_niveaux=None):
+        """Liste des composantes flottantes : numéro, nombres de niveaux et de transitions, niveau de référence."""
+        transitions = np.bincount(self.etiquettes_transitions[self.etiquettes_transitions >= 0],
+                                  minlength=self.nombre)
+        description = []
+        for composante in self.flottantes.tolist():
+            reference = int(self.references[composante])
+            entree = {'composante': composante, 'niveaux': int(self.tailles[composante]),
+                      'transitions': int(transitions[composante]), 'ancrage': self.ancrage}
+            if self.ancrage == 'reference':
+                entree['reference'] = reference
+                if codec is not None and cles_niveaux is not None:
+                    entree['reference'] = list(codec.decoder_tuple(cles_niveaux[reference]))
+            description.append(entree)
+        return description
+
+    def afficher(self, codec=None, cles_niveaux=None, limite=10):
+        """Affiche le nombre de composantes et les composantes flottantes (les limite premières)."""
+        print(f"{self.nombre} composante(s) connexe(s), dont {self.nombre_flottantes} flottante(s) "
+              f"(énergies définies à une constante près, sans transition vers le fondamental fixé).")
+        for entree in self.decrire(codec, cles_niveaux)[:limite]:
+            ancre = (f"ancrée au niveau {entree['reference']}" if self.ancrage == 'reference'
+                     else "énergie moyenne nulle (régularisation)")
+            print(f"- composante {entree['composante']} : {entree['niveaux']} niveaux, "
+                  f"{entree['transitions']} transitions, {ancre}")
+        if self.nombre_flottantes > limite:
+            print(f"... {self.nombre_flottantes - limite} autres composantes flottantes.")
+
+
+def resoudre_par_composantes(M, y, analyse, methode='creuse', ordonnancement='MMD_AT_PLUS_A',
+                             retourner_factorisation=False):
+    """Résout M x = y sur toutes les composantes en une seule factorisation, après ancrage des flottantes.
+
+    M est bloc-diagonale (à la permutation analyse.ordre près) : la
+    factorisation de la matrice ancrée ne produit aucun remplissage entre
+    composantes, et revient à factoriser chaque bloc. Les variances tirées
+    de la factorisation doivent passer par analyse.corriger_variances
+    (préparée ici en mode 'regularisation').
+    """
+    with etape('ancrage_composantes', lignes=M.shape[0]):
+        M_ancree = analyse.ancrer(M)
+    x, factorisation = resoudre_equations_normales(M_ancree.tocsc(), y, methode=methode,
+                                                   ordonnancement=ordonnancement, retourner_factorisation=True)
+    if analyse.ancrage == 'regularisation' and analyse.nombre_flottantes:
+        x = raffiner(M, y, x, factorisation, analyse)
+        analyse.preparer_covariances(M)
+    return (x, factorisation) if retourner_factorisation else x
+
+
+def raffiner(M, y, x, factorisation, analyse):
+    """Tikhonov itéré : x += (M + λ)⁻¹ (y - M x), puis énergie moyenne nulle sur chaque composante flottante.
+
+    M peut être une matrice ou tout objet qui applique M par @ (LinearOperator).
+    """
+    if hasattr(factorisation, 'resoudre'):
+        resoudre = factorisation.resoudre
+    else:
+        def resoudre(r):
+            return cho_solve(factorisation, r)
+    for _ in range(ITERATIONS_RAFFINEMENT):
+        x = x + resoudre(y - M @ x)
+    return analyse.fixer_jauge(x)
@@ -1,19 +1,41 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash
+import threading
+import time
+import uuid
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, g, Response
+from jinja2 import TemplateNotFound
 import pandas as pd
-import sqlite3
+import numpy as np
 import json
 import networkx as nx
 from pyvis.network import Network
 import ast
+import schema
+from ingestion import inserer_transitions_en_masse
+from mise_a_jour import EnergiesIncrementales
+from assemblage import etiqueter_composantes, enregistrer_composantes, numeros_niveaux
+from ancrage import AnalyseComposantes, resoudre_par_composantes
+from cache_niveaux import CacheSysteme
+from inversion_selective import inverser_selectivement
+from taches import FileTaches
+from acces_donnees import AccesDonnees
+from instrumentation import INSTRUMENTATION, etape
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['TEMPLATES_AUTO_RELOAD'] = True  # Les pages des graphes sont écrites par les tâches d'arrière-plan
+
+# Accès partagé à marvel.db : une connexion de lecture par thread, écritures par un seul écrivain (mode WAL)
+donnees = AccesDonnees('marvel.db')
 
 # Nom du fichier JSON contenant les noms des nombres quantiques
 QNAMES_FILE = 'Qnames.json'
 
+# Pages PyVis des tâches 'graphe' (une par tâche, sous templates/) et nombre de pages conservées
+REPERTOIRE_GRAPHES = os.path.join('templates', 'graphes')
+GRAPHES_CONSERVES = 5
+
 # Fonction pour charger les noms des nombres quantiques
 def load_quantum_names():
     if os.path.exists(QNAMES_FILE):
@@ -29,35 +51,179 @@ def load_quantum_names():
         print(f"Erreur : Le fichier '{QNAMES_FILE}' est introuvable.")
         return None
 
-# Fonction pour convertir les nombres quantiques en JSON
-def convert_to_json(quantum_numbers_str):
-    if not quantum_numbers_str or pd.isna(quantum_numbers_str):
-        return json.dumps([])
-    try:
-        quantum_numbers = list(map(int, quantum_numbers_str.split(' ')))
-        return json.dumps(quantum_numbers)
-    except ValueError:
-        print(f"Erreur : Impossible de convertir '{quantum_numbers_str}' en nombres quantiques.")
-        return json.dumps([])
+# Énergies tenues à jour après chaque téléversement (créées au premier téléversement)
+energies_incrementales = None
 
-# Fonction pour créer la table transitions si elle n'existe pas
-def create_transitions_table():
-    conn = sqlite3.connect('marvel.db')
+# Fonction pour mettre à jour les énergies après une insertion, sans tout refactoriser
+def update_energies(conn):
+    global energies_incrementales
+    with open(QNAMES_FILE, 'r') as f:
+        fondamental = tuple(json.load(f)['ground_state_numbers'])
     cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transitions (
-            id INTEGER PRIMARY KEY,
-            wavenumber REAL,
-            uncertainty REAL,
-            quantum_numbers_up TEXT,
-            quantum_numbers_low TEXT,
-            line_status INTEGER,
-            src_status INTEGER,
-            src TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with etape('mise_a_jour_energies'):
+        if energies_incrementales is None:
+            energies_incrementales = EnergiesIncrementales(cursor, fondamental)
+            energies = energies_incrementales.solveur.resoudre()
+        else:
+            energies = energies_incrementales.actualiser(cursor)
+    energies_incrementales.sauvegarder(energies)
+    return energies
+
+# Fonction pour créer la table transitions si elle n'existe pas (ou migrer une base existante)
+def create_transitions_table():
+    quantum_names = load_quantum_names()
+    if not quantum_names:
+        raise RuntimeError(f"Impossible de créer la table transitions sans '{QNAMES_FILE}'.")
+    donnees.ecrire_et_attendre(schema.create_transitions_table, quantum_names)
+
+# Tâche d'arrière-plan : lecture du fichier, insertion en masse puis mise à jour des énergies
+def ingestion_fichier(rapporter, chemin):
+    rapporter(0.05, "Lecture du fichier")
+    try:
+        with etape('lecture_fichier') as mesure:
+            df = pd.read_csv(chemin) if chemin.endswith('.csv') else pd.read_excel(chemin)
+            mesure['lignes'] = len(df)
+    finally:
+        os.remove(chemin)  # Copie propre à cette tâche, lue une seule fois
+
+    quantum_names = load_quantum_names()
+
+    # Exécuté par l'écrivain unique : les téléversements simultanés sont sérialisés
+    def inserer_et_actualiser(conn):
+        # Insérer les données dans la table transitions en une seule transaction
+        nombre_inseres, lignes_rejetees = inserer_transitions_en_masse(conn, df, quantum_names)
+        resultat = {'inseres': nombre_inseres, 'rejetees': len(lignes_rejetees)}
+
+        # Mettre à jour les énergies (mise à jour de rang faible du facteur de Cholesky)
+        rapporter(0.7, "Mise à jour des énergies")
+        try:
+            resultat['niveaux'] = len(update_energies(conn))
+        except (ValueError, np.linalg.LinAlgError) as e:
+            resultat['erreur_energies'] = str(e)
+        return resultat
+
+    rapporter(0.3, f"Insertion de {len(df)} lignes")
+    return donnees.ecrire_et_attendre(inserer_et_actualiser)
+
+# Tâche d'arrière-plan : étiquetage des composantes connexes et remplissage de la table components
+def etiquetage_composantes(rapporter):
+    rapporter(0.1, "Numérotation des niveaux")
+    _, cles_niveaux, idx_up, idx_low, transitions = CacheSysteme(donnees.lecture().cursor()).niveaux()
+    rapporter(0.5, "Étiquetage des composantes")
+    nombre_composantes, _, etiquettes_transitions = etiqueter_composantes(idx_up, idx_low, cles_niveaux.shape[0])
+    donnees.ecrire_et_attendre(enregistrer_composantes, transitions['id'], etiquettes_transitions)
+    return {'nombre_composantes': int(nombre_composantes)}
+
+# Tâche d'arrière-plan : résolution complète (énergies et incertitudes des niveaux)
+def resolution_energies(rapporter, ground_energy_status=0):
+    with open(QNAMES_FILE, 'r') as f:
+        fondamental = tuple(json.load(f)['ground_state_numbers'])
+    rapporter(0.1, "Assemblage des équations normales")
+    cache = CacheSysteme(donnees.lecture().cursor(), fondamental=fondamental,
+                         exclure_fondamental=(ground_energy_status == 0))
+    M, y = cache.equations_normales()
+    codec, cles_niveaux, idx_up, idx_low, _ = cache.niveaux()
+    analyse = AnalyseComposantes(idx_up, idx_low, cles_niveaux.shape[0], cles_niveaux=cles_niveaux,
+                                 references=numeros_niveaux(codec, cles_niveaux, [fondamental]))
+    rapporter(0.4, "Factorisation de Cholesky")
+    x, factorisation = resoudre_par_composantes(M, y, analyse, retourner_factorisation=True)
+    rapporter(0.8, "Incertitudes des niveaux")
+    np.savetxt('energies.txt', x)
+    np.savetxt('incertitudes.txt', np.sqrt(analyse.corriger_variances(inverser_selectivement(factorisation).variances())))
+    return {'niveaux': int(x.shape[0]), 'fichiers': ['energies.txt', 'incertitudes.txt'],
+            'composantes_flottantes': analyse.decrire(codec, cles_niveaux)}
+
+# Tâche d'arrière-plan : construction du graphe et génération du fichier PyVis
+def generation_graphe(rapporter):
+    # Récupérer les transitions (connexion de lecture du thread, non bloquée par une insertion en cours)
+    cursor = donnees.lecture().cursor()
+    with etape('lecture_transitions') as mesure:
+        cursor.execute("SELECT id, wavenumber, quantum_numbers_up, quantum_numbers_low FROM transitions")
+        transitions = cursor.fetchall()
+        mesure['lignes'] = len(transitions)
+
+    if not transitions:
+        raise ValueError("Aucune transition trouvée dans la base de données.")
+
+    # Créer un graphe orienté
+    rapporter(0.2, f"Construction du graphe ({len(transitions)} transitions)")
+    G = nx.DiGraph()
+
+    with etape('graphe_networkx', lignes=len(transitions)):
+        # Ajouter les transitions au graphe
+        for transition in transitions:
+            id_transition, wavenumber, quantum_numbers_up, quantum_numbers_low = transition
+
+            try:
+                quantum_numbers_low = ast.literal_eval(quantum_numbers_low)
+                quantum_numbers_up = ast.literal_eval(quantum_numbers_up)
+
+                if isinstance(quantum_numbers_low, list):
+                    quantum_numbers_low = tuple(quantum_numbers_low)
+                if isinstance(quantum_numbers_up, list):
+                    quantum_numbers_up = tuple(quantum_numbers_up)
+            except (ValueError, SyntaxError):
+                pass
+
+            quantum_numbers_low_str = str(quantum_numbers_low)
+            quantum_numbers_up_str = str(quantum_numbers_up)
+
+            if quantum_numbers_low_str not in G:
+                G.add_node(quantum_numbers_low_str, label=quantum_numbers_low_str)
+            if quantum_numbers_up_str not in G:
+                G.add_node(quantum_numbers_up_str, label=quantum_numbers_up_str)
+
+            G.add_edge(quantum_numbers_low_str, quantum_numbers_up_str, weight=wavenumber, id=id_transition)
+
+    # Nombre de composantes connexes
+    composantes_connexes = list(nx.weakly_connected_components(G))
+    nombre_composantes = len(composantes_connexes)
+
+    # Générer le graphe PyVis
+    rapporter(0.6, "Génération du fichier PyVis")
+    with etape('graphe_pyvis', lignes=len(transitions)):
+        net = Network(notebook=True, directed=True, cdn_resources='remote')
+        for nœud, données in G.nodes(data=True):
+            net.add_node(nœud, label=données.get("label", nœud))
+        for départ, arrivée, données in G.edges(data=True):
+            net.add_edge(départ, arrivée, value=données["weight"], title=f"Transition {données['id']}\nWavenumber: {données['weight']}")
+
+        # Page propre à la tâche (deux tâches peuvent s'exécuter en même temps), servie seulement une fois
+        # la tâche terminée : elle n'est jamais lue à moitié écrite
+        os.makedirs(REPERTOIRE_GRAPHES, exist_ok=True)
+        nom = f"graphe.{os.getpid()}.{threading.get_ident()}.{time.time_ns()}.html"
+        net.write_html(os.path.join(REPERTOIRE_GRAPHES, nom))
+    evincer_graphes()
+    return {'nombre_composantes': nombre_composantes, 'page': f"graphes/{nom}"}
+
+# Supprime les pages de graphe les plus anciennes au-delà de GRAPHES_CONSERVES
+def evincer_graphes():
+    pages = sorted((entree.stat().st_mtime, entree.path) for entree in os.scandir(REPERTOIRE_GRAPHES)
+                   if entree.name.endswith('.html'))
+    for _, chemin in pages[:-GRAPHES_CONSERVES]:
+        try:
+            os.remove(chemin)
+        except FileNotFoundError:
+            pass
+
+# File des tâches d'arrière-plan
+file_taches = FileTaches()
+file_taches.enregistrer_type('ingestion', ingestion_fichier)
+file_taches.enregistrer_type('composantes', etiquetage_composantes)
+file_taches.enregistrer_type('resolution', resolution_energies)
+file_taches.enregistrer_type('graphe', generation_graphe)
+
+# Mesure de chaque requête HTTP, agrégée par route (étape 'route:<nom de la vue>')
+@app.before_request
+def debut_mesure_route():
+    g.mesure_route = etape(f"route:{request.endpoint or 'inconnue'}")
+    g.mesure_route.__enter__()
+
+@app.teardown_request
+def fin_mesure_route(erreur=None):
+    mesure_route = g.pop('mesure_route', None)
+    if mesure_route is not None:
+        mesure_route.__exit__(type(erreur) if erreur else None, erreur, None)
 
 # Route pour la page d'accueil (téléversement de fichiers)
 @app.route('/', methods=['GET', 'POST'])
@@ -74,109 +240,82 @@ def index():
             flash("Aucun fichier sélectionné.", "error")
             return redirect(request.url)
 
-        if file and file.filename.endswith('.xlsx'):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+        if file and file.filename.endswith(('.xlsx', '.csv')):
+            # Nom unique : un téléversement homonyme ne peut pas écraser un fichier encore en attente
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'],
+                                    uuid.uuid4().hex + os.path.splitext(file.filename)[1])
             file.save(filepath)
 
-            # Charger les données Excel
-            df = pd.read_excel(filepath)
-
-            # Connexion à la base de données
-            conn = sqlite3.connect('marvel.db')
-            cursor = conn.cursor()
-
-            # Insérer les données dans la table transitions
-            for index, row in df.iterrows():
-                id_value = row.get('id')
-                wavenumber = row['wavenumber']
-                uncertainty = row.get('uncertainty', 0.0)
-                quantum_numbers_up = convert_to_json(row.get('quantum_numbers_up', ''))
-                quantum_numbers_low = convert_to_json(row.get('quantum_numbers_low', ''))
-                line_status = row.get('line_status', 0)
-                src_status = row.get('src_status', 0)
-                src = row.get('src', '')
-
-                if id_value is not None:
-                    cursor.execute('''
-                        INSERT INTO transitions (id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (id_value, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src))
-                else:
-                    cursor.execute('''
-                        INSERT INTO transitions (wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src))
-
-            conn.commit()
-            conn.close()
-            flash("Données insérées avec succès !", "success")
+            # Lecture et insertion en arrière-plan : la requête retourne immédiatement
+            id_tache = file_taches.soumettre('ingestion', chemin=filepath)
+            flash(f"Fichier reçu : insertion des transitions en cours (tâche {id_tache}).", "success")
             show_graph_button = True  # Afficher le bouton après un téléversement réussi
             return render_template('index.html', show_graph_button=show_graph_button)
 
         else:
-            flash("Format de fichier non supporté. Veuillez téléverser un fichier Excel (.xlsx).", "error")
+            flash("Format de fichier non supporté. Veuillez téléverser un fichier Excel (.xlsx) ou CSV (.csv).", "error")
             return redirect(request.url)
 
     return render_template('index.html', show_graph_button=show_graph_button)
 
-# Route pour afficher le graphe et les informations
-@app.route('/graph')
-def graph():
-    # Connexion à la base de données
-    conn = sqlite3.connect("marvel.db")
-    cursor = conn.cursor()
-
-    # Récupérer les transitions
-    cursor.execute("SELECT id, wavenumber, quantum_numbers_up, quantum_numbers_low FROM transitions")
-    transitions = cursor.fetchall()
-    conn.close()
-
-    if not transitions:
-        flash("Aucune transition trouvée dans la base de données.", "error")
-        return redirect(url_for('index'))
-
-    # Créer un graphe orienté
-    G = nx.DiGraph()
-
-    # Ajouter les transitions au graphe
-    for transition in transitions:
-        id_transition, wavenumber, quantum_numbers_up, quantum_numbers_low = transition
-
-        try:
-            quantum_numbers_low = ast.literal_eval(quantum_numbers_low)
-            quantum_numbers_up = ast.literal_eval(quantum_numbers_up)
-
-            if isinstance(quantum_numbers_low, list):
-                quantum_numbers_low = tuple(quantum_numbers_low)
-            if isinstance(quantum_numbers_up, list):
-                quantum_numbers_up = tuple(quantum_numbers_up)
-        except (ValueError, SyntaxError):
-            pass
-
-        quantum_numbers_low_str = str(quantum_numbers_low)
-        quantum_numbers_up_str = str(quantum_numbers_up)
-
-        if quantum_numbers_low_str not in G:
-            G.add_node(quantum_numbers_low_str, label=quantum_numbers_low_str)
-        if quantum_numbers_up_str not in G:
-            G.add_node(quantum_numbers_up_str, label=quantum_numbers_up_str)
+# Route pour l'état des dernières tâches (interrogée périodiquement par la page d'accueil)
+@app.route('/taches')
+def liste_taches():
+    return jsonify(file_taches.taches(limite=request.args.get('limite', 20, type=int)))
 
-        G.add_edge(quantum_numbers_low_str, quantum_numbers_up_str, weight=wavenumber, id=id_transition)
+# Route pour l'état et la progression d'une tâche
+@app.route('/taches/<int:id_tache>')
+def etat_tache(id_tache):
+    tache = file_taches.tache(id_tache)
+    if tache is None:
+        abort(404)
+    return jsonify(tache)
 
-    # Nombre de composantes connexes
-    composantes_connexes = list(nx.weakly_connected_components(G))
-    nombre_composantes = len(composantes_connexes)
+# Route pour lancer l'étiquetage des composantes ou une résolution en arrière-plan
+@app.route('/taches/<type_tache>', methods=['POST'])
+def lancer_tache(type_tache):
+    if type_tache == 'composantes':
+        id_tache = file_taches.soumettre('composantes')
+    elif type_tache == 'resolution':
+        id_tache = file_taches.soumettre('resolution', ground_energy_status=request.form.get('ground_energy_status', 0, type=int))
+    else:
+        abort(404)
+    return jsonify({'id': id_tache, 'etat': url_for('etat_tache', id_tache=id_tache)}), 202
 
-    # Générer le graphe PyVis
-    net = Network(notebook=True, directed=True, cdn_resources='remote')
-    for nœud, données in G.nodes(data=True):
-        net.add_node(nœud, label=données.get("label", nœud))
-    for départ, arrivée, données in G.edges(data=True):
-        net.add_edge(départ, arrivée, value=données["weight"], title=f"Transition {données['id']}\nWavenumber: {données['weight']}")
+# Route pour afficher le graphe : sa génération est confiée à une tâche d'arrière-plan
+@app.route('/graph')
+def graph():
+    # Une génération déjà en attente ou en cours est reprise plutôt que dupliquée
+    id_tache = file_taches.soumettre_unique('graphe')
+    return redirect(url_for('graphe_tache', id_tache=id_tache))
 
-    net.write_html("templates/graph.html")
+# Route pour afficher le graphe d'une tâche, ou une page d'attente tant qu'elle n'est pas terminée
+@app.route('/graph/<int:id_tache>')
+def graphe_tache(id_tache):
+    tache = file_taches.tache(id_tache)
+    if tache is None or tache['type'] != 'graphe':
+        abort(404)
+    if tache['statut'] == 'terminee':
+        # Chaque tâche sert sa propre page ; celle d'une tâche ancienne a pu être supprimée
+        page = tache['resultat'].get('page')
+        if page and os.path.exists(os.path.join('templates', page)):
+            try:
+                return render_template(page, nombre_composantes=tache['resultat']['nombre_composantes'])
+            except TemplateNotFound:
+                pass
+        flash("Ce graphe a été remplacé par une génération plus récente.", "error")
+        return redirect(url_for('graph'))
+    if tache['statut'] in ('echouee', 'interrompue'):
+        flash(f"Impossible de générer le graphe : {tache['message']}", "error")
+        return redirect(url_for('index'))
+    return render_template('attente.html', tache=tache)
 
-    return render_template('graph.html', nombre_composantes=nombre_composantes)
+# Route des métriques par étape : texte Prometheus par défaut, JSON avec ?format=json
+@app.route('/metrics')
+def metriques():
+    if request.args.get('format') == 'json':
+        return jsonify(INSTRUMENTATION.metriques())
+    return Response(INSTRUMENTATION.format_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
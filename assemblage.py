@@ -0,0 +1,374 @@
+import json
+import warnings
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from codec_niveaux import CodecNiveaux
+from instrumentation import etape
+
+# Requête par défaut : toutes les transitions, dans l'ordre de la table
+REQUETE_TRANSITIONS = 'SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low FROM transitions'
+
+
+def _parser_nombres_quantiques(textes):
+    """Convertit une colonne de listes JSON ("[0, 1, 2]") en tableau d'entiers (n, k).
+
+    Toutes les chaînes sont concaténées puis lues en une seule passe par NumPy.
+    Les valeurs manquantes (NULL) sont écartées de la lecture et marquées
+    invalides. Si une chaîne est invalide ou si les listes n'ont pas toutes
+    le même nombre de virgules, on se replie sur json.loads ligne par ligne.
+    Retourne (tableau, valide) où valide marque les lignes correctement lues.
+    """
+    n = len(textes)
+    if n == 0:
+        return np.zeros((0, 0), dtype=np.int64), np.zeros(0, dtype=bool)
+
+    chaines = np.fromiter((isinstance(texte_ligne, str) for texte_ligne in textes), dtype=bool, count=n)
+    textes_chaines = [texte_ligne for texte_ligne in textes if isinstance(texte_ligne, str)]
+    if textes_chaines:
+        # Le total des valeurs ne suffit pas : chaque liste doit avoir exactement k - 1 virgules
+        virgules = np.fromiter((texte_ligne.count(',') for texte_ligne in textes_chaines), dtype=np.int64,
+                               count=len(textes_chaines))
+        k = int(virgules[0]) + 1
+        if np.all(virgules == k - 1):
+            texte = ','.join(textes_chaines).translate(str.maketrans('', '', '[]'))
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error', DeprecationWarning)  # Lecture partielle = échec
+                    valeurs = np.fromstring(texte, dtype=np.int64, sep=',')
+                if valeurs.shape[0] == len(textes_chaines) * k:
+                    tableau = np.zeros((n, k), dtype=np.int64)
+                    tableau[chaines] = valeurs.reshape(-1, k)
+                    for texte_ligne in np.asarray(textes, dtype=object)[~chaines]:
+                        print(f"Erreur : Impossible de parser les nombres quantiques : {texte_ligne}")
+                    return tableau, chaines
+            except (ValueError, DeprecationWarning):
+                pass
+
+    # Repli : lecture ligne par ligne pour isoler les enregistrements invalides
+    listes = []
+    for texte_ligne in textes:
+        try:
+            listes.append(json.loads(texte_ligne))
+        except (json.JSONDecodeError, TypeError):
+            print(f"Erreur : Impossible de parser les nombres quantiques : {texte_ligne}")
+            listes.append(None)
+    k = max((len(liste) for liste in listes if liste), default=0)
+    tableau = np.zeros((n, k), dtype=np.int64)
+    valide = np.zeros(n, dtype=bool)
+    for i, liste in enumerate(listes):
+        if liste and len(liste) == k:
+            tableau[i] = liste
+            valide[i] = True
+    return tableau, valide
+
+
+def _colonnes_entieres(cursor):
+    """Colonnes INTEGER des nombres quantiques (schéma version 2), ou None si absentes."""
+    colonnes = [ligne[1] for ligne in cursor.execute('PRAGMA table_info(transitions)')]
+    colonnes_up = [c for c in colonnes if c.startswith('up_')]
+    colonnes_low = [c for c in colonnes if c.startswith('low_')]
+    if colonnes_up and len(colonnes_up) == len(colonnes_low):
+        return colonnes_up, colonnes_low
+    return None
+
+
+def lire_transitions(cursor, requete=None, parametres=()):
+    """Lit les transitions en une seule requête et les range dans des tableaux NumPy.
+
+    Sans requête explicite, les colonnes entières du schéma version 2 sont lues
+    directement, sans aucun parsing. Sinon (ou pour une base non migrée), la
+    requête doit retourner, dans l'ordre : id, wavenumber, uncertainty,
+    quantum_numbers_up, quantum_numbers_low.
+    """
+    colonnes = _colonnes_entieres(cursor) if requete is None else None
+    if colonnes is not None:
+        colonnes_up, colonnes_low = colonnes
+        with etape('lecture_transitions') as mesure:
+            cursor.execute(f'SELECT id, wavenumber, uncertainty, {", ".join(colonnes_up + colonnes_low)} FROM transitions')
+            rows = cursor.fetchall()
+            mesure['lignes'] = len(rows)
+        k = len(colonnes_up)
+        valeurs = np.array(rows, dtype=object).reshape(-1, 3 + 2 * k)
+        nombres = valeurs[:, 3:]
+        valide = ~np.any(nombres == None, axis=1)  # noqa: E711 (comparaison élément par élément)
+        nombres[~valide] = 0
+        nombres = nombres.astype(np.int64)
+        return {
+            'id': valeurs[:, 0].astype(np.int64),
+            'wavenumber': valeurs[:, 1].astype(float),
+            'uncertainty': valeurs[:, 2].astype(float),
+            'qn_up': nombres[:, :k],
+            'qn_low': nombres[:, k:],
+            'valide': valide,
+        }
+
+    with etape('lecture_transitions') as mesure:
+        cursor.execute(requete or REQUETE_TRANSITIONS, parametres)
+        rows = cursor.fetchall()
+        mesure['lignes'] = len(rows)
+    ids, wavenumbers, uncertainties, textes_up, textes_low = zip(*rows) if rows else ((),) * 5
+    with etape('parsing_nombres_quantiques', lignes=len(rows)):
+        qn_up, valide_up = _parser_nombres_quantiques(textes_up)
+        qn_low, valide_low = _parser_nombres_quantiques(textes_low)
+    if qn_up.shape[1] != qn_low.shape[1] and rows:
+        raise ValueError("Les nombres quantiques supérieurs et inférieurs n'ont pas la même longueur.")
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'wavenumber': np.array(wavenumbers, dtype=float),
+        'uncertainty': np.array(uncertainties, dtype=float),
+        'qn_up': qn_up,
+        'qn_low': qn_low,
+        'valide': valide_up & valide_low,
+    }
+
+
+def indexer_niveaux(cles_up, cles_low, valide=None, cle_fondamental=None, exclure_fondamental=False):
+    """Attribue un numéro séquentiel à chaque niveau d'énergie, sans dictionnaire Python.
+
+    Les niveaux sont identifiés par leur clé int64 (voir CodecNiveaux) et
+    numérotés dans l'ordre de leur première apparition (supérieur puis
+    inférieur, transition par transition), comme le faisait le bidictionnaire
+    niveaux_energie. Si exclure_fondamental est vrai, le niveau fondamental ne
+    reçoit pas de numéro.
+
+    Retourne (cles_niveaux, idx_up, idx_low) : cles_niveaux[numero] est la clé du
+    niveau, idx_up/idx_low le numéro des niveaux de chaque transition (-1 pour
+    un niveau non numéroté).
+    """
+    nombre_transitions = cles_up.shape[0]
+    if valide is None:
+        valide = np.ones(nombre_transitions, dtype=bool)
+
+    # Entrelacer up/low pour respecter l'ordre de première apparition
+    entrelaces = np.empty(2 * nombre_transitions, dtype=np.int64)
+    entrelaces[0::2] = cles_up
+    entrelaces[1::2] = cles_low
+    retenus = np.repeat(valide, 2)
+    if exclure_fondamental and cle_fondamental is not None:
+        retenus &= entrelaces != cle_fondamental
+
+    cles = entrelaces[retenus]
+    _, premiere, inverse = np.unique(cles, return_index=True, return_inverse=True)
+    ordre = np.argsort(premiere)
+    rang = np.empty_like(ordre)
+    rang[ordre] = np.arange(ordre.shape[0])
+
+    numeros = np.full(2 * nombre_transitions, -1, dtype=np.int64)
+    numeros[retenus] = rang[inverse.ravel()]
+    return cles[premiere[ordre]], numeros[0::2], numeros[1::2]
+
+
+def numeroter_niveaux(transitions, fondamental=None, exclure_fondamental=False, codec=None):
+    """Code les niveaux des transitions lues par lire_transitions puis les numérote.
+
+    Le codec est construit à partir de Qnames.json et des bornes observées
+    s'il n'est pas fourni. Retourne (codec, cles_niveaux, idx_up, idx_low).
+    """
+    valide = transitions['valide']
+    qn_up = transitions['qn_up']
+    qn_low = transitions['qn_low']
+    with etape('numerotation_niveaux', lignes=qn_up.shape[0]):
+        if codec is None:
+            codec = CodecNiveaux.depuis_qnames(qn_up[valide], qn_low[valide])
+
+        # Les lignes invalides reçoivent la clé du minimum, elles sont ignorées par valide
+        cles_up = np.zeros(qn_up.shape[0], dtype=np.int64)
+        cles_low = np.zeros(qn_low.shape[0], dtype=np.int64)
+        cles_up[valide] = codec.encoder(qn_up[valide])
+        cles_low[valide] = codec.encoder(qn_low[valide])
+        cle_fondamental = codec.encoder_tuple(fondamental) if fondamental is not None else None
+
+        cles_niveaux, idx_up, idx_low = indexer_niveaux(cles_up, cles_low, valide, cle_fondamental=cle_fondamental,
+                                                        exclure_fondamental=exclure_fondamental)
+    return codec, cles_niveaux, idx_up, idx_low
+
+
+def numeros_depuis_cles(cles_niveaux, cles):
+    """Numéro de chaque clé dans cles_niveaux, -1 si la clé est absente."""
+    cles = np.asarray(cles, dtype=np.int64)
+    if cles_niveaux.shape[0] == 0:
+        return np.full(cles.shape[0], -1, dtype=np.int64)
+    ordre = np.argsort(cles_niveaux)
+    numeros = ordre[np.minimum(np.searchsorted(cles_niveaux, cles, sorter=ordre), cles_niveaux.shape[0] - 1)]
+    return np.where(cles_niveaux[numeros] == cles, numeros, -1)
+
+
+def numeros_niveaux(codec, cles_niveaux, niveaux):
+    """Numéro (colonne de A) de chaque niveau donné par ses nombres quantiques, -1 s'il est absent."""
+    return numeros_depuis_cles(cles_niveaux, codec.encoder(np.asarray(niveaux, dtype=np.int64)))
+
+
+def construire_matrice_design(idx_up, idx_low, nombre_niveaux):
+    """Construit directement la matrice de design CSR (indptr/indices/data).
+
+    Chaque ligne contient +1 pour le niveau supérieur et -1 pour le niveau
+    inférieur ; un indice -1 (niveau exclu) ne produit aucun élément.
+    """
+    nombre_transitions = idx_up.shape[0]
+    with etape('matrice_design', lignes=nombre_transitions) as mesure:
+        colonnes = np.column_stack((idx_up, idx_low))
+        valeurs = np.tile(np.array([1.0, -1.0]), (nombre_transitions, 1))
+
+        # Une transition d'un niveau vers lui-même donne une ligne nulle
+        identiques = idx_up == idx_low
+        colonnes[identiques] = -1
+
+        # Trier les deux éléments de chaque ligne par colonne croissante
+        inverser = colonnes[:, 0] > colonnes[:, 1]
+        colonnes[inverser] = colonnes[inverser][:, ::-1]
+        valeurs[inverser] = valeurs[inverser][:, ::-1]
+
+        presents = colonnes >= 0
+        indptr = np.zeros(nombre_transitions + 1, dtype=np.int64)
+        np.cumsum(presents.sum(axis=1), out=indptr[1:])
+        A = csr_matrix((valeurs[presents], colonnes[presents], indptr), shape=(nombre_transitions, nombre_niveaux))
+        mesure['nnz'] = A.nnz
+    return A
+
+
+def etiqueter_composantes(idx_up, idx_low, nombre_niveaux):
+    """Étiquette les composantes connexes du réseau de niveaux avec scipy.sparse.csgraph.
+
+    Le graphe est la matrice d'adjacence entière niveau inférieur -> niveau
+    supérieur ; les composantes sont faiblement connexes et numérotées dans
+    l'ordre du plus petit numéro de niveau qu'elles contiennent, c'est-à-dire
+    dans l'ordre de première apparition. Retourne (nombre_composantes,
+    etiquettes_niveaux, etiquettes_transitions), avec -1 pour une transition
+    dont un niveau n'est pas numéroté.
+    """
+    presentes = (idx_up >= 0) & (idx_low >= 0)
+    with etape('composantes_connexes', lignes=idx_up.shape[0]) as mesure:
+        adjacence = coo_matrix((np.ones(np.count_nonzero(presentes), dtype=np.int8),
+                                (idx_low[presentes], idx_up[presentes])),
+                               shape=(nombre_niveaux, nombre_niveaux))
+        mesure['nnz'] = adjacence.nnz
+        nombre_composantes, etiquettes = connected_components(adjacence, directed=True, connection='weak')
+    etiquettes_transitions = np.full(idx_up.shape[0], -1, dtype=np.int64)
+    etiquettes_transitions[presentes] = etiquettes[idx_up[presentes]]
+    return nombre_composantes, etiquettes, etiquettes_transitions
+
+
+def enregistrer_composantes(conn, ids, etiquettes_transitions):
+    """Peuple la table components (numérotées à partir de 1) en une seule requête ensembliste.
+
+    Les étiquettes sont d'abord chargées dans une table temporaire, puis jointes
+    à la table transitions ; les transitions d'étiquette -1 sont ignorées.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS components (
+        id INTEGER PRIMARY KEY,
+        wavenumber REAL,
+        uncertainty REAL,
+        quantum_numbers_up TEXT,
+        quantum_numbers_low TEXT,
+        line_status INTEGER,
+        src_status INTEGER,
+        src TEXT,
+        component INTEGER
+    )
+    """)
+    retenues = etiquettes_transitions >= 0
+    with etape('ecriture_composantes', lignes=int(np.count_nonzero(retenues))), conn:
+        conn.execute("DELETE FROM components")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS etiquettes_composantes (id INTEGER PRIMARY KEY, component INTEGER)")
+        conn.execute("DELETE FROM etiquettes_composantes")
+        conn.executemany("INSERT INTO etiquettes_composantes (id, component) VALUES (?, ?)",
+                         zip(np.asarray(ids)[retenues].tolist(), (etiquettes_transitions[retenues] + 1).tolist()))
+        conn.execute("""
+        INSERT INTO components (id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src, component)
+        SELECT t.id, t.wavenumber, t.uncertainty, t.quantum_numbers_up, t.quantum_numbers_low, t.line_status, t.src_status, t.src, e.component
+        FROM transitions AS t JOIN etiquettes_composantes AS e ON e.id = t.id
+        """)
+
+
+class MotifNormal:
+    """Motif creux de M = Aᵀ W A, précalculé à partir des indices de niveaux des transitions.
+
+    Chaque transition contribue +w en (up, up) et (low, low), -w en (up, low)
+    et (low, up), et ±w b au second membre y. Le motif CSR (indptr/indices) et
+    la position de chaque contribution dans le tableau data sont calculés une
+    seule fois : assembler M pour de nouveaux poids se réduit alors à un
+    np.bincount, sans former A ni W. Un indice -1 (niveau exclu, par exemple
+    le fondamental fixé) ne produit aucune contribution, comme dans
+    construire_matrice_design.
+    """
+
+    def __init__(self, idx_up, idx_low, nombre_niveaux):
+        self.idx_up = np.asarray(idx_up, dtype=np.int64)
+        self.idx_low = np.asarray(idx_low, dtype=np.int64)
+        self.nombre_niveaux = nombre_niveaux
+
+        # Une transition d'un niveau vers lui-même donne une ligne nulle de A
+        actives = self.idx_up != self.idx_low
+        self._avec_up = actives & (self.idx_up >= 0)
+        self._avec_low = actives & (self.idx_low >= 0)
+        self._croisees = self._avec_up & self._avec_low
+
+        up, low = self.idx_up, self.idx_low
+        lignes = np.concatenate((up[self._avec_up], low[self._avec_low], up[self._croisees], low[self._croisees]))
+        colonnes = np.concatenate((up[self._avec_up], low[self._avec_low], low[self._croisees], up[self._croisees]))
+        cles, self._positions = np.unique(lignes * nombre_niveaux + colonnes, return_inverse=True)
+        self._positions = self._positions.ravel()
+
+        self.indices = cles % nombre_niveaux
+        self.indptr = np.zeros(nombre_niveaux + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cles // nombre_niveaux, minlength=nombre_niveaux), out=self.indptr[1:])
+
+    @property
+    def nnz(self):
+        return self.indices.shape[0]
+
+    def tableaux(self):
+        """Tableaux qui définissent le motif, pour le reconstruire ailleurs sans recalcul (mémoire partagée)."""
+        return {'idx_up': self.idx_up, 'idx_low': self.idx_low, 'avec_up': self._avec_up, 'avec_low': self._avec_low,
+                'croisees': self._croisees, 'positions': self._positions, 'indices': self.indices,
+                'indptr': self.indptr}
+
+    @classmethod
+    def depuis_tableaux(cls, tableaux, nombre_niveaux):
+        """Reconstruit un motif à partir des tableaux de tableaux(), sans les copier."""
+        motif = cls.__new__(cls)
+        motif.nombre_niveaux = nombre_niveaux
+        motif.idx_up, motif.idx_low = tableaux['idx_up'], tableaux['idx_low']
+        motif._avec_up, motif._avec_low = tableaux['avec_up'], tableaux['avec_low']
+        motif._croisees, motif._positions = tableaux['croisees'], tableaux['positions']
+        motif.indices, motif.indptr = tableaux['indices'], tableaux['indptr']
+        return motif
+
+    def assembler(self, poids):
+        """Retourne M = Aᵀ W A (CSR, indices triés) pour les poids des transitions."""
+        poids = np.asarray(poids, dtype=float)
+        contributions = np.concatenate((poids[self._avec_up], poids[self._avec_low],
+                                        -poids[self._croisees], -poids[self._croisees]))
+        data = np.bincount(self._positions, weights=contributions, minlength=self.nnz)
+        return csr_matrix((data, self.indices, self.indptr), shape=(self.nombre_niveaux, self.nombre_niveaux))
+
+    def appliquer_A(self, x):
+        """Retourne A x (différences d'énergie prédites pour chaque transition)."""
+        resultat = np.zeros(self.idx_up.shape[0])
+        resultat[self._avec_up] += x[self.idx_up[self._avec_up]]
+        resultat[self._avec_low] -= x[self.idx_low[self._avec_low]]
+        return resultat
+
+    def second_membre(self, poids, b):
+        """Retourne y = Aᵀ W b."""
+        wb = np.asarray(poids, dtype=float) * np.asarray(b, dtype=float)
+        y = np.bincount(self.idx_up[self._avec_up], weights=wb[self._avec_up], minlength=self.nombre_niveaux)
+        y -= np.bincount(self.idx_low[self._avec_low], weights=wb[self._avec_low], minlength=self.nombre_niveaux)
+        return y
+
+
+def assembler_equations_normales(idx_up, idx_low, poids, b, nombre_niveaux):
+    """Assemble directement M = Aᵀ W A et y = Aᵀ W b à partir des indices de niveaux.
+
+    Retourne (M, y, motif) ; le motif peut être réutilisé pour réassembler M
+    avec d'autres poids sans recalculer la structure creuse.
+    """
+    with etape('equations_normales', lignes=np.shape(idx_up)[0]) as mesure:
+        motif = MotifNormal(idx_up, idx_low, nombre_niveaux)
+        M = motif.assembler(poids)
+        y = motif.second_membre(poids, b)
+        mesure['nnz'] = M.nnz
+    return M, y, motif
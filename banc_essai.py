@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from acces_donnees import connecter
+from assemblage import (lire_transitions, numeroter_niveaux, construire_matrice_design, assembler_equations_normales,
+                        etiqueter_composantes)
+from cholesky_creux import resoudre_equations_normales
+from codec_niveaux import QNAMES_FILE
+from generateur_reseau import generer_reseau, TRANSITIONS_PAR_NIVEAU
+from ingestion import inserer_transitions_en_masse
+
+# Nombres de lignes (transitions) mesurés par défaut
+TAILLES = (1_000, 10_000, 100_000, 1_000_000)
+
+# Le rendu PyVis (un nœud HTML par niveau) n'est mesuré que jusqu'à cette taille
+TAILLE_MAX_GRAPHE = 100_000
+
+# Répertoire des résultats : un fichier JSON par exécution, nommé d'après le commit
+REPERTOIRE_RESULTATS = 'resultats_banc'
+
+ETAPES = ('ingestion', 'indexation', 'design', 'assemblage', 'factorisation', 'composantes', 'graphe')
+
+
+def _rss_max_mo():
+    """Pic de mémoire résidente du processus depuis son démarrage (Mo)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if platform.system() == 'Darwin' else rss / 1024
+
+
+def mesurer(resultats, taille, etape, fonction, *args):
+    """Exécute fonction(*args), enregistre sa durée et ses pics mémoire, et retourne son résultat.
+
+    pic_python_mo est le pic des allocations suivies par tracemalloc (NumPy
+    compris) ; rss_max_mo est le pic de mémoire résidente du processus, qui
+    couvre aussi les allocations C (SuperLU, SQLite) mais ne redescend jamais.
+    """
+    tracemalloc.start()
+    debut = time.perf_counter()
+    resultat = fonction(*args)
+    duree = time.perf_counter() - debut
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    mesure = {'taille': taille, 'etape': etape, 'duree_s': duree, 'pic_python_mo': pic / 1024 ** 2,
+              'rss_max_mo': _rss_max_mo()}
+    resultats.append(mesure)
+    print(f"{taille:>9} {etape:<14} {duree:9.3f} s {mesure['pic_python_mo']:9.1f} Mo {mesure['rss_max_mo']:9.1f} Mo")
+    return resultat
+
+
+def _ingerer(fichier_csv, fichier_base, quantum_names):
+    df = pd.read_csv(fichier_csv)
+    conn = connecter(fichier_base)
+    try:
+        return inserer_transitions_en_masse(conn, df, quantum_names)[0]
+    finally:
+        conn.close()
+
+
+def _indexer(fichier_base, fondamental):
+    conn = connecter(fichier_base)
+    try:
+        transitions = lire_transitions(conn.cursor())
+    finally:
+        conn.close()
+    return transitions, numeroter_niveaux(transitions, fondamental=fondamental, exclure_fondamental=True)
+
+
+def _rendre_graphe(idx_up, idx_low, wavenumbers, fichier_html):
+    # Import local : networkx et pyvis ne sont nécessaires que pour cette étape
+    import networkx as nx
+    from pyvis.network import Network
+    G = nx.DiGraph()
+    G.add_edges_from(zip(idx_low.tolist(), idx_up.tolist()))
+    net = Network(notebook=True, directed=True, cdn_resources='remote')
+    for noeud in G.nodes:
+        net.add_node(noeud, label=str(noeud))
+    for (depart, arrivee), wavenumber in zip(zip(idx_low.tolist(), idx_up.tolist()), wavenumbers.tolist()):
+        net.add_edge(depart, arrivee, value=wavenumber)
+    net.write_html(fichier_html)
+
+
+def banc_taille(taille, resultats, repertoire, transitions_par_niveau=TRANSITIONS_PAR_NIVEAU, graine=0):
+    """Mesure toutes les étapes pour un réseau synthétique de taille transitions ; retourne l'erreur sur les énergies."""
+    with open(QNAMES_FILE, 'r') as f:
+        qnames_data = json.load(f)
+    fondamental = tuple(qnames_data['ground_state_numbers'])
+
+    nombre_niveaux = max(2, int(taille / transitions_par_niveau))
+    transitions, niveaux = generer_reseau(nombre_niveaux, transitions_par_niveau, graine=graine)
+    fichier_csv = os.path.join(repertoire, f'transitions_{taille}.csv')
+    fichier_base = os.path.join(repertoire, f'banc_{taille}.db')
+    transitions.to_csv(fichier_csv, index=False)
+
+    mesurer(resultats, taille, 'ingestion', _ingerer, fichier_csv, fichier_base, qnames_data['quantum_names'])
+    donnees, (codec, cles_niveaux, idx_up, idx_low) = mesurer(resultats, taille, 'indexation', _indexer,
+                                                              fichier_base, fondamental)
+    n = cles_niveaux.shape[0]
+    mesurer(resultats, taille, 'design', construire_matrice_design, idx_up, idx_low, n)
+    poids = 1 / donnees['uncertainty'] ** 2
+    M, y, _ = mesurer(resultats, taille, 'assemblage', assembler_equations_normales,
+                      idx_up, idx_low, poids, donnees['wavenumber'], n)
+    x = mesurer(resultats, taille, 'factorisation', resoudre_equations_normales, M.tocsc(), y)
+    mesurer(resultats, taille, 'composantes', etiqueter_composantes, idx_up, idx_low, n)
+    if taille <= TAILLE_MAX_GRAPHE:
+        mesurer(resultats, taille, 'graphe', _rendre_graphe, idx_up, idx_low, donnees['wavenumber'],
+                os.path.join(repertoire, f'graphe_{taille}.html'))
+
+    # Exactitude : écart aux énergies vraies (le fondamental, exclu, vaut 0)
+    vraies = niveaux['energie'].to_numpy()
+    cles_vraies = codec.encoder(niveaux.filter(like='qn_').to_numpy())
+    ordre = np.argsort(cles_vraies)
+    numeros = ordre[np.searchsorted(cles_vraies, cles_niveaux, sorter=ordre)]
+    return float(np.max(np.abs(x - vraies[numeros])))
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'inconnu'
+
+
+def enregistrer_resultats(resultats, erreurs, repertoire=REPERTOIRE_RESULTATS):
+    """Écrit les mesures dans REPERTOIRE_RESULTATS/<commit>_<date>.json ; retourne le chemin."""
+    os.makedirs(repertoire, exist_ok=True)
+    commit = _commit()
+    chemin = os.path.join(repertoire, f"{commit}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(chemin, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine': {'systeme': platform.platform(), 'processeur': platform.processor(),
+                        'coeurs': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__},
+            'erreur_max_energies': erreurs,
+            'mesures': resultats,
+        }, f, indent=1)
+    return chemin
+
+
+def comparer(fichier_reference, fichier):
+    """Affiche, étape par étape, le rapport des durées et des pics mémoire de fichier par rapport à la référence."""
+    def charger(chemin):
+        with open(chemin, 'r') as f:
+            contenu = json.load(f)
+        return contenu['commit'], {(m['taille'], m['etape']): m for m in contenu['mesures']}
+
+    commit_reference, reference = charger(fichier_reference)
+    commit, mesures = charger(fichier)
+    print(f"{'taille':>9} {'étape':<14} {'durée ' + commit_reference:>16} {'durée ' + commit:>16} {'rapport':>8} {'mémoire':>8}")
+    for cle in sorted(set(reference) & set(mesures), key=lambda c: (c[0], ETAPES.index(c[1]))):
+        a, b = reference[cle], mesures[cle]
+        rapport = b['duree_s'] / a['duree_s'] if a['duree_s'] else float('nan')
+        rapport_memoire = b['pic_python_mo'] / a['pic_python_mo'] if a['pic_python_mo'] else float('nan')
+        alerte = '  <-- plus lent' if rapport > 1.2 else ''
+        print(f"{cle[0]:>9} {cle[1]:<14} {a['duree_s']:14.3f} s {b['duree_s']:14.3f} s {rapport:8.2f} "
+              f"{rapport_memoire:8.2f}{alerte}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Banc d'essai des étapes du calcul sur des réseaux synthétiques.")
+    parser.add_argument('--tailles', type=int, nargs='+', default=list(TAILLES), help="nombres de transitions")
+    parser.add_argument('--transitions-par-niveau', type=float, default=TRANSITIONS_PAR_NIVEAU)
+    parser.add_argument('--graine', type=int, default=0)
+    parser.add_argument('--comparer', nargs=2, metavar=('REFERENCE', 'RESULTATS'),
+                        help="compare deux fichiers de résultats au lieu de lancer le banc")
+    arguments = parser.parse_args()
+
+    if arguments.comparer:
+        comparer(*arguments.comparer)
+    else:
+        resultats, erreurs = [], {}
+        print(f"{'taille':>9} {'étape':<14} {'durée':>11} {'pic Python':>12} {'RSS max':>12}")
+        with tempfile.TemporaryDirectory() as repertoire:
+            for taille in arguments.tailles:
+                erreurs[taille] = banc_taille(taille, resultats, repertoire, arguments.transitions_par_niveau,
+                                              arguments.graine)
+                print(f"{taille:>9} écart max aux énergies vraies : {erreurs[taille]:.3e} cm-1")
+        print(f"Résultats enregistrés dans '{enregistrer_resultats(resultats, erreurs)}'.")
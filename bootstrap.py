@@ -0,0 +1,304 @@
+import copy
+import os
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from scipy.sparse import diags
+
+from ancrage import raffiner
+from assemblage import MotifNormal, etiqueter_composantes
+from cholesky_creux import FactorisationCholesky
+from instrumentation import etape
+from resolution_parallele import limiter_threads_blas
+
+# Tirage des répliques : 'reechantillonnage' (transitions tirées avec remise) ou
+# 'perturbation' (nombres d'ondes perturbés d'un bruit gaussien d'écart type σ)
+MODES_BOOTSTRAP = ('reechantillonnage', 'perturbation')
+
+# Nombre de répliques par défaut et nombre de répliques envoyées à la fois à un processus
+NOMBRE_REPLIQUES = 200
+REPLIQUES_PAR_TACHE = 10
+
+# Graine par défaut : la réplique k utilise le générateur (graine, k), quel que soit le processus qui la calcule
+GRAINE = 0
+
+
+class StatistiquesEnLigne:
+    """Moyenne et variance par niveau, agrégées réplique par réplique sans conserver les répliques.
+
+    ajouter applique la récurrence de Welford aux niveaux du masque (ceux que
+    la réplique détermine) ; nombre compte les répliques retenues pour chaque
+    niveau. fusionner combine deux agrégats calculés séparément (formule de
+    Chan et al.), ce qui permet à chaque processus d'agréger ses répliques
+    avant de renvoyer trois vecteurs.
+    """
+
+    def __init__(self, nombre_niveaux):
+        self.repliques = 0
+        self.nombre = np.zeros(nombre_niveaux, dtype=np.int64)
+        self.moyenne = np.zeros(nombre_niveaux)
+        self.m2 = np.zeros(nombre_niveaux)
+
+    def ajouter(self, x, masque=None):
+        self.repliques += 1
+        if masque is None:
+            masque = slice(None)
+        self.nombre[masque] += 1
+        ecart = x[masque] - self.moyenne[masque]
+        self.moyenne[masque] += ecart / self.nombre[masque]
+        self.m2[masque] += ecart * (x[masque] - self.moyenne[masque])
+
+    def fusionner(self, autre):
+        total = self.nombre + autre.nombre
+        fraction = np.divide(autre.nombre, total, out=np.zeros(total.shape[0]), where=total > 0)
+        ecart = autre.moyenne - self.moyenne
+        self.moyenne = self.moyenne + ecart * fraction
+        self.m2 = self.m2 + autre.m2 + ecart ** 2 * self.nombre * fraction
+        self.nombre = total
+        self.repliques += autre.repliques
+        return self
+
+    def variances(self):
+        """Variance empirique (non biaisée) de chaque niveau ; NaN pour un niveau retenu moins de deux fois."""
+        return np.divide(self.m2, self.nombre - 1, out=np.full(self.m2.shape[0], np.nan), where=self.nombre > 1)
+
+    def ecarts_types(self):
+        return np.sqrt(self.variances())
+
+
+class MemoirePartagee:
+    """Tableaux NumPy copiés une fois dans des blocs multiprocessing.shared_memory, lus par tous les processus.
+
+    descripteurs (nom du bloc, forme, type de chaque tableau) est la seule
+    donnée envoyée aux processus, qui s'y attachent par attacher(). Les blocs
+    sont libérés par fermer() (ou à la sortie du bloc with).
+    """
+
+    def __init__(self, tableaux):
+        self._blocs = []
+        self.descripteurs = {}
+        try:
+            for nom, tableau in tableaux.items():
+                tableau = np.ascontiguousarray(tableau)
+                bloc = SharedMemory(create=True, size=max(tableau.nbytes, 1))
+                self._blocs.append(bloc)
+                np.ndarray(tableau.shape, dtype=tableau.dtype, buffer=bloc.buf)[...] = tableau
+                self.descripteurs[nom] = (bloc.name, tableau.shape, tableau.dtype.str)
+        except BaseException:
+            self.fermer()
+            raise
+
+    @property
+    def octets(self):
+        return sum(bloc.size for bloc in self._blocs)
+
+    def fermer(self):
+        for bloc in self._blocs:
+            bloc.close()
+            bloc.unlink()
+        self._blocs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+
+def attacher(descripteurs):
+    """Retourne (blocs, tableaux) : vues en lecture seule sur les blocs partagés ; garder blocs en vie."""
+    blocs, tableaux = [], {}
+    for nom, (nom_bloc, forme, type_tableau) in descripteurs.items():
+        bloc = SharedMemory(name=nom_bloc)
+        blocs.append(bloc)
+        tableau = np.ndarray(forme, dtype=np.dtype(type_tableau), buffer=bloc.buf)
+        tableau.flags.writeable = False
+        tableaux[nom] = tableau
+    return blocs, tableaux
+
+
+def niveaux_determines(idx_up, idx_low, nombre_niveaux, references):
+    """Masque des niveaux reliés, par les transitions données, au fondamental exclu ou à l'un des niveaux references.
+
+    Le fondamental exclu (indice -1) est compté comme un niveau
+    supplémentaire ; references sont les niveaux de référence des
+    composantes flottantes (AnalyseComposantes.references).
+    """
+    idx_up = np.where(idx_up < 0, nombre_niveaux, idx_up)
+    idx_low = np.where(idx_low < 0, nombre_niveaux, idx_low)
+    _, etiquettes, _ = etiqueter_composantes(idx_up, idx_low, nombre_niveaux + 1)
+    ancres = np.append(np.asarray(references, dtype=np.int64), nombre_niveaux)
+    return np.isin(etiquettes[:nombre_niveaux], etiquettes[ancres])
+
+
+# Données d'un processus de bootstrap, installées une fois par _initialiser_processus
+_CONTEXTE = {}
+
+
+def _initialiser_processus(descripteurs, analyse, nombre_niveaux, mode, graine, nombre_threads):
+    limiter_threads_blas(nombre_threads)
+    blocs, tableaux = attacher(descripteurs)
+    _installer_contexte(tableaux, analyse, nombre_niveaux, mode, graine, blocs)
+
+
+def _installer_contexte(tableaux, analyse, nombre_niveaux, mode, graine, blocs=()):
+    _CONTEXTE.clear()
+    motif = MotifNormal.depuis_tableaux(tableaux, nombre_niveaux)
+    _CONTEXTE.update(
+        blocs=blocs, tableaux=tableaux, analyse=analyse, mode=mode, graine=graine, motif=motif, factorisation=None,
+        # Diagonale de M complète : terme qui fixe les niveaux qu'une réplique ne détermine plus
+        diagonale=motif.assembler(tableaux['poids']).diagonal(),
+        references=analyse.references[analyse.flottantes],
+    )
+
+
+def _factoriser(M_ancree):
+    """Factorise M en réutilisant l'ordonnancement partagé, puis refactorise les répliques suivantes."""
+    factorisation = _CONTEXTE['factorisation']
+    if factorisation is None:
+        permutation = _CONTEXTE['tableaux'].get('permutation')
+        factorisation = FactorisationCholesky(M_ancree, permutation=permutation)
+        _CONTEXTE['factorisation'] = factorisation
+    elif _CONTEXTE['mode'] == 'reechantillonnage':
+        factorisation.refactoriser(M_ancree)
+    # En perturbation, M ne change pas : la factorisation du premier tirage sert à toutes les répliques
+    return factorisation
+
+
+def _calculer_repliques(repliques):
+    """Calcule les répliques données ; retourne (statistiques agrégées, nombre de répliques rejetées)."""
+    tableaux, analyse, motif = _CONTEXTE['tableaux'], _CONTEXTE['analyse'], _CONTEXTE['motif']
+    poids_initiaux, b_initial = tableaux['poids'], tableaux['b']
+    statistiques = StatistiquesEnLigne(motif.nombre_niveaux)
+    rejetees = 0
+    for replique in repliques:
+        rng = np.random.default_rng((_CONTEXTE['graine'], int(replique)))
+        determines = None
+        if _CONTEXTE['mode'] == 'reechantillonnage':
+            comptes = np.bincount(rng.integers(0, poids_initiaux.shape[0], poids_initiaux.shape[0]),
+                                  minlength=poids_initiaux.shape[0])
+            poids, b = poids_initiaux * comptes, b_initial
+            gardees = comptes > 0
+            determines = niveaux_determines(motif.idx_up[gardees], motif.idx_low[gardees], motif.nombre_niveaux,
+                                            _CONTEXTE['references'])
+        else:
+            poids, b = poids_initiaux, b_initial + tableaux['sigma'] * rng.standard_normal(b_initial.shape[0])
+
+        M = motif.assembler(poids)
+        y = motif.second_membre(poids, b)
+        M_ancree = analyse.ancrer(M)
+        if determines is not None and not np.all(determines):
+            # Niveaux isolés ou détachés par le tirage : fixés par leur diagonale complète, puis ignorés
+            M_ancree = M_ancree + diags(np.where(determines, 0.0, _CONTEXTE['diagonale']))
+        try:
+            factorisation = _factoriser(M_ancree.tocsc())
+        except np.linalg.LinAlgError:
+            rejetees += 1
+            continue
+        x = factorisation.resoudre(y)
+        if analyse.ancrage == 'regularisation' and analyse.nombre_flottantes:
+            x = raffiner(M, y, x, factorisation, analyse)
+            if determines is not None:
+                x = _recaler_scindees(x, determines, analyse, tableaux['energies'])
+        statistiques.ajouter(x, determines)
+    return statistiques, rejetees
+
+
+def _recaler_scindees(x, determines, analyse, energies):
+    """Jauge d'énergie moyenne nulle d'une composante flottante que le tirage a scindée.
+
+    La moyenne sur toute la composante n'est plus définie : ses niveaux
+    encore déterminés sont décalés pour que leur moyenne soit celle des
+    mêmes niveaux dans la solution complète (energies). Sans scission, c'est
+    exactement la jauge d'énergie moyenne nulle.
+    """
+    flottante = np.zeros(analyse.nombre, dtype=bool)
+    flottante[analyse.flottantes] = True
+    scindees = np.zeros(analyse.nombre, dtype=bool)
+    scindees[analyse.etiquettes[~determines]] = True
+    scindees &= flottante
+    if not np.any(scindees):
+        return x
+    etiquettes = analyse.etiquettes[determines]
+    ecarts = (np.bincount(etiquettes, weights=(x - energies)[determines], minlength=analyse.nombre)
+              / np.maximum(np.bincount(etiquettes, minlength=analyse.nombre), 1))
+    return x - np.where(scindees[analyse.etiquettes], ecarts[analyse.etiquettes], 0.0)
+
+
+def bootstrap(motif, analyse, poids, b, incertitudes, mode='reechantillonnage', nombre_repliques=NOMBRE_REPLIQUES,
+              nombre_processus=None, threads_par_processus=1, graine=GRAINE, permutation=None,
+              repliques_par_tache=REPLIQUES_PAR_TACHE, energies=None):
+    """Incertitudes des niveaux par bootstrap : nombre_repliques résolutions sur des données tirées au hasard.
+
+    - 'reechantillonnage' : les transitions sont tirées avec remise ; une
+      transition tirée k fois reçoit le poids k w (même motif de M). Un
+      niveau que la réplique ne relie plus au fondamental (ou à la référence
+      de sa composante flottante) est fixé le temps de la résolution et
+      n'entre pas dans ses statistiques (statistiques.nombre compte les
+      répliques retenues par niveau ; avec l'ancrage 'regularisation', une
+      composante flottante scindée par le tirage est recalée sur la solution
+      complète energies, calculée ici si elle n'est pas fournie). Un
+      niveau déterminé par une seule
+      transition n'hérite que de la variabilité de ses voisins ; à l'inverse,
+      sur un réseau peu redondant (quelques transitions par niveau), les
+      transitions retirées allongent les chemins vers le fondamental et les
+      écarts types dépassent nettement les incertitudes analytiques.
+    - 'perturbation' : b* = b + σ ε ; M ne change pas et n'est factorisée
+      qu'une fois par processus.
+
+    Le motif de M (MotifNormal), les indices de niveaux, les poids, les
+    nombres d'ondes et l'ordonnancement permutation (q d'une
+    FactorisationCholesky de même motif, facultatif) sont placés une fois en
+    mémoire partagée ; chaque processus s'y attache, reconstruit le motif sans
+    recalcul et factorise toutes ses répliques avec cet ordonnancement. Chaque
+    processus agrège ses répliques (Welford) et renvoie trois vecteurs, fusionnés
+    ici (Chan) : aucune réplique n'est conservée. Les composantes flottantes
+    sont ancrées comme dans la résolution principale (analyse).
+
+    Retourne (statistiques, rejetees) : un StatistiquesEnLigne (moyenne,
+    ecarts_types(), nombre) et le nombre de répliques rejetées (factorisation
+    impossible).
+    """
+    if mode not in MODES_BOOTSTRAP:
+        raise ValueError(f"Mode de bootstrap inconnu : {mode}. Valeurs possibles : {MODES_BOOTSTRAP}")
+    nombre_processus = nombre_processus or os.cpu_count() or 1
+    tableaux = dict(motif.tableaux(), poids=np.asarray(poids, dtype=float), b=np.asarray(b, dtype=float),
+                    sigma=np.asarray(incertitudes, dtype=float))
+    if permutation is not None:
+        tableaux['permutation'] = np.asarray(permutation, dtype=np.int64)
+    if mode == 'reechantillonnage' and analyse.ancrage == 'regularisation' and analyse.nombre_flottantes:
+        if energies is None:
+            analyse_complete = copy.copy(analyse)
+            M = motif.assembler(tableaux['poids'])
+            y = motif.second_membre(tableaux['poids'], tableaux['b'])
+            factorisation = FactorisationCholesky(analyse_complete.ancrer(M).tocsc(), permutation=permutation)
+            energies = raffiner(M, y, factorisation.resoudre(y), factorisation, analyse_complete)
+        tableaux['energies'] = np.asarray(energies, dtype=float)
+    taches = [np.arange(debut, min(debut + repliques_par_tache, nombre_repliques))
+              for debut in range(0, nombre_repliques, repliques_par_tache)]
+
+    statistiques = StatistiquesEnLigne(motif.nombre_niveaux)
+    rejetees = 0
+    with etape('bootstrap', lignes=nombre_repliques):
+        if nombre_processus == 1:
+            # Copie : les termes d'ancrage des répliques ne remplacent pas ceux de la résolution principale
+            _installer_contexte(tableaux, copy.copy(analyse), motif.nombre_niveaux, mode, graine)
+            resultats = map(_calculer_repliques, taches)
+            for statistiques_tache, rejetees_tache in resultats:
+                statistiques.fusionner(statistiques_tache)
+                rejetees += rejetees_tache
+            _CONTEXTE.clear()
+        else:
+            with MemoirePartagee(tableaux) as partage:
+                print(f"Bootstrap : {nombre_repliques} répliques ({mode}) sur {nombre_processus} processus, "
+                      f"{partage.octets / 1024 ** 2:.1f} Mo en mémoire partagée.")
+                with Pool(nombre_processus, initializer=_initialiser_processus,
+                          initargs=(partage.descripteurs, analyse, motif.nombre_niveaux, mode, graine,
+                                    threads_par_processus)) as pool:
+                    for statistiques_tache, rejetees_tache in pool.imap_unordered(_calculer_repliques, taches):
+                        statistiques.fusionner(statistiques_tache)
+                        rejetees += rejetees_tache
+    if motif.nombre_niveaux:
+        print(f"Bootstrap : {statistiques.repliques} répliques calculées, {rejetees} rejetées ; niveaux retenus dans "
+              f"{np.median(statistiques.nombre):.0f} répliques en médiane (minimum {statistiques.nombre.min()}).")
+    return statistiques, rejetees
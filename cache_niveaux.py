@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from assemblage import lire_transitions, numeroter_niveaux, construire_matrice_design, assembler_equations_normales
+from codec_niveaux import CodecNiveaux, QNAMES_FILE
+from instrumentation import etape
+from schema import revision_transitions
+
+# Répertoire du cache (une entrée par clé) et taille totale au-delà de laquelle les entrées les plus anciennes sont évincées
+REPERTOIRE_CACHE = '.cache_marvel'
+TAILLE_MAX_CACHE = 2 * 1024 ** 3  # 2 Go
+
+# À incrémenter si le contenu ou le format des artefacts change
+VERSION_CACHE = 1
+
+# Artefacts de chaque groupe ; un groupe n'est valide que si tous ses fichiers sont présents
+GROUPES = {
+    'niveaux': ('cles_niveaux', 'idx_up', 'idx_low', 'id', 'wavenumber', 'uncertainty', 'valide', 'poids',
+                'codec_minimums', 'codec_largeurs'),
+    'design': ('A_data', 'A_indices', 'A_indptr'),
+    'normales': ('M_data', 'M_indices', 'M_indptr', 'y'),
+}
+
+
+def empreinte_transitions(cursor):
+    """Empreinte du contenu de la table transitions.
+
+    Avec le schéma version 3, le triplet (jeton, revision, COUNT(*)) suffit et
+    ne lit aucune transition ; un INSERT OR REPLACE ne déclenche pas la
+    suppression, les écrivains s'en tiennent donc à INSERT, UPDATE et DELETE.
+    Pour une base plus ancienne, les colonnes lues par lire_transitions sont
+    hachées (lecture complète, mais sans parsing).
+    """
+    revision = revision_transitions(cursor.connection)
+    if revision is not None:
+        return 'revision:' + ':'.join(str(valeur) for valeur in revision)
+    h = hashlib.sha256()
+    cursor.execute('SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low FROM transitions')
+    while True:
+        lignes = cursor.fetchmany(100000)
+        if not lignes:
+            break
+        h.update(repr(lignes).encode())
+    return 'contenu:' + h.hexdigest()
+
+
+def cle_cache(cursor, fondamental=None, exclure_fondamental=False, fichier_qnames=QNAMES_FILE):
+    """Clé d'une entrée du cache : empreinte des transitions, contenu de Qnames.json et option du fondamental."""
+    with open(fichier_qnames, 'rb') as f:
+        qnames = f.read()
+    # Le fondamental ne change la numérotation que s'il est exclu
+    option = json.dumps([list(fondamental), True] if exclure_fondamental and fondamental is not None else None)
+    h = hashlib.sha256()
+    for morceau in (str(VERSION_CACHE), empreinte_transitions(cursor), qnames.decode(), option):
+        h.update(morceau.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _charger_npy(chemin):
+    """Charge un .npy en mémoire projetée (copie sur écriture) ; un tableau vide est lu normalement."""
+    try:
+        return np.load(chemin, mmap_mode='c')
+    except ValueError:
+        return np.load(chemin)
+
+
+def _taille_repertoire(chemin):
+    return sum(entree.stat().st_size for entree in os.scandir(chemin) if entree.is_file())
+
+
+class CacheSysteme:
+    """Cache sur disque des artefacts du système : numérotation des niveaux, matrice de design, poids et M.
+
+    Les artefacts sont rangés dans REPERTOIRE_CACHE/<clé>/ sous forme de
+    fichiers .npy, relus en mémoire projetée : une exécution sur des données
+    inchangées passe directement à la résolution. Chaque groupe est calculé
+    au premier accès puis enregistré ; l'entrée la moins récemment utilisée
+    est évincée tant que le cache dépasse taille_max octets.
+    """
+
+    def __init__(self, cursor, fondamental=None, exclure_fondamental=False, repertoire=REPERTOIRE_CACHE,
+                 taille_max=TAILLE_MAX_CACHE, fichier_qnames=QNAMES_FILE):
+        self.cursor = cursor
+        self.fondamental = fondamental
+        self.exclure_fondamental = exclure_fondamental
+        self.repertoire = repertoire
+        self.taille_max = taille_max
+        self.fichier_qnames = fichier_qnames
+        with etape('cle_cache'):
+            self.cle = cle_cache(cursor, fondamental, exclure_fondamental, fichier_qnames)
+        self.chemin = os.path.join(repertoire, self.cle)
+        self._groupes = {}
+        self.succes = []  # Groupes relus depuis le disque
+
+    def _charger(self, groupe):
+        if groupe in self._groupes:
+            return self._groupes[groupe]
+        chemins = {nom: os.path.join(self.chemin, nom + '.npy') for nom in GROUPES[groupe]}
+        if not all(os.path.exists(chemin) for chemin in chemins.values()):
+            return None
+        with etape(f'cache_{groupe}'):
+            tableaux = {nom: _charger_npy(chemin) for nom, chemin in chemins.items()}
+        os.utime(self.chemin)  # Entrée récemment utilisée
+        self._groupes[groupe] = tableaux
+        self.succes.append(groupe)
+        return tableaux
+
+    def _enregistrer(self, groupe, tableaux):
+        self._groupes[groupe] = tableaux
+        os.makedirs(self.chemin, exist_ok=True)
+        for nom in GROUPES[groupe]:
+            # Écriture dans un fichier temporaire puis renommage : un fichier présent est toujours complet
+            temporaire = os.path.join(self.chemin, f'{nom}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(temporaire, 'wb') as f:
+                np.save(f, np.ascontiguousarray(tableaux[nom]))
+            os.replace(temporaire, os.path.join(self.chemin, nom + '.npy'))
+        self.evincer()
+
+    def evincer(self):
+        """Supprime les entrées les moins récemment utilisées tant que le cache dépasse taille_max."""
+        entrees = []
+        for entree in os.scandir(self.repertoire):
+            if entree.is_dir():
+                entrees.append((entree.stat().st_mtime, entree.path, _taille_repertoire(entree.path)))
+        total = sum(taille for _, _, taille in entrees)
+        for _, chemin, taille in sorted(entrees):
+            if total <= self.taille_max:
+                break
+            if os.path.abspath(chemin) == os.path.abspath(self.chemin):
+                continue
+            shutil.rmtree(chemin, ignore_errors=True)
+            total -= taille
+
+    def niveaux(self):
+        """Équivalent de lire_transitions puis numeroter_niveaux.
+
+        Retourne (codec, cles_niveaux, idx_up, idx_low, transitions) ; en cas de
+        succès du cache, transitions ne contient que 'id', 'wavenumber',
+        'uncertainty' et 'valide' (pas les nombres quantiques bruts).
+        """
+        tableaux = self._charger('niveaux')
+        if tableaux is None:
+            transitions = lire_transitions(self.cursor)
+            valide = transitions['valide']
+            codec = CodecNiveaux.depuis_qnames(transitions['qn_up'][valide], transitions['qn_low'][valide],
+                                               fichier=self.fichier_qnames)
+            codec, cles_niveaux, idx_up, idx_low = numeroter_niveaux(
+                transitions, fondamental=self.fondamental, exclure_fondamental=self.exclure_fondamental, codec=codec)
+            tableaux = {
+                'cles_niveaux': cles_niveaux, 'idx_up': idx_up, 'idx_low': idx_low,
+                'id': transitions['id'], 'wavenumber': transitions['wavenumber'],
+                'uncertainty': transitions['uncertainty'], 'valide': transitions['valide'],
+                'poids': 1 / (transitions['uncertainty'] ** 2),
+                'codec_minimums': codec.minimums, 'codec_largeurs': codec.largeurs,
+            }
+            self._enregistrer('niveaux', tableaux)
+            return codec, cles_niveaux, idx_up, idx_low, transitions
+
+        codec = CodecNiveaux(self._noms_quantiques(), tableaux['codec_minimums'], tableaux['codec_largeurs'])
+        transitions = {nom: tableaux[nom] for nom in ('id', 'wavenumber', 'uncertainty', 'valide')}
+        return codec, tableaux['cles_niveaux'], tableaux['idx_up'], tableaux['idx_low'], transitions
+
+    def _noms_quantiques(self):
+        with open(self.fichier_qnames, 'r') as f:
+            return json.load(f)['quantum_names']
+
+    def poids(self):
+        """Poids w = 1 / uncertainty² de chaque transition."""
+        self.niveaux()
+        return self._groupes['niveaux']['poids']
+
+    def matrice_design(self):
+        """Matrice de design A (CSR), comme construire_matrice_design."""
+        tableaux = self._charger('design')
+        _, cles_niveaux, idx_up, idx_low, _ = self.niveaux()
+        forme = (idx_up.shape[0], cles_niveaux.shape[0])
+        if tableaux is None:
+            A = construire_matrice_design(idx_up, idx_low, cles_niveaux.shape[0])
+            self._enregistrer('design', {'A_data': A.data, 'A_indices': A.indices, 'A_indptr': A.indptr})
+            return A
+        return csr_matrix((tableaux['A_data'], tableaux['A_indices'], tableaux['A_indptr']), shape=forme)
+
+    def equations_normales(self):
+        """Retourne (M, y) avec M = A^T W A (CSR) et y = A^T W b, comme assembler_equations_normales."""
+        tableaux = self._charger('normales')
+        _, cles_niveaux, idx_up, idx_low, transitions = self.niveaux()
+        n = cles_niveaux.shape[0]
+        if tableaux is None:
+            M, y, _ = assembler_equations_normales(idx_up, idx_low, self.poids(), transitions['wavenumber'], n)
+            self._enregistrer('normales', {'M_data': M.data, 'M_indices': M.indices, 'M_indptr': M.indptr, 'y': y})
+            return M, y
+        M = csr_matrix((tableaux['M_data'], tableaux['M_indices'], tableaux['M_indptr']), shape=(n, n))
+        return M, tableaux['y']
+
+    def afficher_etat(self):
+        """Affiche les groupes relus depuis le cache (les autres viennent d'être calculés)."""
+        if self.succes:
+            print(f"Cache : {', '.join(self.succes)} relu(s) depuis '{self.chemin}'.")
+        else:
+            print(f"Cache : artefacts calculés et enregistrés dans '{self.chemin}'.")
@@ -1,3 +1,5 @@
+import os
+import numpy as np
 import pandas as pd
 
 # Définition des noms des colonnes
@@ -12,67 +14,175 @@ column_names = [
     "Reference Indices", "Upper State Weight", "Lower State Weight"
 ]
 
-def safe_int(value, default=0):
-    """ Convertit en entier, retourne `default` si vide ou invalide """
-    return int(value) if value.strip().isdigit() else default
+# Position (début, fin) et type de chaque champ d'un enregistrement CDSD
+colspecs = [
+    (0, 2, 'int'),      # Molecule Number
+    (2, 3, 'str'),      # Isotopologue Index
+    (3, 15, 'float'),   # Vacuum Wavenumber
+    (15, 25, 'float'),  # Intensity
+    (25, 35, 'float'),  # Einstein A-coefficient
+    (35, 40, 'float'),  # Air-broadened Half-width
+    (40, 45, 'float'),  # Self-broadened Half-width
+    (45, 55, 'float'),  # Lower State Energy
+    (55, 59, 'float'),  # Temperature Exponent (γ_air)
+    (59, 67, 'float'),  # Air Pressure Shift
+    (67, 69, 'int'),    # Upper State v1
+    (69, 71, 'int'),    # Upper State v2
+    (71, 73, 'int'),    # Upper State l2
+    (73, 75, 'int'),    # Upper State v3
+    (75, 76, 'int'),    # Upper State r
+    (76, 78, 'int'),    # Lower State v1
+    (78, 80, 'int'),    # Lower State v2
+    (80, 82, 'int'),    # Lower State l2
+    (82, 84, 'int'),    # Lower State v3
+    (84, 85, 'int'),    # Lower State r
+    (85, 89, 'float'),  # Temp Exponent (γ_self)
+    (89, 97, 'float'),  # Self Pressure Shift
+    (97, 98, 'str'),    # Branch
+    (98, 101, 'int'),   # Lower State J
+    (101, 102, 'str'),  # Lower State Wang Symmetry
+    (102, 108, 'str'),  # Uncertainty Indices
+    (108, 120, 'str'),  # Reference Indices
+    (120, 127, 'float'),  # Upper State Weight
+    (127, 134, 'float'),  # Lower State Weight
+]
+
+# Longueur utile d'un enregistrement CDSD (sans le saut de ligne)
+LONGUEUR_ENREGISTREMENT = 134
+
+# Nombre de lignes par bloc renvoyé par lire_cdsd_par_blocs
+TAILLE_BLOC = 1_000_000
+
+# Octets examinés à la fois pour compter les sauts de ligne d'un fichier projeté
+TRANCHE_VERIFICATION = 1 << 24
+
 
-def safe_float(value, default=0.0):
-    """ Convertit en float, retourne `default` si vide ou invalide """
+def _dtype_enregistrement(longueur_ligne):
+    """Type structuré NumPy décrivant une ligne : un champ d'octets par colonne CDSD."""
+    return np.dtype({
+        'names': column_names,
+        'formats': [f'S{fin - debut}' for debut, fin, _ in colspecs],
+        'offsets': [debut for debut, _, _ in colspecs],
+        'itemsize': longueur_ligne,
+    })
+
+def _convertir_champ(octets, type_champ):
+    """Convertit un tableau de champs d'octets en valeurs.
+
+    Les champs vides (ou invalides) prennent la valeur par défaut 0 / 0.0.
+    """
+    if type_champ == 'str':
+        return np.strings.strip(octets).astype(np.str_)
+
+    nettoyes = np.strings.strip(octets)
+    if type_champ == 'int':
+        # Seule une suite de chiffres est un entier valide
+        invalides = ~np.strings.isdigit(nettoyes)
+    else:
+        invalides = nettoyes == b''
+    nettoyes = np.where(invalides, b'0', nettoyes)
     try:
-        return float(value.strip())
+        valeurs = nettoyes.astype(np.int64 if type_champ == 'int' else np.float64)
     except ValueError:
-        return default
+        # Repli pour un bloc contenant des valeurs invalides
+        valeurs = pd.to_numeric(pd.Series(nettoyes.astype(np.str_)), errors='coerce').fillna(0).to_numpy()
+        valeurs = valeurs.astype(np.int64 if type_champ == 'int' else np.float64)
+    return valeurs
+
+def _bloc_en_dataframe(enregistrements):
+    """Décode un tableau structuré d'enregistrements CDSD en DataFrame."""
+    return pd.DataFrame({
+        nom: _convertir_champ(enregistrements[nom], type_champ)
+        for nom, (_, _, type_champ) in zip(column_names, colspecs)
+    })
 
-def read_cdsd_file(filename):
-    data = []
+def _longueur_ligne_uniforme(donnees):
+    """Longueur d'une ligne (saut de ligne compris) si toutes les lignes ont la même, sinon None.
 
-    with open(filename, 'r') as file:
+    Le saut de ligne de la dernière ligne peut manquer.
+    """
+    if donnees.shape[0] == 0:
+        return None
+    premiers = np.flatnonzero(donnees[:4096] == ord('\n'))
+    if premiers.shape[0] == 0:
+        return None
+    longueur = int(premiers[0]) + 1
+    if longueur < LONGUEUR_ENREGISTREMENT + 1 or donnees.shape[0] % longueur not in (0, longueur - 1):
+        return None
+    # Vérification vectorisée : un saut de ligne à la fin de chaque enregistrement, et nulle part ailleurs
+    # (compté par tranches : la mémoire reste bornée quelle que soit la taille du fichier)
+    if not np.all(donnees[longueur - 1::longueur] == ord('\n')):
+        return None
+    sauts = sum(int(np.count_nonzero(donnees[debut:debut + TRANCHE_VERIFICATION] == ord('\n')))
+                for debut in range(0, donnees.shape[0], TRANCHE_VERIFICATION))
+    if sauts != donnees.shape[0] // longueur:
+        return None
+    return longueur
+
+def _blocs_lignes_irregulieres(filename, taille_bloc):
+    """Lecture de repli, ligne à ligne, pour un fichier dont les lignes n'ont pas la même longueur."""
+    lignes = []
+    with open(filename, 'rb') as file:
         for line_num, line in enumerate(file, start=1):  # Ajout du numéro de ligne pour debug
-            line = line.rstrip("\n")  # Supprimer le saut de ligne
+            line = line.rstrip(b"\r\n")  # Supprimer le saut de ligne
 
-            if len(line) < 134:
-                print(f"⚠️ Ligne {line_num} ignorée (trop courte) : {repr(line)}")
+            if len(line) < LONGUEUR_ENREGISTREMENT:
+                print(f"⚠️ Ligne {line_num} ignorée (trop courte) : {line.decode(errors='replace')!r}")
                 continue  # Ignore la ligne et passe à la suivante
 
-            row = [
-                safe_int(line[0:2]),     # Molecule Number
-                line[2:3].strip(),       # Isotopologue Index
-                safe_float(line[3:15]),  # Vacuum Wavenumber
-                safe_float(line[15:25]), # Intensity
-                safe_float(line[25:35]), # Einstein A-coefficient
-                safe_float(line[35:40]), # Air-broadened Half-width
-                safe_float(line[40:45]), # Self-broadened Half-width
-                safe_float(line[45:55]), # Lower State Energy
-                safe_float(line[55:59]), # Temperature Exponent (γ_air)
-                safe_float(line[59:67]), # Air Pressure Shift
-                safe_int(line[67:69]),   # Upper State v1
-                safe_int(line[69:71]),   # Upper State v2
-                safe_int(line[71:73]),   # Upper State l2
-                safe_int(line[73:75]),   # Upper State v3
-                safe_int(line[75:76]),   # Upper State r
-                safe_int(line[76:78]),   # Lower State v1
-                safe_int(line[78:80]),   # Lower State v2
-                safe_int(line[80:82]),   # Lower State l2
-                safe_int(line[82:84]),   # Lower State v3
-                safe_int(line[84:85]),   # Lower State r
-                safe_float(line[85:89]), # Temp Exponent (γ_self)
-                safe_float(line[89:97]), # Self Pressure Shift
-                line[97:98].strip(),     # Branch
-                safe_int(line[98:101]),  # Lower State J
-                line[101:102].strip(),   # Lower State Wang Symmetry
-                line[102:108].strip(),   # Uncertainty Indices
-                line[108:120].strip(),   # Reference Indices
-                safe_float(line[120:127]), # Upper State Weight
-                safe_float(line[127:134])  # Lower State Weight
-            ]
-
-            data.append(row)
-
-    df = pd.DataFrame(data, columns=column_names)
-    return df
-
-# 📌 Lecture du fichier (remplace 'cdsd296v1' par le vrai nom de ton fichier)
-df_cdsd = read_cdsd_file('cdsd296v1')
-
-# 📌 Affichage des premières lignes du fichier sous forme de tableau
-print(df_cdsd.head())
+            lignes.append(line[:LONGUEUR_ENREGISTREMENT])
+            if len(lignes) == taille_bloc:
+                yield np.frombuffer(b''.join(lignes), dtype=_dtype_enregistrement(LONGUEUR_ENREGISTREMENT))
+                lignes = []
+    if lignes:
+        yield np.frombuffer(b''.join(lignes), dtype=_dtype_enregistrement(LONGUEUR_ENREGISTREMENT))
+
+def _blocs_lignes_uniformes(donnees, longueur, taille_bloc):
+    """Blocs d'enregistrements lus directement dans le fichier projeté (vues, sans copie)."""
+    type_enregistrement = _dtype_enregistrement(longueur)
+    complets = donnees.shape[0] // longueur
+    enregistrements = donnees[:complets * longueur].view(type_enregistrement)
+    dernier = None
+    if donnees.shape[0] % longueur:
+        # Dernière ligne sans saut de ligne final : seule copiée, puis ajoutée au dernier bloc
+        dernier = np.frombuffer(donnees[complets * longueur:].tobytes() + b'\n', dtype=type_enregistrement)
+    for debut in range(0, max(complets, 1), taille_bloc):
+        bloc = enregistrements[debut:debut + taille_bloc]
+        if dernier is not None and debut + taille_bloc >= complets:
+            bloc = np.concatenate((bloc, dernier))
+        yield bloc
+
+def lire_cdsd_par_blocs(filename, taille_bloc=TAILLE_BLOC, en_dataframe=True):
+    """Lit un fichier CDSD par blocs de taille_bloc lignes.
+
+    Le fichier est projeté en mémoire (memmap) et chaque bloc est décodé comme
+    un tableau d'enregistrements à largeur fixe, champ par champ et sans boucle
+    Python par ligne. La mémoire utilisée est bornée par la taille d'un bloc.
+    Génère des DataFrames, ou les tableaux structurés bruts si en_dataframe=False.
+    """
+    if os.path.getsize(filename) == 0:
+        return
+    donnees = np.memmap(filename, dtype=np.uint8, mode='r')
+    longueur = _longueur_ligne_uniforme(donnees)
+
+    if longueur is None:
+        blocs = _blocs_lignes_irregulieres(filename, taille_bloc)
+    else:
+        blocs = _blocs_lignes_uniformes(donnees, longueur, taille_bloc)
+
+    for bloc in blocs:
+        yield _bloc_en_dataframe(bloc) if en_dataframe else bloc
+
+def read_cdsd_file(filename, taille_bloc=TAILLE_BLOC):
+    """Lit tout le fichier CDSD dans un seul DataFrame (assemblé à partir des blocs)."""
+    blocs = list(lire_cdsd_par_blocs(filename, taille_bloc))
+    if not blocs:
+        return pd.DataFrame(columns=column_names)
+    return pd.concat(blocs, ignore_index=True)
+
+if __name__ == '__main__':
+    # 📌 Lecture du fichier (remplace 'cdsd296v1' par le vrai nom de ton fichier)
+    df_cdsd = read_cdsd_file('cdsd296v1')
+
+    # 📌 Affichage des premières lignes du fichier sous forme de tableau
+    print(df_cdsd.head())
@@ -1,222 +1,267 @@
-import sqlite3
-from bidict import bidict
+from acces_donnees import connecter
 import json
 import pandas as pd
-from scipy.sparse import coo_matrix, csr_matrix, diags
 import numpy as np
-from scipy.linalg import cho_factor, cho_solve
-
-# Se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
-cursor = conn.cursor()
-
-# Créer un bidictionnaire vide
-niveaux_energie = bidict()
-
-# Compteur pour les numéros séquentiels
-compteur = 0
-
-# Charger les nombres quantiques de l'état fondamental depuis Qnames.json
-with open('Qnames.json', 'r') as f:
-    qnames_data = json.load(f)
-    fondamental = tuple(qnames_data['ground_state_numbers'])  # Convertir en tuple
-
-# Lire ground_energy_status depuis le clavier
-ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'fixed' ou 1 'free') : "))
-if ground_energy_status not in [0, 1]:
-    raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
-
-# Fonction pour explorer la table des transitions et remplir le bidictionnaire
-def explorer_transitions_et_remplir_bidict():
-    global compteur  # Utiliser le compteur global
-
-    # Exécuter une requête pour lire tous les enregistrements de la table transitions
-    cursor.execute('SELECT id, wavenumber, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
-
-    # Parcourir chaque enregistrement
-    for row in rows:
-        quantum_numbers_up = row[2]  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = row[3]  # Nombres quantiques de l'état inférieur
-
-        # Convertir les chaînes JSON en listes Python
-        try:
-            liste_up = json.loads(quantum_numbers_up)  # Convertir "[1, 2, 3]" en [1, 2, 3]
-            liste_low = json.loads(quantum_numbers_low)  # Convertir "[0, 1, 2]" en [0, 1, 2]
-        except json.JSONDecodeError:
-            print(f"Erreur : Impossible de parser les nombres quantiques : {quantum_numbers_up} ou {quantum_numbers_low}")
-            continue
-
-        # Convertir les listes en tuples
-        tuple_up = tuple(liste_up)
-        tuple_low = tuple(liste_low)
-
-        # Ajouter les tuples au bidictionnaire avec un numéro séquentiel
-        # Ignorer le niveau fondamental si ground_energy_status == 0
-        if ground_energy_status == 1 or tuple_up != fondamental:
-            if tuple_up not in niveaux_energie:
-                niveaux_energie[tuple_up] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-        if ground_energy_status == 1 or tuple_low != fondamental:
-            if tuple_low not in niveaux_energie:
-                niveaux_energie[tuple_low] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-# Appeler la fonction pour explorer la table et remplir le bidictionnaire
-explorer_transitions_et_remplir_bidict()
-
-# Fonction pour générer la matrice de design en représentation COO
-def generer_matrice_design_coo():
-    # Récupérer toutes les transitions
-    cursor.execute('SELECT id, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
-
-    # Initialiser des listes pour les indices et les valeurs non nulles
-    lignes = []  # Indices de ligne
-    colonnes = []  # Indices de colonne
-    valeurs = []  # Valeurs non nulles
-
-    # Remplir les listes pour la représentation COO
-    for i, row in enumerate(rows):
-        quantum_numbers_up = json.loads(row[1])  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = json.loads(row[2])  # Nombres quantiques de l'état inférieur
-
-        # Convertir en tuples
-        tuple_up = tuple(quantum_numbers_up)
-        tuple_low = tuple(quantum_numbers_low)
-
-        # Récupérer les numéros associés
-        num_up = niveaux_energie.get(tuple_up, None)  # Utiliser None si le niveau n'est pas dans le dictionnaire
-        num_low = niveaux_energie.get(tuple_low, None)
-
-        # Ajouter les éléments non nuls
-        if num_up is not None and (ground_energy_status == 1 or tuple_up != fondamental):
-            lignes.append(i)
-            colonnes.append(num_up)
-            valeurs.append(1)  # 1 pour le niveau supérieur
-
-        if num_low is not None and (ground_energy_status == 1 or tuple_low != fondamental):
-            lignes.append(i)
-            colonnes.append(num_low)
-            valeurs.append(-1)  # -1 pour le niveau inférieur
-
-    # Créer la matrice COO avec la taille correcte
-    nombre_transitions = len(rows)  # Nombre de transitions
-    nombre_niveaux_energie = compteur  # Nombre de niveaux d'énergie
-    taille_A = (nombre_transitions, nombre_niveaux_energie)  # Taille de la matrice A
-    print(f"Taille de la matrice A : {taille_A}")
-
-    matrice_coo = coo_matrix((valeurs, (lignes, colonnes)), shape=taille_A)
-    return matrice_coo
-
-# Générer la matrice de design en représentation COO
-matrice_coo = generer_matrice_design_coo()
-
-# Supprimer les doublons dans la matrice COO
-matrice_coo.sum_duplicates()
-
-# Convertir la matrice COO en DataFrame pour l'exportation
-df_matrice_coo = pd.DataFrame({
-    'Ligne': matrice_coo.row,  # Indices de ligne des éléments non nuls
-    'Colonne': matrice_coo.col,  # Indices de colonne des éléments non nuls
-    'Valeur': matrice_coo.data  # Valeurs des éléments non nuls
-})
-
-# Enregistrer la matrice COO dans un fichier Excel
-df_matrice_coo.to_excel('matrice_design_coo.xlsx', index=False)
-print("La matrice de design en représentation COO a été enregistrée dans 'matrice_design_coo.xlsx'.")
-
-# Convertir la matrice COO en CSR
-matrice_csr = matrice_coo.tocsr()
-
-# Afficher des informations sur la matrice CSR
-print("Matrice CSR :")
-print(f"- Shape : {matrice_csr.shape}")
-print(f"- Nombre d'éléments non nuls : {matrice_csr.nnz}")
-
-# Convertir la matrice CSR en DataFrame pour l'exportation
-lignes, colonnes = matrice_csr.nonzero()  # Indices de ligne et de colonne
-valeurs = matrice_csr.data  # Valeurs non nulles
-
-# Vérifier que les tableaux ont la même longueur
-if len(lignes) == len(colonnes) == len(valeurs):
-    df_matrice_csr = pd.DataFrame({
-        'Ligne': lignes,  # Indices de ligne des éléments non nuls
-        'Colonne': colonnes,  # Indices de colonne des éléments non nuls
-        'Valeur': valeurs  # Valeurs des éléments non nuls
-    })
-else:
-    # Afficher les incohérences
-    print("Incohérence détectée :")
-    print(f"- lignes : {lignes}")
-    print(f"- colonnes : {colonnes}")
-    print(f"- valeurs : {valeurs}")
-    raise ValueError("Les tableaux d'indices et de valeurs n'ont pas la même longueur.")
-
-# Enregistrer la matrice CSR dans un fichier Excel
-df_matrice_csr.to_excel('matrice_design_csr.xlsx', index=False)
-print("La matrice de design en représentation CSR a été enregistrée dans 'matrice_design_csr.xlsx'.")
-
-# Récupérer les valeurs de wavenumber et uncertainty pour construire les poids
-cursor.execute('SELECT wavenumber, uncertainty FROM transitions')
-rows = cursor.fetchall()
-
-# Extraire les wavenumbers et les incertitudes
-wavenumbers = np.array([row[0] for row in rows])
-uncertainties = np.array([row[1] for row in rows])
-
-# Calculer les poids w = 1 / (uncertainty ** 2)
-weights = 1 / (uncertainties ** 2)
-W=diags(weights)
-# Calculer le scaling factor (valeur maximale des poids)
-# scaling_factor = np.max(weights)
-# print(f"Scaling factor (max(weights)) : {scaling_factor}")
-
-# Normaliser les poids
-# weights_normalized = weights / scaling_factor
-
-# Construire la matrice diagonale W avec les poids normalisés
-#W = diags(weights_normalized)
-
-# Sauvegarder wavenumbers et weights dans le même fichier
-data_to_save = np.column_stack((wavenumbers, weights))  # Concaténation des deux tableaux
-np.savetxt('wavenumbers_and_weights.txt', data_to_save, fmt='%.8f', header='wavenumber weight', comments='')
-print("Les tableaux wavenumber et weight ont été sauvegardés dans 'wavenumbers_and_weights.txt'.")
-
-# Construire le système linéaire M x = y
-A = matrice_csr  # La matrice de design en format CSR
-b = wavenumbers  # Le vecteur des wavenumbers
-
-# Calculer M = A^T W A
-M = A.T @ W @ A
-
-# Convertir M en DataFrame pour l'exportation
-M_dense = M.toarray()  # Convertir en format dense
-df_M = pd.DataFrame(M_dense)
-
-# Enregistrer M dans un fichier Excel
-df_M.to_excel('matrice_M.xlsx', index=False)
-print("La matrice M a été enregistrée dans 'matrice_M.xlsx'.")
-
-# Calculer y = A^T W b
-y = A.T @ W @ b
-
-# Résoudre le système M x = y en utilisant la décomposition de Cholesky
-# Vérifier que M est symétrique et définie positive
-try:
-    # Factorisation de Cholesky
-    c, lower = cho_factor(M.toarray())  # Convertir M en format dense pour Cholesky
-    # Résolution du système
-    x = cho_solve((c, lower), y)
-    print("Résolution du système linéaire réussie.")
-except Exception as e:
-    print(f"Erreur lors de la résolution du système linéaire : {e}")
-    raise
-
-# Sauvegarder les résultats
-np.savetxt('energies.txt', x)
-print("Les énergies calculées ont été sauvegardées dans 'energies.txt'.")
-
-# Fermer la connexion à la base de données
-conn.close()
+from cholesky_creux import METHODES_RESOLUTION, FactorisationCholesky
+from solveur_iteratif import OperateurNormal, resoudre_iteratif
+from inversion_selective import inverser_selectivement
+from reponderation import reponderation_robuste
+from assemblage import numeros_niveaux, MotifNormal
+from ancrage import AnalyseComposantes, resoudre_par_composantes, ANCRAGES
+from qr_creux import resoudre_par_qr
+from diagnostics import diagnostics_transitions, afficher_diagnostics
+from bootstrap import bootstrap, MODES_BOOTSTRAP
+from cache_niveaux import CacheSysteme
+from export_matrices import exporter_matrice
+import os
+from instrumentation import profil_demande
+
+# Paramètres du mode itératif (gradient conjugué préconditionné sans former M)
+ALGORITHME_ITERATIF = 'cg'  # 'cg' ou 'lsqr'
+PRECONDITIONNEUR = 'arbre'  # 'jacobi', 'arbre' ou 'aucun'
+TOLERANCE_ITERATIVE = 1e-12
+ITERATIONS_MAX = 5000
+
+# Paires de niveaux (nombres quantiques) dont on veut la covariance, écrite dans 'covariances.txt'
+# Exemple : [((0, 0, 0, 1, 1, 1), (0, 0, 0, 2, 0, 2))]
+PAIRES_COVARIANCE = []
+
+# Ancrage des composantes sans transition vers le fondamental : 'reference' (énergies relatives à un
+# niveau de référence de la composante) ou 'regularisation' (énergie moyenne nulle sur la composante)
+ANCRAGE = 'reference'
+if ANCRAGE not in ANCRAGES:
+    raise ValueError(f"L'ancrage doit être l'un de {ANCRAGES}.")
+
+# Niveaux de référence préférés des composantes flottantes (nombres quantiques) ; à défaut, le niveau
+# aux plus petits nombres quantiques de la composante. Exemple : [(1, 0, 0, 0, 0, 0)]
+NIVEAUX_REFERENCE = []
+
+# Leviers et résidus supprimés de chaque transition, écrits dans 'diagnostics_transitions.txt'
+# (méthodes directes et robuste, à partir de l'inversion sélective des incertitudes)
+DIAGNOSTICS_TRANSITIONS = True
+
+# Incertitudes des niveaux par bootstrap, écrites dans 'incertitudes_bootstrap.txt' (0 répliques : désactivé ;
+# méthodes directes et robuste) : 'reechantillonnage' (transitions tirées avec remise) ou 'perturbation'
+# (nombres d'ondes perturbés de leur incertitude). None : un processus par cœur
+BOOTSTRAP_REPLIQUES = 0
+BOOTSTRAP_MODE = 'reechantillonnage'
+BOOTSTRAP_PROCESSUS = 1
+if BOOTSTRAP_MODE not in MODES_BOOTSTRAP:
+    raise ValueError(f"Le mode de bootstrap doit être l'un de {MODES_BOOTSTRAP}.")
+
+# Format d'export des matrices A et M : 'npz', 'mtx', 'parquet', 'csv' ou 'xlsx' (petites matrices seulement)
+FORMAT_EXPORT = 'npz'
+
+
+def main():
+    """Résolution interactive ; exécutée seulement dans le processus principal.
+
+    Avec spawn ou forkserver, chaque processus du bootstrap réimporte ce module :
+    le garde __main__ évite qu'il repose les questions et relance la résolution.
+    """
+    # Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+    profil_demande()
+
+    # Se connecter à la base de données SQLite
+    conn = connecter('marvel.db')
+    cursor = conn.cursor()
+
+    # Charger les nombres quantiques de l'état fondamental depuis Qnames.json
+    with open('Qnames.json', 'r') as f:
+        qnames_data = json.load(f)
+        fondamental = tuple(qnames_data['ground_state_numbers'])  # Convertir en tuple
+
+    # Lire ground_energy_status depuis le clavier
+    ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'fixed' ou 1 'free') : "))
+    if ground_energy_status not in [0, 1]:
+        raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
+
+    # Lire la méthode de résolution depuis le clavier (Cholesky creux par défaut)
+    methodes_disponibles = METHODES_RESOLUTION + ('qr', 'iterative', 'robuste')
+    methode_resolution = input("Entrez la méthode de résolution ('creuse', 'dense', 'mixte', 'qr', 'iterative' ou 'robuste') [creuse] : ").strip() or 'creuse'
+    if methode_resolution not in methodes_disponibles:
+        raise ValueError(f"La méthode de résolution doit être l'une de {methodes_disponibles}.")
+
+    # Lire les transitions et numéroter les niveaux d'énergie (relus depuis le cache si la base n'a pas changé)
+    # Ignorer le niveau fondamental si ground_energy_status == 0
+    cache = CacheSysteme(cursor, fondamental=fondamental, exclure_fondamental=(ground_energy_status == 0))
+    codec, cles_niveaux, idx_up, idx_low, transitions = cache.niveaux()
+    compteur = cles_niveaux.shape[0]  # Nombre de niveaux d'énergie
+
+    # Composantes connexes (blocs de M) et détection des composantes flottantes, à partir des indices de niveaux ;
+    # le fondamental, s'il est libre, sert de référence à sa composante
+    references = numeros_niveaux(codec, cles_niveaux, [fondamental] + list(NIVEAUX_REFERENCE))
+    analyse = AnalyseComposantes(idx_up, idx_low, compteur, cles_niveaux=cles_niveaux, references=references,
+                                 ancrage=ANCRAGE)
+    analyse.afficher(codec, cles_niveaux)
+    if analyse.nombre_flottantes:
+        with open('composantes_flottantes.json', 'w') as f:
+            json.dump(analyse.decrire(codec, cles_niveaux), f, indent=1)
+        print("La liste des composantes flottantes a été sauvegardée dans 'composantes_flottantes.json'.")
+
+    # Générer la matrice de design directement en représentation CSR
+    matrice_csr = cache.matrice_design()
+    print(f"Taille de la matrice A : {matrice_csr.shape}")
+
+    # Exporter la matrice de design en représentation COO puis CSR (éléments non nuls, sans densifier)
+    chemin = exporter_matrice(matrice_csr.tocoo(), 'matrice_design_coo', FORMAT_EXPORT)
+    print(f"La matrice de design en représentation COO a été enregistrée dans '{chemin}'.")
+
+    # Afficher des informations sur la matrice CSR
+    print("Matrice CSR :")
+    print(f"- Shape : {matrice_csr.shape}")
+    print(f"- Nombre d'éléments non nuls : {matrice_csr.nnz}")
+
+    chemin = exporter_matrice(matrice_csr, 'matrice_design_csr', FORMAT_EXPORT)
+    print(f"La matrice de design en représentation CSR a été enregistrée dans '{chemin}'.")
+
+    # Récupérer les valeurs de wavenumber et uncertainty pour construire les poids
+    wavenumbers = transitions['wavenumber']
+    uncertainties = transitions['uncertainty']
+
+    # Calculer les poids w = 1 / (uncertainty ** 2)
+    weights = cache.poids()
+    # Calculer le scaling factor (valeur maximale des poids)
+    # scaling_factor = np.max(weights)
+    # print(f"Scaling factor (max(weights)) : {scaling_factor}")
+
+    # Normaliser les poids
+    # weights_normalized = weights / scaling_factor
+
+    # Construire la matrice diagonale W avec les poids normalisés
+    #W = diags(weights_normalized)
+
+    # Sauvegarder wavenumbers et weights dans le même fichier
+    data_to_save = np.column_stack((wavenumbers, weights))  # Concaténation des deux tableaux
+    np.savetxt('wavenumbers_and_weights.txt', data_to_save, fmt='%.8f', header='wavenumber weight', comments='')
+    print("Les tableaux wavenumber et weight ont été sauvegardés dans 'wavenumbers_and_weights.txt'.")
+
+    # Construire le système linéaire M x = y
+    A = matrice_csr  # La matrice de design en format CSR
+    b = wavenumbers  # Le vecteur des wavenumbers
+
+    # Inversion sélective et poids utilisés pour les diagnostics des transitions (méthodes directes et robuste)
+    inversion = None
+    poids_diagnostics = weights
+
+    if methode_resolution == 'iterative':
+        # Appliquer A et A^T W comme opérateurs, à partir des indices de niveaux de chaque transition
+        operateur = OperateurNormal(idx_up, idx_low, weights, A.shape[1])
+
+        # Démarrage à chaud depuis les énergies précédentes si leur taille correspond
+        x0 = None
+        if os.path.exists('energies.txt'):
+            energies_precedentes = np.atleast_1d(np.loadtxt('energies.txt'))
+            if energies_precedentes.shape[0] == A.shape[1]:
+                x0 = energies_precedentes
+                print("Démarrage à chaud depuis 'energies.txt'.")
+
+        x, historique = resoudre_iteratif(operateur, b, algorithme=ALGORITHME_ITERATIF, x0=x0,
+                                          tolerance=TOLERANCE_ITERATIVE, iterations_max=ITERATIONS_MAX,
+                                          preconditionneur=PRECONDITIONNEUR)
+        # M est singulière sur les composantes flottantes : les ramener à la jauge de l'ancrage
+        x = analyse.fixer_jauge(x)
+        np.savetxt('convergence.txt', np.array(historique), header='residu_relatif', comments='')
+        print(f"Résolution itérative terminée : résidu relatif final {historique[-1]:.3e}.")
+        print("L'historique de convergence a été sauvegardé dans 'convergence.txt'.")
+    elif methode_resolution == 'robuste':
+        # Repondération robuste : même motif de M et même ordonnancement à chaque itération
+        motif = MotifNormal(idx_up, idx_low, A.shape[1])
+        x, incertitudes_transitions, historique, factorisation = reponderation_robuste(motif, b, uncertainties,
+                                                                                       analyse=analyse)
+        pd.DataFrame(historique).to_csv('reponderation.txt', sep=' ', index=False)
+        print("Les statistiques de la repondération ont été sauvegardées dans 'reponderation.txt'.")
+        np.savetxt('incertitudes_transitions.txt', np.column_stack((transitions['id'], incertitudes_transitions)),
+                   fmt=['%d', '%.8e'], header='id uncertainty', comments='')
+        print("Les incertitudes repondérées des transitions ont été sauvegardées dans 'incertitudes_transitions.txt'.")
+
+        # Incertitudes des niveaux à partir de la dernière factorisation
+        inversion = inverser_selectivement(factorisation)
+        poids_diagnostics = 1 / incertitudes_transitions ** 2
+        variances = analyse.corriger_variances(inversion.variances())
+        np.savetxt('incertitudes.txt', np.sqrt(variances))
+        print("Les incertitudes des énergies ont été sauvegardées dans 'incertitudes.txt'.")
+    else:
+        if methode_resolution == 'qr':
+            # Moindres carrés par QR de √W A, sans former M (le conditionnement n'est pas élevé au carré)
+            try:
+                x, factorisation = resoudre_par_qr(A, weights, b, analyse, retourner_factorisation=True)
+                print("Résolution par QR réussie.")
+            except Exception as e:
+                print(f"Erreur lors de la résolution par QR : {e}")
+                raise
+        else:
+            # Assembler directement M = A^T W A et y = A^T W b à partir des indices de niveaux (sans former W), ou les relire du cache
+            M, y = cache.equations_normales()
+            cache.afficher_etat()
+
+            # Exporter M (dense seulement en Excel, réservé aux petites matrices)
+            chemin = exporter_matrice(M, 'matrice_M', FORMAT_EXPORT, dense=True)
+            print(f"La matrice M a été enregistrée dans '{chemin}'.")
+
+            # Résoudre le système M x = y en utilisant la décomposition de Cholesky
+            # Vérifier que M est symétrique et définie positive
+            try:
+                # Factorisation de Cholesky (creuse ou dense) de tous les blocs en une fois, composantes flottantes ancrées
+                x, factorisation = resoudre_par_composantes(M, y, analyse, methode=methode_resolution,
+                                                            retourner_factorisation=True)
+                print("Résolution du système linéaire réussie.")
+            except Exception as e:
+                print(f"Erreur lors de la résolution du système linéaire : {e}")
+                raise
+
+        # Incertitudes des niveaux : diagonale de M^-1 par inversion sélective à partir du facteur (ou de R)
+        inversion = inverser_selectivement(factorisation)
+        incertitudes = np.sqrt(analyse.corriger_variances(inversion.variances()))
+        np.savetxt('incertitudes.txt', incertitudes)
+        print("Les incertitudes des énergies ont été sauvegardées dans 'incertitudes.txt'.")
+
+        # Covariances des paires de niveaux demandées
+        if PAIRES_COVARIANCE:
+            paires = numeros_niveaux(codec, cles_niveaux, [niveau for paire in PAIRES_COVARIANCE for niveau in paire])
+            if np.any(paires < 0):
+                raise ValueError("Un niveau de PAIRES_COVARIANCE est absent du système (ou est le fondamental fixé).")
+            covariances = analyse.corriger_covariances(paires.reshape(-1, 2), inversion.covariances(paires.reshape(-1, 2)))
+            with open('covariances.txt', 'w') as f:
+                f.write('niveau_1 niveau_2 covariance\n')
+                for (niveau_1, niveau_2), covariance in zip(PAIRES_COVARIANCE, covariances):
+                    f.write(f"{list(niveau_1)} {list(niveau_2)} {covariance:.10e}\n")
+            print("Les covariances demandées ont été sauvegardées dans 'covariances.txt'.")
+
+    # Leviers h = w aᵀ M⁻¹ a et résidus supprimés de toutes les transitions, en un lot depuis l'inversion sélective
+    if DIAGNOSTICS_TRANSITIONS and inversion is not None:
+        diagnostics = diagnostics_transitions(idx_up, idx_low, poids_diagnostics, b, x, inversion)
+        diagnostics.insert(0, 'id', np.asarray(transitions['id']))
+        diagnostics.to_csv('diagnostics_transitions.txt', sep=' ', index=False)
+        afficher_diagnostics(diagnostics, nombre_parametres=A.shape[1] - analyse.nombre_flottantes)
+        print("Les leviers et résidus supprimés des transitions ont été sauvegardés dans 'diagnostics_transitions.txt'.")
+
+    # Bootstrap : répliques résolues dans un groupe de processus qui partagent le motif de M et l'ordonnancement
+    if BOOTSTRAP_REPLIQUES and inversion is not None:
+        if methode_resolution != 'robuste':
+            motif = MotifNormal(idx_up, idx_low, A.shape[1])
+        permutation = factorisation.q if isinstance(factorisation, FactorisationCholesky) else None
+        statistiques, _ = bootstrap(motif, analyse, poids_diagnostics, b, 1 / np.sqrt(poids_diagnostics),
+                                    mode=BOOTSTRAP_MODE, nombre_repliques=BOOTSTRAP_REPLIQUES,
+                                    nombre_processus=BOOTSTRAP_PROCESSUS, permutation=permutation,
+                                    energies=x)
+        incertitudes_bootstrap = statistiques.ecarts_types()
+        incertitudes_analytiques = np.sqrt(analyse.corriger_variances(inversion.variances()))
+        np.savetxt('incertitudes_bootstrap.txt', np.column_stack((incertitudes_bootstrap, statistiques.nombre)),
+                   fmt=['%.10e', '%d'], header='incertitude_bootstrap repliques', comments='')
+        comparables = (incertitudes_analytiques > 0) & np.isfinite(incertitudes_bootstrap)
+        if np.any(comparables):
+            print(f"Bootstrap ({BOOTSTRAP_MODE}) : rapport médian à l'incertitude analytique "
+                  f"{np.median(incertitudes_bootstrap[comparables] / incertitudes_analytiques[comparables]):.3f}.")
+        print("Les incertitudes bootstrap des énergies ont été sauvegardées dans 'incertitudes_bootstrap.txt'.")
+
+    # Sauvegarder les résultats
+    np.savetxt('energies.txt', x)
+    print("Les énergies calculées ont été sauvegardées dans 'energies.txt'.")
+
+    # Fermer la connexion à la base de données
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,170 +1,90 @@
-import sqlite3
-from bidict import bidict
+from acces_donnees import connecter
 import json
-import pandas as pd
-from scipy.sparse import coo_matrix, csr_matrix, diags
+import os
 import numpy as np
-from scipy.linalg import cho_factor, cho_solve
-
-# Se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
-cursor = conn.cursor()
-
-# Charger les nombres quantiques de l'état fondamental depuis Qnames.json
-with open('Qnames.json', 'r') as f:
-    qnames_data = json.load(f)
-    fondamental = tuple(qnames_data['ground_state_numbers'])  # Convertir en tuple
-
-# Lire ground_energy_status depuis le clavier
-ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'fixed' ou 1 'free') : "))
-if ground_energy_status not in [0, 1]:
-    raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
-
-# Fonction pour explorer les transitions d'une composante connexe et remplir le bidictionnaire
-def explorer_transitions_et_remplir_bidict(component_id):
-    global compteur  # Utiliser le compteur global
-
-    # Récupérer les transitions de la composante connexe
-    cursor.execute('''
-        SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low 
-        FROM components 
-        WHERE component = ?
-    ''', (component_id,))
-    rows = cursor.fetchall()
-
-    # Parcourir chaque enregistrement
-    for row in rows:
-        quantum_numbers_up = row[3]  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = row[4]  # Nombres quantiques de l'état inférieur
-
-        # Convertir les chaînes JSON en listes Python
-        try:
-            liste_up = json.loads(quantum_numbers_up)  # Convertir "[1, 2, 3]" en [1, 2, 3]
-            liste_low = json.loads(quantum_numbers_low)  # Convertir "[0, 1, 2]" en [0, 1, 2]
-        except json.JSONDecodeError:
-            print(f"Erreur : Impossible de parser les nombres quantiques : {quantum_numbers_up} ou {quantum_numbers_low}")
-            continue
-
-        # Convertir les listes en tuples
-        tuple_up = tuple(liste_up)
-        tuple_low = tuple(liste_low)
-
-        # Ajouter les tuples au bidictionnaire avec un numéro séquentiel
-        # Ignorer le niveau fondamental si ground_energy_status == 0
-        if ground_energy_status == 1 or tuple_up != fondamental:
-            if tuple_up not in niveaux_energie:
-                niveaux_energie[tuple_up] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-        if ground_energy_status == 1 or tuple_low != fondamental:
-            if tuple_low not in niveaux_energie:
-                niveaux_energie[tuple_low] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-# Fonction pour générer la matrice de design en représentation COO pour une composante connexe
-# ici
-def generer_matrice_design_coo(component_id):
-    # Récupérer les transitions de la composante connexe
-    cursor.execute('''
-        SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low 
-        FROM components 
-        WHERE component = ?
-    ''', (component_id,))
-    rows = cursor.fetchall()
-
-    # Initialiser des listes pour les indices et les valeurs non nulles
-    lignes = []  # Indices de ligne
-    colonnes = []  # Indices de colonne
-    valeurs = []  # Valeurs non nulles
-
-    # Remplir les listes pour la représentation COO
-    for i, row in enumerate(rows):
-        quantum_numbers_up = json.loads(row[3])  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = json.loads(row[4])  # Nombres quantiques de l'état inférieur
-
-        # Convertir en tuples
-        tuple_up = tuple(quantum_numbers_up)
-        tuple_low = tuple(quantum_numbers_low)
-
-        # Récupérer les numéros associés
-        num_up = niveaux_energie.get(tuple_up, None)  # Utiliser None si le niveau n'est pas dans le dictionnaire
-        num_low = niveaux_energie.get(tuple_low, None)
-
-        # Ajouter les éléments non nuls
-        if num_up is not None and (ground_energy_status == 1 or tuple_up != fondamental):
-            lignes.append(i)
-            colonnes.append(num_up)
-            valeurs.append(1)  # 1 pour le niveau supérieur
-
-        if num_low is not None and (ground_energy_status == 1 or tuple_low != fondamental):
-            lignes.append(i)
-            colonnes.append(num_low)
-            valeurs.append(-1)  # -1 pour le niveau inférieur
-
-    # Créer la matrice COO avec la taille correcte
-    nombre_transitions = len(rows)  # Nombre de transitions
-    nombre_niveaux_energie = compteur  # Nombre de niveaux d'énergie
-    taille_A = (nombre_transitions, nombre_niveaux_energie)  # Taille de la matrice A
-    print(f"Taille de la matrice A pour la composante {component_id} : {taille_A}")
-
-    matrice_coo = coo_matrix((valeurs, (lignes, colonnes)), shape=taille_A)
-    return matrice_coo, rows
-# Récupérer la liste des composantes connexes
-cursor.execute('SELECT DISTINCT component FROM components')
-components = cursor.fetchall()
-
-# Boucle sur chaque composante connexe
-for component in components:
-    component_id = component[0]
-    print(f"\nTraitement de la composante connexe {component_id}...")
-
-    # Réinitialiser le bidictionnaire et le compteur pour chaque composante
-    niveaux_energie = bidict()
-    compteur = 0
-
-    # Explorer les transitions et remplir le bidictionnaire
-    explorer_transitions_et_remplir_bidict(component_id)
-
-    # Générer la matrice de design en représentation COO
-    matrice_coo, rows = generer_matrice_design_coo(component_id)
-
-    # Supprimer les doublons dans la matrice COO
-    matrice_coo.sum_duplicates()
-
-    # Convertir la matrice COO en CSR
-    matrice_csr = matrice_coo.tocsr()
-
-    # Récupérer les valeurs de wavenumber et uncertainty pour construire les poids
-    wavenumbers = np.array([row[1] for row in rows])
-    uncertainties = np.array([row[2] for row in rows])
-    # Calculer les poids w = 1 / (uncertainty ** 2)
-    weights = 1 / (uncertainties ** 2)
-    W = diags(weights)
-
-    # Construire le système linéaire M x = y
-    A = matrice_csr  # La matrice de design en format CSR
-    b = wavenumbers  # Le vecteur des wavenumbers
-
-    # Calculer M = A^T W A
-    M = A.T @ W @ A
-
-    # Calculer y = A^T W b
-    y = A.T @ W @ b
-
-    # Résoudre le système M x = y en utilisant la décomposition de Cholesky
-    try:
-        # Factorisation de Cholesky
-        c, lower = cho_factor(M.toarray())  # Convertir M en format dense pour Cholesky
-        # Résolution du système
-        x = cho_solve((c, lower), y)
-        print(f"Résolution du système linéaire pour la composante {component_id} réussie.")
-    except Exception as e:
-        print(f"Erreur lors de la résolution du système linéaire pour la composante {component_id} : {e}")
-        continue
-
-    # Sauvegarder les résultats
-    np.savetxt(f'energies_component_{component_id}.txt', x)
-    print(f"Les énergies calculées pour la composante {component_id} ont été sauvegardées dans 'energies_component_{component_id}.txt'.")
-
-# Fermer la connexion à la base de données
-conn.close()
+from assemblage import lire_transitions
+from codec_niveaux import CodecNiveaux
+from cholesky_creux import METHODES_RESOLUTION
+from resolution_parallele import separer_composantes, resoudre_composantes_parallele
+from instrumentation import profil_demande
+
+# Transitions de toutes les composantes, lues en une seule requête (tableaux NumPy)
+REQUETE_COMPOSANTES = '''
+    SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low 
+    FROM components 
+    ORDER BY rowid
+'''
+
+
+def main():
+    """Résout toutes les composantes ; exécutée seulement dans le processus principal.
+
+    Avec spawn ou forkserver, chaque processus du pool réimporte ce module : le
+    garde __main__ évite qu'il repose les questions et relance un pool.
+    """
+    # Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+    profil_demande()
+
+    # Se connecter à la base de données SQLite
+    conn = connecter('marvel.db')
+    cursor = conn.cursor()
+
+    # Charger les nombres quantiques de l'état fondamental depuis Qnames.json
+    with open('Qnames.json', 'r') as f:
+        qnames_data = json.load(f)
+        fondamental = tuple(qnames_data['ground_state_numbers'])  # Convertir en tuple
+
+    # Lire ground_energy_status depuis le clavier
+    ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'fixed' ou 1 'free') : "))
+    if ground_energy_status not in [0, 1]:
+        raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
+
+    # Lire la méthode de résolution depuis le clavier (Cholesky creux par défaut)
+    methode_resolution = input("Entrez la méthode de résolution ('creuse', 'dense' ou 'mixte') [creuse] : ").strip() or 'creuse'
+    if methode_resolution not in METHODES_RESOLUTION:
+        raise ValueError(f"La méthode de résolution doit être l'une de {METHODES_RESOLUTION}.")
+
+    # Nombre de processus pour la résolution des composantes (1 = séquentiel)
+    nombre_coeurs = os.cpu_count() or 1
+    saisie = input(f"Entrez le nombre de processus pour la résolution (1 = séquentiel) [{nombre_coeurs}] : ").strip()
+    nombre_processus = int(saisie) if saisie else nombre_coeurs
+    if nombre_processus < 1:
+        raise ValueError("Le nombre de processus doit être au moins 1.")
+
+    # Lire les transitions de toutes les composantes en une seule requête (tableaux NumPy)
+    transitions = lire_transitions(cursor, REQUETE_COMPOSANTES)
+    cursor.execute('SELECT component FROM components ORDER BY rowid')
+    composantes = np.array([ligne[0] for ligne in cursor.fetchall()], dtype=np.int64)
+
+    # Fermer la connexion à la base de données avant de lancer les processus
+    conn.close()
+
+    # Codec des niveaux construit une fois pour toutes les composantes (Qnames.json lu une seule fois)
+    valide = transitions['valide']
+    codec = CodecNiveaux.depuis_qnames(transitions['qn_up'][valide], transitions['qn_low'][valide])
+
+    # Séparer les composantes connexes puis les résoudre (les plus grandes en premier)
+    par_composante = separer_composantes(transitions, composantes)
+    energies, incertitudes, erreurs = resoudre_composantes_parallele(par_composante, fondamental,
+                                                                     exclure_fondamental=(ground_energy_status == 0),
+                                                                     methode=methode_resolution,
+                                                                     nombre_processus=nombre_processus, codec=codec)
+
+    for component_id, message in sorted(erreurs.items()):
+        print(f"Erreur lors de la résolution du système linéaire pour la composante {component_id} : {message}")
+
+    # Sauvegarder les résultats, composante par composante
+    for component_id, x in sorted(energies.items()):
+        np.savetxt(f'energies_component_{component_id}.txt', x)
+        np.savetxt(f'incertitudes_component_{component_id}.txt', incertitudes[component_id])
+    print(f"Les énergies de {len(energies)} composantes ont été sauvegardées dans 'energies_component_<id>.txt'.")
+    print("Leurs incertitudes ont été sauvegardées dans 'incertitudes_component_<id>.txt'.")
+
+    # Rassembler toutes les énergies dans un seul fichier, indexé par composante
+    np.savez('energies_components.npz', **{f'composante_{component_id}': x for component_id, x in sorted(energies.items())})
+    np.savez('incertitudes_components.npz', **{f'composante_{component_id}': sigma for component_id, sigma in sorted(incertitudes.items())})
+    print("Les énergies et incertitudes de toutes les composantes ont été rassemblées dans 'energies_components.npz' et 'incertitudes_components.npz'.")
+
+
+if __name__ == '__main__':
+    main()
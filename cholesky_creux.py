@@ -0,0 +1,299 @@
+import numpy as np
+from scipy.sparse import csc_matrix, diags
+from scipy.sparse.linalg import splu
+from scipy.linalg import cho_factor, cho_solve
+
+from instrumentation import etape
+
+# CHOLMOD (scikit-sparse) est utilisé s'il est installé, sinon SuperLU (scipy)
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
+# Méthodes de résolution disponibles pour le système M x = y
+METHODES_RESOLUTION = ('creuse', 'dense', 'mixte')
+
+# Ordonnancements réducteurs de remplissage acceptés par SuperLU
+ORDONNANCEMENTS = ('MMD_AT_PLUS_A', 'COLAMD', 'MMD_ATA', 'NATURAL')
+
+# Raffinement itératif du mode 'mixte' : arrêt quand ‖y - M x‖∞ <= ‖M‖∞ ‖x‖∞ ε √n
+# (critère de dsposv, LAPACK) ; retour à la double précision si le résidu n'a pas
+# diminué d'un facteur REDUCTION_MIN en FENETRE_STAGNATION itérations, ou après
+# ITERATIONS_RAFFINEMENT_MAX itérations
+ITERATIONS_RAFFINEMENT_MAX = 50
+FENETRE_STAGNATION = 5
+REDUCTION_MIN = 0.5
+
+
+class FactorisationCholesky:
+    """Factorisation de Cholesky creuse (forme LDLᵀ) de la matrice M = Aᵀ W A.
+
+    La factorisation vérifie M[q][:, q] = L D Lᵀ, où q est la permutation
+    réductrice de remplissage, L une matrice triangulaire inférieure creuse à
+    diagonale unité et D = diag(d). La mémoire consommée est celle du facteur L
+    (remplissage compris ; SuperLU garde aussi U = D Lᵀ) et non celle d'une
+    matrice dense n x n.
+
+    permutation permet de reprendre l'ordonnancement q d'une factorisation
+    d'une matrice de même motif (calculé dans un autre processus, par
+    exemple) : avec SuperLU, seule la factorisation de M[q][:, q] dans l'ordre
+    naturel est alors faite, comme dans refactoriser.
+    """
+
+    def __init__(self, M, ordonnancement='MMD_AT_PLUS_A', precision=np.float64, permutation=None):
+        if ordonnancement not in ORDONNANCEMENTS:
+            raise ValueError(f"Ordonnancement inconnu : {ordonnancement}. Valeurs possibles : {ORDONNANCEMENTS}")
+        self.ordonnancement = ordonnancement
+        # Type des valeurs du facteur : float32 n'est factorisé que par SuperLU
+        self.precision = np.dtype(precision)
+        self.n = M.shape[0]
+        self._cholmod = None
+        self._lu = None
+        self.q = None
+        # Vrai quand _lu factorise M[q][:, q] (ordre naturel) plutôt que M
+        self._permutee = False
+        if permutation is not None and (cholmod_cholesky is None or self.precision != np.float64):
+            self.q = np.asarray(permutation)
+            self.refactoriser(M)
+        else:
+            # Avec CHOLMOD, l'analyse symbolique (rapide) est refaite : elle n'est pas transmissible
+            self._factoriser(csc_matrix(M, dtype=self.precision), ordonnancement)
+
+    def _factoriser(self, M, ordonnancement):
+        if cholmod_cholesky is not None and self.precision == np.float64:
+            self._cholmod = cholmod_cholesky(M, ordering_method='amd' if ordonnancement != 'NATURAL' else 'natural')
+            self.q = np.asarray(self._cholmod.P())
+            self._verifier_pivots(self._cholmod.D(), M.diagonal()[self.q])
+            return
+
+        self._lu = self._superlu(M, ordonnancement)
+        # perm_c donne la position de chaque niveau dans la matrice factorisée
+        self.q = np.argsort(self._lu.perm_c)
+
+    def _superlu(self, M, ordonnancement):
+        # SuperLU en mode symétrique, sans pivotage hors diagonale : U = D Lᵀ
+        try:
+            lu = splu(M, permc_spec=ordonnancement, diag_pivot_thresh=0.0,
+                      options=dict(SymmetricMode=True))
+        except RuntimeError as e:
+            raise np.linalg.LinAlgError(f"M est singulière : {e}") from e
+        if not np.array_equal(lu.perm_r, lu.perm_c):
+            raise np.linalg.LinAlgError("La factorisation a dû pivoter : M n'est pas symétrique définie positive.")
+        self._lu = lu
+        self._verifier_pivots(lu.U.diagonal(), M.diagonal()[np.argsort(lu.perm_c)])
+        return lu
+
+    def refactoriser(self, M):
+        """Refactorise numériquement une matrice de même motif que la précédente.
+
+        L'ordonnancement (et, avec CHOLMOD, toute l'analyse symbolique) est
+        conservé : seules les valeurs changent, par exemple quand les poids des
+        transitions sont mis à jour. Avec SuperLU, la matrice M[q][:, q] est
+        factorisée dans l'ordre naturel, ce qui évite de recalculer q.
+        """
+        M = csc_matrix(M, dtype=self.precision)
+        if M.shape[0] != self.n:
+            raise ValueError(f"La matrice à refactoriser est de taille {M.shape[0]} au lieu de {self.n}.")
+        if self._cholmod is not None:
+            self._cholmod.cholesky_inplace(M)
+            self._verifier_pivots(self._cholmod.D(), M.diagonal()[self.q])
+            return
+        self._superlu(M[self.q][:, self.q].tocsc(), 'NATURAL')
+        self._permutee = True
+
+    def _verifier_pivots(self, d, diagonale):
+        """Rejette un pivot négatif, nul ou de l'ordre des erreurs d'arrondi.
+
+        Une matrice singulière (composante flottante sans ancrage) ne donne pas
+        un pivot exactement nul mais un résidu d'annulation de l'ordre de
+        ε M[j, j] : chaque pivot est comparé à l'élément diagonal de M
+        correspondant, avec la tolérance n ε.
+        """
+        rapports = d / np.maximum(np.abs(diagonale), np.finfo(np.float64).tiny)
+        if rapports.shape[0] and rapports.min() <= self.n * np.finfo(self.precision).eps:
+            position = int(np.argmin(rapports))
+            raise np.linalg.LinAlgError(f"M est singulière ou n'est pas définie positive (pivot {d[position]:.3e} pour "
+                                        f"un élément diagonal {diagonale[position]:.3e}, position {position}).")
+
+    def resoudre(self, y):
+        """Résout M x = y à partir du facteur (dans la précision du facteur)."""
+        y = np.asarray(y, dtype=self.precision)
+        if self._cholmod is not None:
+            return self._cholmod(y)
+        if self._permutee:
+            x = np.empty_like(y)
+            x[self.q] = self._lu.solve(y[self.q])
+            return x
+        return self._lu.solve(y)
+
+    def facteur_LD(self):
+        """Retourne (L, d, q) avec M[q][:, q] = L diag(d) Lᵀ."""
+        if self._cholmod is not None:
+            L, D = self._cholmod.L_D()
+            return csc_matrix(L), D.diagonal(), self.q
+        return csc_matrix(self._lu.L), self._lu.U.diagonal().copy(), self.q
+
+    @property
+    def nnz(self):
+        """Nombre d'éléments non nuls du facteur L (remplissage compris)."""
+        if self._cholmod is not None:
+            return self._cholmod.L().nnz
+        return self._lu.L.nnz
+
+    @property
+    def octets(self):
+        """Mémoire des valeurs et des indices des facteurs conservés.
+
+        CHOLMOD ne garde que L ; SuperLU garde L et U = D Lᵀ (mode symétrique
+        sans pivotage), soit à peu près deux fois plus.
+        """
+        if self._cholmod is not None:
+            return self.nnz * (self.precision.itemsize + 4)
+        return (self._lu.L.nnz + self._lu.U.nnz) * (self.precision.itemsize + 4)
+
+
+class FactorisationMixte:
+    """Factorisation de Cholesky en simple précision, énergies en double précision par raffinement itératif.
+
+    M est d'abord équilibrée, M̃ = S M S avec S = diag(M)^-½ (diagonale
+    unité) : les poids 1/σ² s'étalent sur de nombreux ordres de grandeur et
+    dépasseraient sinon la précision relative de float32. M̃ est factorisée en
+    float32 (valeurs du facteur deux fois plus légères, factorisation plus
+    rapide quand elle est dominée par les blocs denses du remplissage), puis
+    chaque résolution est raffinée avec M et y en float64.
+
+    La correction n'est pas la simple itération x += S M̃⁻¹ S r, qui diverge
+    dès que cond(M) dépasse 1/ε(float32) (cas des longues chaînes de niveaux) :
+    le facteur float32 sert de préconditionneur à un gradient conjugué mené en
+    float64 sur M, dont le résidu est recalculé à chaque itération. Si le
+    résidu stagne, ou si la factorisation float32 échoue, M est refactorisée
+    en double précision avec la même méthode d'ordonnancement ; la bascule est
+    définitive pour cette factorisation.
+    """
+
+    def __init__(self, M, ordonnancement='MMD_AT_PLUS_A', iterations_max=ITERATIONS_RAFFINEMENT_MAX):
+        self.M = csc_matrix(M, dtype=np.float64)
+        self.n = self.M.shape[0]
+        self.ordonnancement = ordonnancement
+        self.iterations_max = iterations_max
+        diagonale = self.M.diagonal()
+        self.echelle = 1 / np.sqrt(np.where(diagonale > 0, diagonale, 1.0))
+        S = diags(self.echelle)
+        self._simple = None
+        self._double = None
+        self._norme_M = abs(self.M).sum(axis=0).max()
+        # Itérations de raffinement de la dernière résolution
+        self.iterations = 0
+        try:
+            self._simple = FactorisationCholesky(S @ self.M @ S, ordonnancement=ordonnancement, precision=np.float32)
+        except np.linalg.LinAlgError as e:
+            self._basculer(f"échec de la factorisation en simple précision ({e})")
+
+    @property
+    def q(self):
+        return self._double.q if self._double is not None else self._simple.q
+
+    @property
+    def double_precision(self):
+        """Vrai si M a dû être refactorisée en float64."""
+        return self._double is not None
+
+    def _basculer(self, raison):
+        print(f"Précision mixte : {raison} ; refactorisation de M en double précision.")
+        with etape('factorisation_cholesky', lignes=self.n) as mesure:
+            self._double = FactorisationCholesky(self.M, ordonnancement=self.ordonnancement)
+            mesure['nnz'] = self._double.nnz
+        self._simple = None
+
+    def _preconditionner(self, r):
+        return self.echelle * self._simple.resoudre(self.echelle * r).astype(np.float64)
+
+    def resoudre(self, y):
+        """Résout M x = y en double précision."""
+        y = np.asarray(y, dtype=np.float64)
+        if self._double is not None:
+            return self._double.resoudre(y)
+        seuil = self._norme_M * np.finfo(np.float64).eps * np.sqrt(self.n)
+        x = self._preconditionner(y)
+        residu = y - self.M @ x
+        z = self._preconditionner(residu)
+        direction = z
+        rz = residu @ z
+        normes = []
+        for self.iterations in range(self.iterations_max + 1):
+            norme = np.abs(residu).max(initial=0.0)
+            if not np.isfinite(norme):
+                break
+            if norme <= seuil * np.abs(x).max(initial=0.0):
+                return x
+            normes.append(norme)
+            if (len(normes) > FENETRE_STAGNATION and norme > REDUCTION_MIN * normes[-1 - FENETRE_STAGNATION]) \
+                    or self.iterations == self.iterations_max:
+                break
+            Md = self.M @ direction
+            alpha = rz / (direction @ Md)
+            x = x + alpha * direction
+            residu = y - self.M @ x
+            z = self._preconditionner(residu)
+            rz_suivant = residu @ z
+            direction = z + (rz_suivant / rz) * direction
+            rz = rz_suivant
+        self._basculer(f"le raffinement stagne après {self.iterations} itération(s)")
+        return self._double.resoudre(y)
+
+    def facteur_LD(self):
+        """Retourne (L, d, q) avec M[q][:, q] = L diag(d) Lᵀ, à partir d'un facteur en double précision.
+
+        Les variances tirées d'un facteur float32 perdent toute précision quand
+        cond(M) approche 1/ε(float32) : l'inversion sélective bascule donc en
+        double précision. Le gain de mémoire du mode mixte ne porte que sur les
+        résolutions sans incertitudes.
+        """
+        if self._double is None:
+            self._basculer("facteur demandé pour l'inversion sélective")
+        return self._double.facteur_LD()
+
+    @property
+    def nnz(self):
+        return (self._double or self._simple).nnz
+
+    @property
+    def octets(self):
+        return (self._double or self._simple).octets
+
+
+def resoudre_equations_normales(M, y, methode='creuse', ordonnancement='MMD_AT_PLUS_A', retourner_factorisation=False):
+    """Résout M x = y par Cholesky creux ('creuse'), dense ('dense') ou creux en précision mixte ('mixte').
+
+    Si retourner_factorisation est vrai, retourne (x, factorisation) : une
+    FactorisationCholesky en mode creux, une FactorisationMixte en mode mixte,
+    le résultat de cho_factor en mode dense (utilisés par exemple pour les
+    incertitudes, voir inversion_selective).
+    """
+    if methode == 'creuse':
+        with etape('factorisation_cholesky', lignes=M.shape[0]) as mesure:
+            factorisation = FactorisationCholesky(M, ordonnancement=ordonnancement)
+            mesure['nnz'] = factorisation.nnz
+        print(f"Factorisation creuse : n = {M.shape[0]}, nnz(M) = {M.nnz}, nnz(L) = {factorisation.nnz}")
+        with etape('resolution_cholesky', lignes=M.shape[0]):
+            x = factorisation.resoudre(y)
+    elif methode == 'mixte':
+        with etape('factorisation_cholesky_simple', lignes=M.shape[0]) as mesure:
+            factorisation = FactorisationMixte(M, ordonnancement=ordonnancement)
+            mesure['nnz'] = factorisation.nnz
+        precision = 'double' if factorisation.double_precision else 'simple'
+        print(f"Factorisation creuse en {precision} précision : n = {M.shape[0]}, nnz(M) = {M.nnz}, "
+              f"nnz(L) = {factorisation.nnz}, facteurs {factorisation.octets / 1024 ** 2:.1f} Mo")
+        with etape('resolution_raffinement', lignes=M.shape[0]):
+            x = factorisation.resoudre(y)
+        if not factorisation.double_precision:
+            print(f"Raffinement itératif : {factorisation.iterations} itération(s).")
+    elif methode == 'dense':
+        with etape('factorisation_cholesky_dense', lignes=M.shape[0], nnz=M.shape[0] ** 2):
+            factorisation = cho_factor(M.toarray())  # Convertir M en format dense pour Cholesky
+        with etape('resolution_cholesky_dense', lignes=M.shape[0]):
+            x = cho_solve(factorisation, y)
+    else:
+        raise ValueError(f"Méthode de résolution inconnue : {methode}. Valeurs possibles : {METHODES_RESOLUTION}")
+    return (x, factorisation) if retourner_factorisation else x
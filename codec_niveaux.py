@@ -0,0 +1,76 @@
+import json
+import numpy as np
+
+# Nom du fichier JSON contenant les noms des nombres quantiques
+QNAMES_FILE = 'Qnames.json'
+
+# Nombre de bits disponibles dans une clé int64 positive
+BITS_DISPONIBLES = 63
+
+
+class CodecNiveaux:
+    """Code les nombres quantiques d'un niveau en un seul entier int64.
+
+    Chaque nombre quantique q_i est décalé de son minimum puis rangé sur
+    largeurs[i] bits (base mixte) : cle = Σ (q_i - minimums[i]) << decalages[i].
+    Le premier nombre quantique occupe les bits de poids fort, si bien que
+    l'ordre des clés est l'ordre lexicographique des tuples.
+    """
+
+    def __init__(self, noms, minimums, largeurs):
+        self.noms = list(noms)
+        self.minimums = np.asarray(minimums, dtype=np.int64)
+        self.largeurs = np.asarray(largeurs, dtype=np.int64)
+        if not (len(self.noms) == self.minimums.shape[0] == self.largeurs.shape[0]):
+            raise ValueError("Les noms, minimums et largeurs doivent avoir la même longueur.")
+        if self.largeurs.sum() > BITS_DISPONIBLES:
+            raise ValueError(f"Les nombres quantiques demandent {self.largeurs.sum()} bits, "
+                             f"plus que les {BITS_DISPONIBLES} disponibles dans un int64.")
+        # Décalage de chaque champ : somme des largeurs des champs suivants
+        self.decalages = np.concatenate((np.cumsum(self.largeurs[::-1])[::-1][1:], [0])).astype(np.int64)
+        self.maximums = self.minimums + (np.int64(1) << self.largeurs) - 1
+
+    @classmethod
+    def depuis_donnees(cls, noms, *tableaux):
+        """Déduit les bornes de chaque nombre quantique à partir des tableaux (n, k) fournis."""
+        tableaux = [np.asarray(t, dtype=np.int64) for t in tableaux]
+        if any(t.size and t.shape[-1] != len(noms) for t in tableaux):
+            raise ValueError(f"Le nombre de nombres quantiques ne correspond pas aux {len(noms)} noms : {noms}")
+        valeurs = np.vstack([t.reshape(-1, len(noms)) for t in tableaux])
+        if valeurs.shape[0] == 0:
+            return cls(noms, np.zeros(len(noms)), np.zeros(len(noms)))
+        minimums = valeurs.min(axis=0)
+        etendues = valeurs.max(axis=0) - minimums + 1
+        largeurs = np.ceil(np.log2(etendues)).astype(np.int64)
+        return cls(noms, minimums, largeurs)
+
+    @classmethod
+    def depuis_qnames(cls, *tableaux, fichier=QNAMES_FILE):
+        """Construit le codec avec les noms de Qnames.json ; l'état fondamental est toujours codable."""
+        with open(fichier, 'r') as f:
+            qnames_data = json.load(f)
+        fondamental = np.asarray(qnames_data['ground_state_numbers'], dtype=np.int64).reshape(1, -1)
+        return cls.depuis_donnees(qnames_data['quantum_names'], fondamental, *tableaux)
+
+    def encoder(self, qn):
+        """Code un tableau (n, k) de nombres quantiques en un tableau (n,) de clés int64."""
+        qn = np.asarray(qn, dtype=np.int64).reshape(-1, len(self.noms))
+        hors_bornes = np.any((qn < self.minimums) | (qn > self.maximums), axis=1)
+        if np.any(hors_bornes):
+            ligne = int(np.argmax(hors_bornes))
+            raise ValueError(f"Nombres quantiques hors des bornes du codec : {tuple(qn[ligne])}")
+        return ((qn - self.minimums) << self.decalages).sum(axis=1)
+
+    def encoder_tuple(self, niveau):
+        """Code un seul niveau (tuple de nombres quantiques)."""
+        return int(self.encoder(np.asarray(niveau).reshape(1, -1))[0])
+
+    def decoder(self, cles):
+        """Décode un tableau de clés int64 en tableau (n, k) de nombres quantiques."""
+        cles = np.asarray(cles, dtype=np.int64).reshape(-1, 1)
+        masques = (np.int64(1) << self.largeurs) - 1
+        return ((cles >> self.decalages) & masques) + self.minimums
+
+    def decoder_tuple(self, cle):
+        """Décode une clé en tuple de nombres quantiques."""
+        return tuple(int(q) for q in self.decoder(cle)[0])
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import etape
+
+# Une transition dont 1 - h est inférieur à ce seuil détermine seule un niveau (ou un sous-réseau) :
+# son résidu est nul quel que soit le nombre d'ondes mesuré, et sa suppression laisse ce niveau indéterminé
+TOLERANCE_LEVIER = 1e-6
+
+
+def diagnostics_transitions(idx_up, idx_low, poids, b, x, inversion):
+    """Leviers et résidus supprimés (leave-one-out) de toutes les transitions, en un seul lot.
+
+    La ligne a_i de A ne contient que +1 (niveau supérieur u) et -1 (niveau
+    inférieur l) : le levier h_i = w_i a_iᵀ M⁻¹ a_i ne demande que le bloc
+    2 x 2 de M⁻¹ sur (u, l),
+
+        h_i = w_i (Z[u, u] + Z[l, l] - 2 Z[u, l]),
+
+    dont les trois éléments sont dans le motif de L + Lᵀ (u et l sont voisins
+    dans M) : l'inversion sélective déjà calculée pour les incertitudes (objet
+    de inverser_selectivement) les fournit tous, sans résolution
+    supplémentaire. Un niveau exclu (fondamental fixé, indice -1) ne
+    contribue pas. Les termes d'ancrage des composantes flottantes
+    s'annulent dans a_iᵀ M⁻¹ a_i (a_i est de somme nulle sur sa composante) :
+    l'inversion est utilisée sans corriger_variances.
+
+    Le résidu que laisserait la transition si elle était retirée de
+    l'ajustement s'en déduit sans nouvelle résolution :
+
+        e_(i) = e_i / (1 - h_i),  t_i = e_i √w_i / √(1 - h_i)
+
+    où e_i = b_i - a_iᵀ x est le résidu ordinaire et t_i le résidu supprimé
+    studentisé (en unités de l'incertitude de la prédiction sans la
+    transition, à comparer à un seuil en σ). Une transition de levier
+    h ≈ 1 (voir TOLERANCE_LEVIER) détermine seule un niveau : elle est
+    signalée dans la colonne isolee et ses résidus supprimés valent NaN.
+
+    Retourne un DataFrame aligné sur les transitions : residu,
+    residu_normalise, levier, residu_supprime, residu_studentise, isolee.
+    """
+    idx_up = np.asarray(idx_up, dtype=np.int64)
+    idx_low = np.asarray(idx_low, dtype=np.int64)
+    poids = np.asarray(poids, dtype=float)
+    b = np.asarray(b, dtype=float)
+    with etape('diagnostics_transitions', lignes=idx_up.shape[0]):
+        haut = idx_up >= 0
+        bas = idx_low >= 0
+        prediction = np.where(haut, x[np.maximum(idx_up, 0)], 0.0) - np.where(bas, x[np.maximum(idx_low, 0)], 0.0)
+        residus = b - prediction
+
+        variances = inversion.variances()
+        quadratique = (np.where(haut, variances[np.maximum(idx_up, 0)], 0.0)
+                       + np.where(bas, variances[np.maximum(idx_low, 0)], 0.0))
+        deux_niveaux = haut & bas
+        if np.any(deux_niveaux):
+            paires = np.column_stack((idx_up[deux_niveaux], idx_low[deux_niveaux]))
+            quadratique[deux_niveaux] -= 2 * inversion.covariances(paires)
+        # Une transition d'un niveau vers lui-même a une ligne nulle dans A
+        quadratique[idx_up == idx_low] = 0.0
+        leviers = np.clip(poids * quadratique, 0.0, 1.0)
+
+        complement = 1 - leviers
+        isolees = complement <= TOLERANCE_LEVIER
+        complement_sur = np.where(isolees, 1.0, complement)
+        supprimes = np.where(isolees, np.nan, residus / complement_sur)
+        studentises = np.where(isolees, np.nan, residus * np.sqrt(poids) / np.sqrt(complement_sur))
+
+    return pd.DataFrame({
+        'residu': residus,
+        'residu_normalise': residus * np.sqrt(poids),
+        'levier': leviers,
+        'residu_supprime': supprimes,
+        'residu_studentise': studentises,
+        'isolee': isolees,
+    })
+
+
+def afficher_diagnostics(diagnostics, seuil=3.0, nombre_parametres=None):
+    """Résumé : somme des leviers, transitions isolées (h ≈ 1) et au-delà de seuil en résidu studentisé."""
+    somme = diagnostics['levier'].sum()
+    message = f"Somme des leviers : {somme:.3f}"
+    if nombre_parametres is not None:
+        message += f" (rang attendu : {nombre_parametres})"
+    print(message)
+    print(f"{int(diagnostics['isolee'].sum())} transition(s) déterminent seules un niveau (h ≈ 1), "
+          f"{int((diagnostics['residu_studentise'].abs() > seuil).sum())} au-delà de {seuil} σ "
+          f"en résidu supprimé studentisé.")
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.io import mmwrite
+from scipy.sparse import issparse, coo_matrix, save_npz
+
+from instrumentation import etape
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet optionnel
+    pa = pq = None
+
+# Formats d'export disponibles et extension des fichiers écrits
+FORMATS_EXPORT = {
+    'npz': '.npz',  # Matrice creuse SciPy (save_npz), relue par scipy.sparse.load_npz
+    'mtx': '.mtx',  # Matrix Market (coordonnées, indices à partir de 1)
+    'parquet': '.parquet',  # Triplets Ligne/Colonne/Valeur (nécessite pyarrow)
+    'csv': '.csv',  # Triplets Ligne/Colonne/Valeur, écrits par blocs
+    'xlsx': '.xlsx',  # Excel : sur demande, pour les petites matrices seulement
+}
+FORMAT_EXPORT_DEFAUT = 'npz'
+
+# Nombre de triplets écrits par bloc (CSV et Parquet)
+TAILLE_BLOC_EXPORT = 1_000_000
+
+# Limites de l'export Excel : au-delà, le format par défaut est utilisé
+TAILLE_MAX_EXCEL_DENSE = 2000  # Lignes et colonnes d'une feuille dense
+TRIPLETS_MAX_EXCEL = 100_000  # Triplets d'une feuille Ligne/Colonne/Valeur
+
+
+def _triplets_par_blocs(matrice, taille_bloc):
+    """Parcourt les éléments non nuls par blocs de taille_bloc, sans densifier : DataFrames Ligne/Colonne/Valeur."""
+    coo = matrice.tocoo() if issparse(matrice) else coo_matrix(matrice)
+    for debut in range(0, max(coo.nnz, 1), taille_bloc):
+        fin = debut + taille_bloc
+        yield pd.DataFrame({
+            'Ligne': coo.row[debut:fin],  # Indices de ligne des éléments non nuls
+            'Colonne': coo.col[debut:fin],  # Indices de colonne des éléments non nuls
+            'Valeur': coo.data[debut:fin],  # Valeurs des éléments non nuls
+        })
+
+
+def _exporter_csv(matrice, chemin, taille_bloc):
+    with open(chemin, 'w', newline='') as f:
+        for i, bloc in enumerate(_triplets_par_blocs(matrice, taille_bloc)):
+            bloc.to_csv(f, header=(i == 0), index=False)
+
+
+def _exporter_parquet(matrice, chemin, taille_bloc):
+    if pq is None:
+        raise ImportError("L'export Parquet nécessite pyarrow (pip install pyarrow).")
+    ecrivain = None
+    try:
+        for bloc in _triplets_par_blocs(matrice, taille_bloc):
+            table = pa.Table.from_pandas(bloc, preserve_index=False)
+            if ecrivain is None:
+                ecrivain = pq.ParquetWriter(chemin, table.schema)
+            ecrivain.write_table(table)
+    finally:
+        if ecrivain is not None:
+            ecrivain.close()
+
+
+def _excel_possible(matrice, dense):
+    if dense:
+        return max(matrice.shape) <= TAILLE_MAX_EXCEL_DENSE
+    nnz = matrice.nnz if issparse(matrice) else np.count_nonzero(matrice)
+    return nnz <= TRIPLETS_MAX_EXCEL
+
+
+def _exporter_excel(matrice, chemin, dense, noms_colonnes):
+    if dense:
+        df = pd.DataFrame(matrice.toarray() if issparse(matrice) else np.asarray(matrice))
+        if noms_colonnes is not None:
+            df.columns = noms_colonnes
+    else:
+        df = next(_triplets_par_blocs(matrice, TRIPLETS_MAX_EXCEL))
+    df.to_excel(chemin, index=False)
+
+
+def exporter_matrice(matrice, base, format_export=FORMAT_EXPORT_DEFAUT, dense=False, noms_colonnes=None,
+                     taille_bloc=TAILLE_BLOC_EXPORT):
+    """Exporte une matrice (creuse ou dense) dans le fichier base + extension du format choisi.
+
+    Seul l'export Excel peut densifier la matrice (dense=True : une feuille
+    n x m, avec noms_colonnes comme en-tête ; sinon des triplets). Il est
+    réservé aux petites matrices : au-delà des limites TAILLE_MAX_EXCEL_DENSE
+    et TRIPLETS_MAX_EXCEL, la matrice est exportée au format par défaut.
+    Les autres formats écrivent les éléments non nuls tels quels, par blocs
+    pour CSV et Parquet. Retourne le chemin du fichier écrit.
+    """
+    if format_export not in FORMATS_EXPORT:
+        raise ValueError(f"Le format d'export doit être l'un de {tuple(FORMATS_EXPORT)}.")
+    if format_export == 'xlsx' and not _excel_possible(matrice, dense):
+        print(f"Matrice trop grande {matrice.shape} pour Excel : export au format '{FORMAT_EXPORT_DEFAUT}'.")
+        format_export = FORMAT_EXPORT_DEFAUT
+
+    chemin = base + FORMATS_EXPORT[format_export]
+    nnz = matrice.nnz if issparse(matrice) else np.count_nonzero(matrice)
+    with etape(f'export_{format_export}', lignes=matrice.shape[0], nnz=nnz):
+        if format_export == 'npz':
+            save_npz(chemin, matrice if issparse(matrice) else coo_matrix(matrice), compressed=False)
+        elif format_export == 'mtx':
+            mmwrite(chemin, matrice if issparse(matrice) else coo_matrix(matrice))
+        elif format_export == 'parquet':
+            _exporter_parquet(matrice, chemin, taille_bloc)
+        elif format_export == 'csv':
+            _exporter_csv(matrice, chemin, taille_bloc)
+        else:
+            _exporter_excel(matrice, chemin, dense, noms_colonnes)
+    return os.path.normpath(chemin)
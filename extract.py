@@ -1,4 +1,4 @@
-import sqlite3
+from acces_donnees import connecter
 import json
 import os
 
@@ -26,7 +26,7 @@ if not quantum_names:
     exit(1)  # Arrêter le script si les noms ne peuvent pas être chargés
 
 # Se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
+conn = connecter('marvel.db')
 cursor = conn.cursor()
 
 # Construire la requête SQL pour extraire les nombres quantiques sous forme de liste JSON
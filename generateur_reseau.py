@@ -0,0 +1,148 @@
+import argparse
+import json
+import numpy as np
+import pandas as pd
+
+from acces_donnees import connecter
+from codec_niveaux import QNAMES_FILE
+from ingestion import inserer_transitions_en_masse
+
+# Paramètres par défaut d'un réseau synthétique
+TRANSITIONS_PAR_NIVEAU = 3
+ENERGIE_MAX = 20000.0  # cm-1
+INCERTITUDE_TYPIQUE = 1e-3  # cm-1 ; les incertitudes sont tirées entre /10 et x10
+LARGEUR_BANDE = 50  # Une transition relie deux niveaux distants d'au plus LARGEUR_BANDE rangs d'énergie
+
+# Au-delà, Excel ne peut pas contenir toutes les lignes : le fichier est écrit en CSV
+LIGNES_MAX_EXCEL = 1_048_575
+
+
+def _nombres_quantiques(composantes, rangs, fondamental):
+    """Nombres quantiques (n, k) : la composante dans le premier champ, le rang en base mixte dans les suivants.
+
+    Le tuple du rang 0 de la composante 0 est l'état fondamental de Qnames.json.
+    """
+    k = len(fondamental)
+    qn = np.zeros((rangs.shape[0], k), dtype=np.int64)
+    if k == 1:
+        qn[:, 0] = rangs
+    else:
+        base = max(2, int(np.ceil((rangs.max(initial=0) + 1) ** (1 / (k - 1)))) + 1)
+        reste = rangs.copy()
+        for j in range(k - 1, 0, -1):
+            qn[:, j] = reste % base
+            reste //= base
+        qn[:, 0] = composantes
+    return qn + np.asarray(fondamental, dtype=np.int64)
+
+
+def generer_reseau(nombre_niveaux, transitions_par_niveau=TRANSITIONS_PAR_NIVEAU, nombre_composantes=1,
+                   incertitude=INCERTITUDE_TYPIQUE, energie_max=ENERGIE_MAX, largeur_bande=LARGEUR_BANDE,
+                   graine=0, fichier_qnames=QNAMES_FILE):
+    """Génère un réseau rovibrationnel synthétique dont les énergies vraies sont connues.
+
+    Les niveaux sont répartis entre nombre_composantes composantes connexes
+    (la composante 0 contient l'état fondamental, d'énergie nulle). Dans chaque
+    composante, un arbre relie chaque niveau à un niveau plus bas parmi les
+    largeur_bande précédents, puis des transitions supplémentaires du même type
+    sont ajoutées jusqu'à transitions_par_niveau transitions par niveau. Le
+    nombre d'ondes mesuré est la différence des énergies vraies plus un bruit
+    gaussien d'écart type égal à l'incertitude de la ligne.
+
+    Retourne (transitions, niveaux) : transitions est un DataFrame au format
+    de transitions.xlsx, niveaux un DataFrame des nombres quantiques et de
+    l'énergie vraie de chaque niveau.
+    """
+    rng = np.random.default_rng(graine)
+    with open(fichier_qnames, 'r') as f:
+        fondamental = json.load(f)['ground_state_numbers']
+
+    # Répartition des niveaux entre composantes et énergies vraies (triées dans chaque composante)
+    composantes = np.sort(rng.integers(0, nombre_composantes, nombre_niveaux))
+    composantes[:nombre_composantes] = np.arange(nombre_composantes)  # Aucune composante vide
+    composantes.sort()
+    debuts = np.searchsorted(composantes, np.arange(nombre_composantes + 1))
+    rangs = np.arange(nombre_niveaux) - debuts[composantes]
+    energies = rng.uniform(0, energie_max, nombre_niveaux)
+    for c in range(nombre_composantes):
+        energies[debuts[c]:debuts[c + 1]].sort()
+    energies[0] = 0.0
+
+    # Arbre couvrant de chaque composante : niveau i relié à un niveau plus bas de la bande
+    enfants = np.flatnonzero(rangs > 0)
+    decalages = rng.integers(1, largeur_bande + 1, enfants.shape[0])
+    parents = np.maximum(enfants - decalages, debuts[composantes[enfants]])
+
+    # Transitions supplémentaires, dans la même bande et la même composante
+    supplementaires = max(0, int(round(transitions_par_niveau * nombre_niveaux)) - enfants.shape[0])
+    hauts = enfants[rng.integers(0, max(enfants.shape[0], 1), supplementaires)] if enfants.size else enfants
+    bas = np.maximum(hauts - rng.integers(1, largeur_bande + 1, hauts.shape[0]), debuts[composantes[hauts]])
+    up = np.concatenate((enfants, hauts))
+    low = np.concatenate((parents, bas))
+
+    # Mesures bruitées
+    incertitudes = incertitude * 10 ** rng.uniform(-1, 1, up.shape[0])
+    wavenumbers = energies[up] - energies[low] + rng.normal(0, 1, up.shape[0]) * incertitudes
+
+    qn = _nombres_quantiques(composantes, rangs, fondamental)
+    textes = np.array([' '.join(map(str, ligne)) for ligne in qn.tolist()], dtype=object)
+    transitions = pd.DataFrame({
+        'wavenumber': wavenumbers,
+        'uncertainty': incertitudes,
+        'quantum_numbers_up': textes[up],
+        'quantum_numbers_low': textes[low],
+        'line_status': 1,
+        'src_status': 1,
+        'src': [f'line.{i}' for i in range(up.shape[0])],
+    })
+    niveaux = pd.DataFrame(qn, columns=[f'qn_{j}' for j in range(qn.shape[1])])
+    niveaux['composante'] = composantes
+    niveaux['energie'] = energies
+    return transitions, niveaux
+
+
+def ecrire_fichier(transitions, fichier):
+    """Écrit les transitions au format de transitions.xlsx (CSV au-delà de la limite de lignes d'Excel).
+
+    Retourne le nom du fichier effectivement écrit.
+    """
+    if fichier.endswith('.xlsx') and len(transitions) > LIGNES_MAX_EXCEL:
+        fichier = fichier[:-len('.xlsx')] + '.csv'
+        print(f"Trop de lignes pour Excel : transitions écrites dans '{fichier}'.")
+    if fichier.endswith('.xlsx'):
+        transitions.to_excel(fichier, index=False)
+    else:
+        transitions.to_csv(fichier, index=False)
+    return fichier
+
+
+def ecrire_base(transitions, fichier, fichier_qnames=QNAMES_FILE):
+    """Insère les transitions dans la table transitions de la base (schéma courant)."""
+    with open(fichier_qnames, 'r') as f:
+        quantum_names = json.load(f)['quantum_names']
+    conn = connecter(fichier)
+    try:
+        nombre_inseres, _ = inserer_transitions_en_masse(conn, transitions, quantum_names)
+    finally:
+        conn.close()
+    return nombre_inseres
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Génère un réseau spectroscopique synthétique aux énergies connues.")
+    parser.add_argument('niveaux', type=int, help="nombre de niveaux d'énergie")
+    parser.add_argument('--transitions-par-niveau', type=float, default=TRANSITIONS_PAR_NIVEAU)
+    parser.add_argument('--composantes', type=int, default=1, help="nombre de composantes connexes")
+    parser.add_argument('--incertitude', type=float, default=INCERTITUDE_TYPIQUE, help="incertitude typique (cm-1)")
+    parser.add_argument('--graine', type=int, default=0)
+    parser.add_argument('--fichier', default='transitions_synthetiques.xlsx', help="fichier .xlsx ou .csv à écrire")
+    parser.add_argument('--base', help="base SQLite où insérer aussi les transitions")
+    arguments = parser.parse_args()
+
+    transitions, niveaux = generer_reseau(arguments.niveaux, arguments.transitions_par_niveau, arguments.composantes,
+                                          arguments.incertitude, graine=arguments.graine)
+    fichier = ecrire_fichier(transitions, arguments.fichier)
+    niveaux.to_csv('energies_vraies.csv', index=False)
+    print(f"{len(transitions)} transitions écrites dans '{fichier}', énergies vraies dans 'energies_vraies.csv'.")
+    if arguments.base:
+        print(f"{ecrire_base(transitions, arguments.base)} transitions insérées dans '{arguments.base}'.")
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import etape
+from schema import create_transitions_table, creer_index, noms_colonnes_quantiques, supprimer_index
+
+# Nombre de lignes envoyées à SQLite par appel à executemany
+TAILLE_LOT = 50000
+
+# Pragmas appliqués pendant l'ingestion en masse
+PRAGMAS_INGESTION = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -200000',  # ~200 Mo de cache de pages
+)
+
+
+def parser_colonne_quantique(colonne, nombre_quantiques):
+    """Convertit une colonne de chaînes "0 1 2 ..." en tableau d'entiers (n, k), de façon vectorisée.
+
+    Toute la colonne est découpée d'un bloc par les méthodes de chaînes de pandas,
+    une ligne par cellule : une cellule vide, manquante ou mal formée ne rend
+    invalide que sa propre ligne. Retourne (tableau, valide) ; une ligne est
+    invalide si elle est vide, contient une valeur non entière ou n'a pas
+    exactement nombre_quantiques valeurs.
+    """
+    n = len(colonne)
+    if n == 0:
+        return np.zeros((0, nombre_quantiques), dtype=np.int64), np.zeros(0, dtype=bool)
+    # Une colonne supplémentaire détecte les lignes avec trop de valeurs
+    morceaux = (colonne.fillna('').astype(str).str.split(expand=True)
+                .reindex(columns=range(nombre_quantiques + 1)))
+    nombres = morceaux.iloc[:, :nombre_quantiques].apply(pd.to_numeric, errors='coerce')
+    tableau = nombres.to_numpy(dtype=float, na_value=np.nan)
+
+    valide = morceaux.iloc[:, nombre_quantiques].isna().to_numpy()
+    valide = valide & np.all(np.isfinite(tableau), axis=1)
+    valide = valide & np.all(tableau == np.round(tableau), axis=1)
+    tableau = np.where(valide[:, None], tableau, 0).astype(np.int64)
+    return tableau, valide
+
+
+def _json_depuis_tableau(tableau):
+    """Construit le texte JSON "[0, 1, 2]" de chaque ligne avec les opérations de chaînes de NumPy."""
+    tableau = np.asarray(tableau, dtype=np.int64)
+    if tableau.size and tableau.max() - tableau.min() < 100000:
+        # Table des représentations textuelles de chaque valeur possible
+        minimum = tableau.min()
+        table = np.array([str(v) for v in range(minimum, tableau.max() + 1)])
+        morceaux = table[tableau - minimum]
+    else:
+        morceaux = tableau.astype(np.str_)
+    textes = np.full(tableau.shape[0], '[', dtype='<U1')
+    for j in range(tableau.shape[1]):
+        textes = np.char.add(np.char.add(textes, ', ') if j else textes, morceaux[:, j])
+    return np.char.add(textes, ']').tolist()
+
+
+def preparer_transitions(df, nombre_quantiques):
+    """Valide et met en forme un tableau de transitions (Excel ou CSV) pour l'insertion.
+
+    Retourne (colonnes, lignes_rejetees) où colonnes est un dictionnaire de listes
+    Python prêtes pour executemany et lignes_rejetees les indices du DataFrame
+    dont les nombres quantiques sont invalides.
+    """
+    if 'wavenumber' not in df.columns:
+        raise ValueError("La colonne 'wavenumber' est obligatoire.")
+
+    n = len(df)
+    vide = pd.Series([''] * n, index=df.index)
+    qn_up, valide_up = parser_colonne_quantique(df.get('quantum_numbers_up', vide), nombre_quantiques)
+    qn_low, valide_low = parser_colonne_quantique(df.get('quantum_numbers_low', vide), nombre_quantiques)
+    wavenumber = pd.to_numeric(df['wavenumber'], errors='coerce').to_numpy(dtype=float)
+    valide = valide_up & valide_low & np.isfinite(wavenumber)
+
+    def colonne(nom, defaut):
+        if nom not in df.columns:
+            return [defaut] * int(valide.sum())
+        valeurs = df[nom][valide]
+        return valeurs.astype(object).where(valeurs.notna(), defaut).tolist()
+
+    colonnes = {
+        # Un id absent (None) est attribué par SQLite
+        'id': [None if v is None else int(v) for v in colonne('id', None)],
+        'wavenumber': wavenumber[valide].tolist(),
+        'uncertainty': [float(v) for v in colonne('uncertainty', 0.0)],
+        'quantum_numbers_up': _json_depuis_tableau(qn_up[valide]),
+        'quantum_numbers_low': _json_depuis_tableau(qn_low[valide]),
+        'line_status': [int(v) for v in colonne('line_status', 0)],
+        'src_status': [int(v) for v in colonne('src_status', 0)],
+        'src': [str(v) for v in colonne('src', '')],
+        'qn_up': qn_up[valide],
+        'qn_low': qn_low[valide],
+    }
+    return colonnes, np.flatnonzero(~valide)
+
+
+def inserer_transitions_en_masse(conn, df, quantum_names, taille_lot=TAILLE_LOT):
+    """Insère un DataFrame de transitions en une seule transaction avec executemany.
+
+    Les colonnes JSON et les colonnes entières (schéma version 2) sont écrites
+    ensemble, sans passer par les déclencheurs. Retourne (nombre_inseres,
+    lignes_rejetees).
+    """
+    create_transitions_table(conn, quantum_names)
+    with etape('preparation_transitions', lignes=len(df)):
+        colonnes, lignes_rejetees = preparer_transitions(df, len(quantum_names))
+    for ligne in lignes_rejetees[:10]:
+        print(f"Erreur : nombres quantiques invalides à la ligne {ligne + 2} du fichier, ligne ignorée.")
+    if len(lignes_rejetees) > 10:
+        print(f"... {len(lignes_rejetees) - 10} autres lignes ignorées.")
+
+    colonnes_up, colonnes_low = noms_colonnes_quantiques(quantum_names)
+    noms = ['id', 'wavenumber', 'uncertainty', 'quantum_numbers_up', 'quantum_numbers_low',
+            'line_status', 'src_status', 'src'] + colonnes_up + colonnes_low
+    requete = f'INSERT INTO transitions ({", ".join(noms)}) VALUES ({", ".join("?" * len(noms))})'
+    valeurs = [colonnes[nom] for nom in noms[:8]]
+    valeurs += colonnes['qn_up'].T.tolist() + colonnes['qn_low'].T.tolist()
+
+    for pragma in PRAGMAS_INGESTION:
+        conn.execute(pragma)
+    nombre = len(colonnes['wavenumber'])
+    existants = conn.execute('SELECT COUNT(*) FROM transitions').fetchone()[0]
+
+    # Pour un gros lot, reconstruire les index après coup (tri) coûte moins que les maintenir ligne à ligne
+    reconstruire_index = nombre > existants
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    with etape('insertion_transitions', lignes=nombre), conn:
+        if reconstruire_index:
+            supprimer_index(conn)
+        for debut in range(0, nombre, taille_lot):
+            lot = zip(*(valeurs_colonne[debut:debut + taille_lot] for valeurs_colonne in valeurs))
+            conn.executemany(requete, lot)
+        if reconstruire_index:
+            creer_index(conn, colonnes_up, colonnes_low)
+    return nombre, lignes_rejetees
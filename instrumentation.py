@@ -0,0 +1,178 @@
+import atexit
+import json
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Nombre de mesures individuelles conservées (les plus récentes) pour /metrics
+HISTORIQUE_MAX = 200
+
+# Préfixe des métriques au format texte de Prometheus
+PREFIXE_PROMETHEUS = 'marvel'
+
+# Option de ligne de commande des scripts demandant le rapport par étape en fin d'exécution
+OPTION_PROFIL = '--profile'
+
+
+def rss_max_octets():
+    """Pic de mémoire résidente du processus depuis son démarrage (octets)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if platform.system() == 'Darwin' else rss * 1024
+
+
+class Instrumentation:
+    """Mesures légères par étape : durée, pic de mémoire résidente, lignes traitées et éléments non nuls.
+
+    Chaque étape est mesurée par le gestionnaire de contexte etape(nom), qui ne
+    coûte que deux appels à perf_counter et à getrusage. Les mesures sont
+    agrégées par nom d'étape (nombre d'exécutions, durées totale et maximale,
+    dernières lignes et nnz) et les HISTORIQUE_MAX plus récentes sont gardées
+    telles quelles. L'accès est protégé par un verrou : les routes Flask, les
+    tâches d'arrière-plan et l'écrivain SQLite peuvent mesurer en même temps.
+    """
+
+    def __init__(self, historique_max=HISTORIQUE_MAX):
+        self._verrou = threading.Lock()
+        self._etapes = {}
+        self._historique = deque(maxlen=historique_max)
+        self.debut = time.time()
+
+    @contextmanager
+    def etape(self, nom, lignes=None, nnz=None):
+        """Mesure le bloc ; la mesure (dictionnaire) est retournée pour y renseigner lignes et nnz une fois connus.
+
+        Exemple :
+            with etape('lecture_transitions') as mesure:
+                rows = cursor.fetchall()
+                mesure['lignes'] = len(rows)
+        """
+        mesure = {'etape': nom, 'lignes': lignes, 'nnz': nnz, 'thread': threading.current_thread().name}
+        rss_avant = rss_max_octets()
+        debut = time.perf_counter()
+        try:
+            yield mesure
+        except BaseException:
+            mesure['echec'] = True
+            raise
+        finally:
+            mesure['duree_s'] = time.perf_counter() - debut
+            mesure['rss_max_octets'] = rss_max_octets()
+            # Hausse du pic de RSS pendant l'étape : l'étape qui a fait grimper la mémoire du processus
+            mesure['hausse_rss_octets'] = mesure['rss_max_octets'] - rss_avant
+            mesure['fin'] = time.time()
+            self._enregistrer(mesure)
+
+    def _enregistrer(self, mesure):
+        with self._verrou:
+            self._historique.append(mesure)
+            agregat = self._etapes.setdefault(mesure['etape'], {
+                'executions': 0, 'echecs': 0, 'duree_totale_s': 0.0, 'duree_max_s': 0.0, 'derniere_duree_s': 0.0,
+                'lignes_total': 0, 'dernieres_lignes': None, 'dernier_nnz': None, 'nnz_max': None,
+                'hausse_rss_max_octets': 0,
+            })
+            agregat['executions'] += 1
+            agregat['echecs'] += int(mesure.get('echec', False))
+            agregat['duree_totale_s'] += mesure['duree_s']
+            agregat['duree_max_s'] = max(agregat['duree_max_s'], mesure['duree_s'])
+            agregat['derniere_duree_s'] = mesure['duree_s']
+            agregat['hausse_rss_max_octets'] = max(agregat['hausse_rss_max_octets'], mesure['hausse_rss_octets'])
+            if mesure['lignes'] is not None:
+                agregat['lignes_total'] += int(mesure['lignes'])
+                agregat['dernieres_lignes'] = int(mesure['lignes'])
+            if mesure['nnz'] is not None:
+                agregat['dernier_nnz'] = int(mesure['nnz'])
+                agregat['nnz_max'] = max(agregat['nnz_max'] or 0, int(mesure['nnz']))
+
+    def reinitialiser(self):
+        """Efface toutes les mesures."""
+        with self._verrou:
+            self._etapes.clear()
+            self._historique.clear()
+            self.debut = time.time()
+
+    def metriques(self):
+        """Mesures agrégées par étape et mesures récentes, sérialisables en JSON."""
+        with self._verrou:
+            return {
+                'debut': self.debut,
+                'rss_max_octets': rss_max_octets(),
+                'etapes': {nom: dict(agregat) for nom, agregat in self._etapes.items()},
+                'recentes': [dict(mesure) for mesure in self._historique],
+            }
+
+    def format_prometheus(self):
+        """Mesures agrégées au format texte d'exposition de Prometheus (version 0.0.4)."""
+        metriques = self.metriques()
+        p = PREFIXE_PROMETHEUS
+        series = (
+            ('etape_executions_total', 'counter', "Nombre d'exécutions de l'étape", 'executions'),
+            ('etape_echecs_total', 'counter', "Nombre d'exécutions de l'étape terminées par une exception", 'echecs'),
+            ('etape_duree_secondes_total', 'counter', "Durée cumulée de l'étape", 'duree_totale_s'),
+            ('etape_duree_secondes_max', 'gauge', "Durée maximale d'une exécution de l'étape", 'duree_max_s'),
+            ('etape_duree_secondes_derniere', 'gauge', "Durée de la dernière exécution de l'étape", 'derniere_duree_s'),
+            ('etape_lignes_total', 'counter', "Lignes (transitions) traitées par l'étape", 'lignes_total'),
+            ('etape_nnz', 'gauge', "Éléments non nuls de la matrice produite lors de la dernière exécution",
+             'dernier_nnz'),
+            ('etape_hausse_rss_octets_max', 'gauge', "Plus forte hausse du pic de mémoire résidente pendant l'étape",
+             'hausse_rss_max_octets'),
+        )
+        lignes = []
+        for nom, type_metrique, aide, champ in series:
+            lignes.append(f'# HELP {p}_{nom} {aide}')
+            lignes.append(f'# TYPE {p}_{nom} {type_metrique}')
+            for etape, agregat in sorted(metriques['etapes'].items()):
+                if agregat[champ] is not None:
+                    lignes.append(f'{p}_{nom}{{etape="{etape}"}} {agregat[champ]}')
+        lignes.append(f'# HELP {p}_rss_max_octets Pic de mémoire résidente du processus')
+        lignes.append(f'# TYPE {p}_rss_max_octets gauge')
+        lignes.append(f"{p}_rss_max_octets {metriques['rss_max_octets']}")
+        return '\n'.join(lignes) + '\n'
+
+    def rapport(self, fichier=None):
+        """Affiche le tableau des étapes, de la plus coûteuse à la moins coûteuse (durée cumulée).
+
+        La part est rapportée à la durée écoulée depuis le début des mesures ;
+        les étapes imbriquées (une étape du pipeline et celles qu'elle appelle)
+        sont comptées chacune.
+        """
+        metriques = self.metriques()
+        etapes = sorted(metriques['etapes'].items(), key=lambda item: -item[1]['duree_totale_s'])
+        total = max(time.time() - metriques['debut'], 1e-9)
+        sortie = fichier or sys.stdout
+        print(f"\nProfil par étape (pic RSS du processus : {metriques['rss_max_octets'] / 1024 ** 2:.1f} Mo)", file=sortie)
+        print(f"{'étape':<28} {'appels':>6} {'durée':>10} {'part':>6} {'max':>10} {'lignes':>10} {'nnz':>10} "
+              f"{'hausse RSS':>11}", file=sortie)
+        for nom, agregat in etapes:
+            lignes = agregat['lignes_total'] if agregat['dernieres_lignes'] is not None else ''
+            nnz = agregat['nnz_max'] if agregat['nnz_max'] is not None else ''
+            print(f"{nom:<28} {agregat['executions']:>6} {agregat['duree_totale_s']:9.3f}s "
+                  f"{100 * agregat['duree_totale_s'] / total:5.1f}% {agregat['duree_max_s']:9.3f}s {lignes:>10} "
+                  f"{nnz:>10} {agregat['hausse_rss_max_octets'] / 1024 ** 2:9.1f}Mo", file=sortie)
+
+    def enregistrer_json(self, chemin):
+        """Écrit les métriques (format de metriques()) dans un fichier JSON."""
+        with open(chemin, 'w') as f:
+            json.dump(self.metriques(), f, indent=1)
+
+
+# Instance partagée par les modules de calcul, les scripts et l'application
+INSTRUMENTATION = Instrumentation()
+etape = INSTRUMENTATION.etape
+
+
+def profil_demande(arguments=None):
+    """Vrai si l'option --profile est passée au script ; le rapport par étape est alors affiché à la sortie.
+
+    L'option est retirée de sys.argv pour ne pas gêner la lecture des autres arguments.
+    """
+    arguments = sys.argv if arguments is None else arguments
+    if OPTION_PROFIL not in arguments:
+        return False
+    while OPTION_PROFIL in arguments:
+        arguments.remove(OPTION_PROFIL)
+    atexit.register(INSTRUMENTATION.rapport)
+    return True
@@ -1,55 +1,25 @@
-import sqlite3
-from bidict import bidict
+from acces_donnees import connecter
 import json
-import pandas as pd
-from scipy.sparse import coo_matrix, csr_matrix
+import numpy as np
+from assemblage import construire_matrice_design
+from cache_niveaux import CacheSysteme
+from export_matrices import exporter_matrice
+from instrumentation import profil_demande
 
-# Se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
-cursor = conn.cursor()
-
-# Créer un bidictionnaire vide
-niveaux_energie = bidict()
-
-# Compteur pour les numéros séquentiels
-compteur = 0
-
-# Fonction pour explorer la table des transitions et remplir le bidictionnaire
-def explorer_transitions_et_remplir_bidict():
-    global compteur  # Utiliser le compteur global
-
-    # Exécuter une requête pour lire tous les enregistrements de la table transitions
-    cursor.execute('SELECT id, wavenumber, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
+# Format d'export de la matrice : 'npz', 'mtx', 'parquet', 'csv' ou 'xlsx' (petites matrices seulement)
+FORMAT_EXPORT = 'npz'
 
-    # Parcourir chaque enregistrement
-    for row in rows:
-        quantum_numbers_up = row[2]  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = row[3]  # Nombres quantiques de l'état inférieur
+# Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+profil_demande()
 
-        # Convertir les chaînes JSON en listes Python
-        try:
-            liste_up = json.loads(quantum_numbers_up)  # Convertir "[1, 2, 3]" en [1, 2, 3]
-            liste_low = json.loads(quantum_numbers_low)  # Convertir "[0, 1, 2]" en [0, 1, 2]
-        except json.JSONDecodeError:
-            print(f"Erreur : Impossible de parser les nombres quantiques : {quantum_numbers_up} ou {quantum_numbers_low}")
-            continue
-
-        # Convertir les listes en tuples
-        tuple_up = tuple(liste_up)
-        tuple_low = tuple(liste_low)
-
-        # Ajouter les tuples au bidictionnaire avec un numéro séquentiel
-        if tuple_up not in niveaux_energie:
-            niveaux_energie[tuple_up] = compteur
-            compteur += 1  # Incrémenter le compteur
-
-        if tuple_low not in niveaux_energie:
-            niveaux_energie[tuple_low] = compteur
-            compteur += 1  # Incrémenter le compteur
+# Se connecter à la base de données SQLite
+conn = connecter('marvel.db')
+cursor = conn.cursor()
 
-# Appeler la fonction pour explorer la table et remplir le bidictionnaire
-explorer_transitions_et_remplir_bidict()  # Correction ici
+# Lire les transitions et numéroter les niveaux d'énergie, dans l'ordre de première apparition
+# (relus depuis le cache si la base et Qnames.json n'ont pas changé)
+codec, cles_niveaux, idx_up, idx_low, transitions = CacheSysteme(cursor).niveaux()
+compteur = cles_niveaux.shape[0]  # Nombre de niveaux d'énergie
 
 # Charger les nombres quantiques de l'état fondamental depuis Qnames.json
 with open('Qnames.json', 'r') as f:
@@ -57,10 +27,11 @@ with open('Qnames.json', 'r') as f:
     fondamental = tuple(qnames_data['ground_state_numbers'])  # Convertir en tuple
 
 # Récupérer le numéro attribué à l'état fondamental
-if fondamental in niveaux_energie:
-    fondamental_num = niveaux_energie[fondamental]
+trouve = np.flatnonzero(cles_niveaux == codec.encoder_tuple(fondamental))
+if trouve.size:
+    fondamental_num = int(trouve[0])
 else:
-    raise ValueError("L'état fondamental n'a pas été trouvé dans le bidictionnaire.")
+    raise ValueError("L'état fondamental n'a pas été trouvé parmi les niveaux d'énergie.")
 
 # Lire ground_energy_status depuis le clavier
 ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'fixed' ou 1 'free') : "))
@@ -69,58 +40,17 @@ if ground_energy_status not in [0, 1]:
 
 # Fonction pour générer la matrice de design en représentation COO
 def generer_matrice_design_coo():
-    # Récupérer toutes les transitions
-    cursor.execute('SELECT id, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
-
-    # Initialiser des listes pour les indices et les valeurs non nulles
-    lignes = []  # Indices de ligne
-    colonnes = []  # Indices de colonne
-    valeurs = []  # Valeurs non nulles
-
-    # Remplir les listes pour la représentation COO
-    for i, row in enumerate(rows):
-        quantum_numbers_up = json.loads(row[1])  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = json.loads(row[2])  # Nombres quantiques de l'état inférieur
-
-        # Convertir en tuples
-        tuple_up = tuple(quantum_numbers_up)
-        tuple_low = tuple(quantum_numbers_low)
-
-        # Récupérer les numéros associés
-        num_up = niveaux_energie[tuple_up]
-        num_low = niveaux_energie[tuple_low]
-
-        # Ajouter les éléments non nuls
-        if num_up != fondamental_num:
-            lignes.append(i)
-            colonnes.append(num_up)
-            valeurs.append(1)  # 1 pour le niveau supérieur
-
-        if num_low != fondamental_num:
-            lignes.append(i)
-            colonnes.append(num_low)
-            valeurs.append(-1)  # -1 pour le niveau inférieur
-
-        # Gérer le cas du niveau fondamental
-        if num_up == fondamental_num:
-            lignes.append(i)
-            colonnes.append(num_up)
-            valeurs.append(0 if ground_energy_status == 0 else -1)  # 0 ou -1 selon ground_energy_status
-
-        if num_low == fondamental_num:
-            lignes.append(i)
-            colonnes.append(num_low)
-            valeurs.append(0 if ground_energy_status == 0 else -1)  # 0 ou -1 selon ground_energy_status
-
-    # Créer la matrice COO avec la taille correcte
-    nombre_transitions = len(rows)  # Nombre de transitions
-    nombre_niveaux_energie = compteur  # Nombre de niveaux d'énergie
-    taille_A = (nombre_transitions, nombre_niveaux_energie)  # Taille de la matrice A
-    print(f"Taille de la matrice A : {taille_A}")
-
-    matrice_coo = coo_matrix((valeurs, (lignes, colonnes)), shape=taille_A)
-    return matrice_coo
+    # Si l'énergie du fondamental est fixée (0), sa colonne reste nulle
+    up = idx_up.copy()
+    low = idx_low.copy()
+    if ground_energy_status == 0:
+        up[up == fondamental_num] = -1
+        low[low == fondamental_num] = -1
+
+    # Construire directement la matrice de design à partir des numéros de niveaux
+    matrice_csr = construire_matrice_design(up, low, compteur)
+    print(f"Taille de la matrice A : {matrice_csr.shape}")
+    return matrice_csr.tocoo()
 
 # Générer la matrice de design en représentation COO
 matrice_coo = generer_matrice_design_coo()
@@ -135,28 +65,10 @@ matrice_csr = matrice_coo.tocsr()
 print("Matrice CSR :")
 print(f"- Shape : {matrice_csr.shape}")
 print(f"- Nombre d'éléments non nuls : {matrice_csr.nnz}")
-# Convertir la matrice CSR en DataFrame pour l'exportation
-lignes, colonnes = matrice_csr.nonzero()  # Indices de ligne et de colonne
-valeurs = matrice_csr.data  # Valeurs non nulles
-
-# Vérifier que les tableaux ont la même longueur
-if len(lignes) == len(colonnes) == len(valeurs):
-    df_matrice_csr = pd.DataFrame({
-        'Ligne': lignes,  # Indices de ligne des éléments non nuls
-        'Colonne': colonnes,  # Indices de colonne des éléments non nuls
-        'Valeur': valeurs  # Valeurs des éléments non nuls
-    })
-else:
-    # Afficher les incohérences
-    print("Incohérence détectée :")
-    print(f"- lignes : {lignes}")
-    print(f"- colonnes : {colonnes}")
-    print(f"- valeurs : {valeurs}")
-    raise ValueError("Les tableaux d'indices et de valeurs n'ont pas la même longueur.")
 
-# Enregistrer le DataFrame dans un fichier Excel
-df_matrice_csr.to_excel('matrice_design_csr.xlsx', index=False)
-print("La matrice de design en représentation CSR a été enregistrée dans 'matrice_design_csr.xlsx'.")
+# Exporter la matrice CSR (éléments non nuls, sans densifier)
+chemin = exporter_matrice(matrice_csr, 'matrice_design_csr', FORMAT_EXPORT)
+print(f"La matrice de design en représentation CSR a été enregistrée dans '{chemin}'.")
 
 # Fermer la connexion à la base de données
 conn.close()
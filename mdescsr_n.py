@@ -1,19 +1,20 @@
-import sqlite3
-from bidict import bidict
+from acces_donnees import connecter
 import json
-import pandas as pd
-from scipy.sparse import coo_matrix, csr_matrix, diags
+from scipy.sparse import diags
 import numpy as np
+from cache_niveaux import CacheSysteme
+from export_matrices import exporter_matrice
+from instrumentation import profil_demande
 
-# Se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
-cursor = conn.cursor()
+# Format d'export de la matrice : 'npz', 'mtx', 'parquet', 'csv' ou 'xlsx' (petites matrices seulement)
+FORMAT_EXPORT = 'npz'
 
-# Créer un bidictionnaire vide
-niveaux_energie = bidict()
+# Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+profil_demande()
 
-# Compteur pour les numéros séquentiels
-compteur = 0
+# Se connecter à la base de données SQLite
+conn = connecter('marvel.db')
+cursor = conn.cursor()
 
 # Charger les nombres quantiques de l'état fondamental depuis Qnames.json
 with open('Qnames.json', 'r') as f:
@@ -25,148 +26,34 @@ ground_energy_status = int(input("Entrez la valeur de ground_energy_status (0 'f
 if ground_energy_status not in [0, 1]:
     raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
 
-# Fonction pour explorer la table des transitions et remplir le bidictionnaire
-def explorer_transitions_et_remplir_bidict():
-    global compteur  # Utiliser le compteur global
-
-    # Exécuter une requête pour lire tous les enregistrements de la table transitions
-    cursor.execute('SELECT id, wavenumber, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
-
-    # Parcourir chaque enregistrement
-    for row in rows:
-        quantum_numbers_up = row[2]  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = row[3]  # Nombres quantiques de l'état inférieur
-
-        # Convertir les chaînes JSON en listes Python
-        try:
-            liste_up = json.loads(quantum_numbers_up)  # Convertir "[1, 2, 3]" en [1, 2, 3]
-            liste_low = json.loads(quantum_numbers_low)  # Convertir "[0, 1, 2]" en [0, 1, 2]
-        except json.JSONDecodeError:
-            print(f"Erreur : Impossible de parser les nombres quantiques : {quantum_numbers_up} ou {quantum_numbers_low}")
-            continue
-
-        # Convertir les listes en tuples
-        tuple_up = tuple(liste_up)
-        tuple_low = tuple(liste_low)
-
-        # Ajouter les tuples au bidictionnaire avec un numéro séquentiel
-        # Ignorer le niveau fondamental si ground_energy_status == 0
-        if ground_energy_status == 1 or tuple_up != fondamental:
-            if tuple_up not in niveaux_energie:
-                niveaux_energie[tuple_up] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-        if ground_energy_status == 1 or tuple_low != fondamental:
-            if tuple_low not in niveaux_energie:
-                niveaux_energie[tuple_low] = compteur
-                compteur += 1  # Incrémenter le compteur
-
-# Appeler la fonction pour explorer la table et remplir le bidictionnaire
-explorer_transitions_et_remplir_bidict()
-
-# Fonction pour générer la matrice de design en représentation COO
-def generer_matrice_design_coo():
-    # Récupérer toutes les transitions
-    cursor.execute('SELECT id, quantum_numbers_up, quantum_numbers_low FROM transitions')
-    rows = cursor.fetchall()
-
-    # Initialiser des listes pour les indices et les valeurs non nulles
-    lignes = []  # Indices de ligne
-    colonnes = []  # Indices de colonne
-    valeurs = []  # Valeurs non nulles
-
-    # Remplir les listes pour la représentation COO
-    for i, row in enumerate(rows):
-        quantum_numbers_up = json.loads(row[1])  # Nombres quantiques de l'état supérieur
-        quantum_numbers_low = json.loads(row[2])  # Nombres quantiques de l'état inférieur
-
-        # Convertir en tuples
-        tuple_up = tuple(quantum_numbers_up)
-        tuple_low = tuple(quantum_numbers_low)
-
-        # Récupérer les numéros associés
-        num_up = niveaux_energie.get(tuple_up, None)  # Utiliser None si le niveau n'est pas dans le dictionnaire
-        num_low = niveaux_energie.get(tuple_low, None)
-
-        # Ajouter les éléments non nuls
-        if num_up is not None and (ground_energy_status == 1 or tuple_up != fondamental):
-            lignes.append(i)
-            colonnes.append(num_up)
-            valeurs.append(1)  # 1 pour le niveau supérieur
-
-        if num_low is not None and (ground_energy_status == 1 or tuple_low != fondamental):
-            lignes.append(i)
-            colonnes.append(num_low)
-            valeurs.append(-1)  # -1 pour le niveau inférieur
-
-    # Créer la matrice COO avec la taille correcte
-    nombre_transitions = len(rows)  # Nombre de transitions
-    nombre_niveaux_energie = compteur  # Nombre de niveaux d'énergie
-    taille_A = (nombre_transitions, nombre_niveaux_energie)  # Taille de la matrice A
-    print(f"Taille de la matrice A : {taille_A}")
-
-    matrice_coo = coo_matrix((valeurs, (lignes, colonnes)), shape=taille_A)
-    return matrice_coo
-
-# Générer la matrice de design en représentation COO
-matrice_coo = generer_matrice_design_coo()
-
-# Supprimer les doublons dans la matrice COO
-matrice_coo.sum_duplicates()
-
-# Convertir la matrice COO en DataFrame pour l'exportation
-df_matrice_coo = pd.DataFrame({
-    'Ligne': matrice_coo.row,  # Indices de ligne des éléments non nuls
-    'Colonne': matrice_coo.col,  # Indices de colonne des éléments non nuls
-    'Valeur': matrice_coo.data  # Valeurs des éléments non nuls
-})
-
-# Enregistrer la matrice COO dans un fichier Excel
-df_matrice_coo.to_excel('matrice_design_coo.xlsx', index=False)
-print("La matrice de design en représentation COO a été enregistrée dans 'matrice_design_coo.xlsx'.")
-
-# Convertir la matrice COO en CSR
-matrice_csr = matrice_coo.tocsr()
+# Lire les transitions et numéroter les niveaux d'énergie (relus depuis le cache si la base n'a pas changé)
+# Ignorer le niveau fondamental si ground_energy_status == 0
+cache = CacheSysteme(cursor, fondamental=fondamental, exclure_fondamental=(ground_energy_status == 0))
+codec, cles_niveaux, idx_up, idx_low, transitions = cache.niveaux()
+compteur = cles_niveaux.shape[0]  # Nombre de niveaux d'énergie
+
+# Générer la matrice de design directement en représentation CSR
+matrice_csr = cache.matrice_design()
+print(f"Taille de la matrice A : {matrice_csr.shape}")
+
+# Exporter la matrice de design en représentation COO puis CSR (éléments non nuls, sans densifier)
+chemin = exporter_matrice(matrice_csr.tocoo(), 'matrice_design_coo', FORMAT_EXPORT)
+print(f"La matrice de design en représentation COO a été enregistrée dans '{chemin}'.")
 
 # Afficher des informations sur la matrice CSR
 print("Matrice CSR :")
 print(f"- Shape : {matrice_csr.shape}")
 print(f"- Nombre d'éléments non nuls : {matrice_csr.nnz}")
 
-# Convertir la matrice CSR en DataFrame pour l'exportation
-lignes, colonnes = matrice_csr.nonzero()  # Indices de ligne et de colonne
-valeurs = matrice_csr.data  # Valeurs non nulles
-
-# Vérifier que les tableaux ont la même longueur
-if len(lignes) == len(colonnes) == len(valeurs):
-    df_matrice_csr = pd.DataFrame({
-        'Ligne': lignes,  # Indices de ligne des éléments non nuls
-        'Colonne': colonnes,  # Indices de colonne des éléments non nuls
-        'Valeur': valeurs  # Valeurs des éléments non nuls
-    })
-else:
-    # Afficher les incohérences
-    print("Incohérence détectée :")
-    print(f"- lignes : {lignes}")
-    print(f"- colonnes : {colonnes}")
-    print(f"- valeurs : {valeurs}")
-    raise ValueError("Les tableaux d'indices et de valeurs n'ont pas la même longueur.")
-
-# Enregistrer la matrice CSR dans un fichier Excel
-df_matrice_csr.to_excel('matrice_design_csr.xlsx', index=False)
-print("La matrice de design en représentation CSR a été enregistrée dans 'matrice_design_csr.xlsx'.")
+chemin = exporter_matrice(matrice_csr, 'matrice_design_csr', FORMAT_EXPORT)
+print(f"La matrice de design en représentation CSR a été enregistrée dans '{chemin}'.")
 
 # Récupérer les valeurs de wavenumber et uncertainty pour construire les poids
-cursor.execute('SELECT wavenumber, uncertainty FROM transitions')
-rows = cursor.fetchall()
-
-# Extraire les wavenumbers et les incertitudes
-wavenumbers = np.array([row[0] for row in rows])
-uncertainties = np.array([row[1] for row in rows])
+wavenumbers = transitions['wavenumber']
+uncertainties = transitions['uncertainty']
 
 # Calculer les poids w = 1 / (uncertainty ** 2)
-weights = 1 / (uncertainties ** 2)
+weights = cache.poids()
 
 # Construire la matrice diagonale W
 W = diags(weights)
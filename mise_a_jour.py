@@ -0,0 +1,380 @@
+import time
+import warnings
+import numpy as np
+from scipy.linalg import LinAlgWarning, lu_factor, lu_solve
+
+from ancrage import AnalyseComposantes
+from assemblage import (assembler_equations_normales, lire_transitions, numeros_depuis_cles, numeros_niveaux,
+                        numeroter_niveaux)
+from cholesky_creux import FactorisationCholesky
+from schema import revision_transitions
+
+# Nombre maximal de transitions modifiées + niveaux ajoutés depuis la dernière
+# factorisation complète ; au-delà, M est refactorisée
+SEUIL_RANG = 256
+
+# Une mise à jour dont le système bordé a un pivot LU inférieur à TOLERANCE_DERIVE
+# fois le plus grand est abandonnée au profit d'une refactorisation complète
+TOLERANCE_DERIVE = 1e-10
+
+# Mémoire maximale d'un lot de colonnes de Z = M0⁻¹ V1 (octets) : chaque lot
+# est réduit à V1ᵀ Z puis libéré
+MEMOIRE_LOT_Z = 64 * 2 ** 20
+
+# Requête des transitions ajoutées depuis la dernière mise à jour
+REQUETE_NOUVELLES_TRANSITIONS = '''
+    SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low
+    FROM transitions
+    WHERE id > ?
+    ORDER BY id
+'''
+
+
+class SolveurIncremental:
+    """Résolution de M x = y tenue à jour après ajout ou suppression de transitions.
+
+    La matrice factorisée M0 reste inchangée ; les k transitions modifiées
+    depuis la factorisation forment une mise à jour de rang k, M = M0 + V C Vᵀ
+    (C = ±w, négatif pour une suppression), et les p niveaux apparus depuis
+    bordent le système. En notant V1 et V2 les lignes de V des anciens et des
+    nouveaux niveaux, Z = M0⁻¹ V1 et u = M0⁻¹ y1, la solution vérifie le
+    système dense de taille p + k
+
+        [ 0     V2               ] [x2]   [ y2     ]
+        [ V2ᵀ  -(C⁻¹ + V1ᵀ Z)    ] [t ] = [ -V1ᵀ u ]
+
+    puis x1 = u - Z t, avec u = u0 + Z C b où u0 = M0⁻¹ y0 est calculé une fois.
+    Z (n0 × k, dense) n'est pas conservé : seules les colonnes des nouvelles
+    transitions sont calculées, par lots d'au plus memoire_lot octets, et
+    réduites à V1ᵀ Z (k × k) ; V1ᵀ u = V1ᵀ u0 + V1ᵀ Z C b, et
+    x1 = u0 + M0⁻¹ V1 (C b - t) coûte une seule résolution avec le facteur.
+    La factorisation complète est refaite quand p + k dépasse seuil_rang ou
+    quand un pivot de la factorisation LU du système bordé devient trop petit.
+
+    M0 est ancrée comme dans resolution_energies (AnalyseComposantes.ancrer,
+    ancrage 'reference' : un terme λ e_r e_rᵀ par composante flottante, qui
+    fixe x[r] = 0 quel que soit λ). L'ancrage reste valable tant que chaque
+    composante flottante du système mis à jour contient exactement un niveau
+    pénalisé et qu'aucune composante ancrée n'en contient : une transition
+    qui relie une composante flottante au fondamental ou à une autre
+    composante, ou une suppression qui en détache une, provoque une
+    refactorisation.
+    """
+
+    def __init__(self, ids, idx_up, idx_low, poids, b, nombre_niveaux, cles_niveaux=None, references=(),
+                 seuil_rang=SEUIL_RANG, tolerance=TOLERANCE_DERIVE, memoire_lot=MEMOIRE_LOT_Z):
+        self.cles_niveaux = cles_niveaux
+        self.references = references
+        self.seuil_rang = seuil_rang
+        self.tolerance = tolerance
+        self.memoire_lot = memoire_lot
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.idx_up = np.asarray(idx_up, dtype=np.int64)
+        self.idx_low = np.asarray(idx_low, dtype=np.int64)
+        self.poids = np.asarray(poids, dtype=float)
+        self.b = np.asarray(b, dtype=float)
+        self.actives = np.ones(self.ids.shape[0], dtype=bool)
+        self.nombre_niveaux = int(nombre_niveaux)
+        self.refactorisations = 0
+        self.refactoriser()
+
+    def refactoriser(self):
+        """Factorisation complète de M sur les transitions actives ; efface les mises à jour."""
+        actives = self.actives
+        M0, self.y0, _ = assembler_equations_normales(self.idx_up[actives], self.idx_low[actives],
+                                                      self.poids[actives], self.b[actives], self.nombre_niveaux)
+        analyse = AnalyseComposantes(self.idx_up[actives], self.idx_low[actives], self.nombre_niveaux,
+                                     cles_niveaux=self.cles_niveaux, references=self.references)
+        self.M0 = analyse.ancrer(M0)
+        self._penalises = analyse.references[analyse.flottantes]
+        self.factorisation = FactorisationCholesky(self.M0.tocsc())
+        self.n0 = self.nombre_niveaux
+        self.u0 = self.factorisation.resoudre(self.y0)
+        self._maj_up = np.zeros(0, dtype=np.int64)
+        self._maj_low = np.zeros(0, dtype=np.int64)
+        self._maj_c = np.zeros(0)
+        self._maj_b = np.zeros(0)
+        # V1ᵀ Z (k × k, symétrique), dans un tableau dont la capacité double au besoin
+        self._VtZ = np.zeros((8, 8))
+        self._colonnes_Z = 0
+        self.refactorisations += 1
+
+    @property
+    def rang(self):
+        """Nombre de transitions modifiées + niveaux ajoutés depuis la dernière factorisation."""
+        return self._maj_c.shape[0] + self.nombre_niveaux - self.n0
+
+    def _empiler_mises_a_jour(self, idx_up, idx_low, c, b):
+        self._maj_up = np.concatenate((self._maj_up, idx_up))
+        self._maj_low = np.concatenate((self._maj_low, idx_low))
+        self._maj_c = np.concatenate((self._maj_c, c))
+        self._maj_b = np.concatenate((self._maj_b, b))
+
+    def ajouter_transitions(self, ids, idx_up, idx_low, poids, b, nombre_niveaux, cles_niveaux=None):
+        """Ajoute des transitions ; les niveaux numérotés à partir de l'ancien nombre_niveaux sont nouveaux."""
+        if nombre_niveaux < self.nombre_niveaux:
+            raise ValueError("Le nombre de niveaux ne peut pas diminuer lors d'un ajout.")
+        if cles_niveaux is not None:
+            self.cles_niveaux = cles_niveaux
+        idx_up = np.asarray(idx_up, dtype=np.int64)
+        idx_low = np.asarray(idx_low, dtype=np.int64)
+        poids = np.asarray(poids, dtype=float)
+        b = np.asarray(b, dtype=float)
+        self.ids = np.concatenate((self.ids, np.asarray(ids, dtype=np.int64)))
+        self.idx_up = np.concatenate((self.idx_up, idx_up))
+        self.idx_low = np.concatenate((self.idx_low, idx_low))
+        self.poids = np.concatenate((self.poids, poids))
+        self.b = np.concatenate((self.b, b))
+        self.actives = np.concatenate((self.actives, np.ones(idx_up.shape[0], dtype=bool)))
+        self.nombre_niveaux = int(nombre_niveaux)
+        self._empiler_mises_a_jour(idx_up, idx_low, poids, b)
+
+    def supprimer_transitions(self, ids):
+        """Retire des transitions (mise à jour de rang négatif) à partir de leurs identifiants."""
+        positions = np.flatnonzero(np.isin(self.ids, ids) & self.actives)
+        self.actives[positions] = False
+        self._empiler_mises_a_jour(self.idx_up[positions], self.idx_low[positions],
+                                   -self.poids[positions], self.b[positions])
+        return positions.shape[0]
+
+    def _extremites(self, debut=0, fin=None, decalage=0, nombre_lignes=None):
+        """Pour les mises à jour debut..fin-1 : (colonnes, lignes, signes) des éléments non nuls
+        de V restreints aux niveaux decalage .. decalage + nombre_lignes - 1."""
+        up, low = self._maj_up[debut:fin], self._maj_low[debut:fin]
+        nombre_lignes = self.n0 if nombre_lignes is None else nombre_lignes
+        colonnes = np.arange(up.shape[0])
+        actives = up != low  # Une transition d'un niveau vers lui-même donne une ligne nulle
+        resultat = []
+        for indices, signe in ((up, 1.0), (low, -1.0)):
+            dedans = actives & (indices >= decalage) & (indices < decalage + nombre_lignes)
+            resultat.append((colonnes[dedans], indices[dedans] - decalage, np.full(np.count_nonzero(dedans), signe)))
+        return tuple(np.concatenate(parties) for parties in zip(*resultat))
+
+    def _V_dense(self, decalage, nombre_lignes):
+        colonnes, lignes, signes = self._extremites(decalage=decalage, nombre_lignes=nombre_lignes)
+        V = np.zeros((nombre_lignes, self._maj_c.shape[0]))
+        V[lignes, colonnes] = signes
+        return V
+
+    def _VtX(self, X):
+        """V1ᵀ X pour une matrice X (n0, r), sans former V1."""
+        colonnes, lignes, signes = self._extremites()
+        resultat = np.zeros((self._maj_c.shape[0], X.shape[1]))
+        np.add.at(resultat, colonnes, signes[:, None] * X[lignes])
+        return resultat
+
+    def _completer_VtZ(self):
+        """Ajoute à V1ᵀ Z les lignes et colonnes des transitions arrivées depuis la dernière résolution."""
+        k = self._maj_c.shape[0]
+        if k <= self._colonnes_Z:
+            return
+        if k > self._VtZ.shape[0]:
+            capacite = max(k, 2 * self._VtZ.shape[0])
+            VtZ = np.zeros((capacite, capacite))
+            VtZ[:self._colonnes_Z, :self._colonnes_Z] = self._VtZ[:self._colonnes_Z, :self._colonnes_Z]
+            self._VtZ = VtZ
+        # Z = M0⁻¹ V1 est dense : ses colonnes sont calculées par lots de mémoire bornée
+        par_lot = max(1, self.memoire_lot // (8 * self.n0))
+        for debut in range(self._colonnes_Z, k, par_lot):
+            fin = min(k, debut + par_lot)
+            colonnes, lignes, signes = self._extremites(debut, fin)
+            V1_lot = np.zeros((self.n0, fin - debut))
+            V1_lot[lignes, colonnes] = signes
+            VtZ_lot = self._VtX(self.factorisation.resoudre(V1_lot).reshape(self.n0, -1))
+            self._VtZ[:k, debut:fin] = VtZ_lot
+            self._VtZ[debut:fin, :k] = VtZ_lot.T
+        self._colonnes_Z = k
+
+    def _ancrage_valide(self):
+        """Vrai si les termes d'ancrage de M0 ancrent encore exactement les composantes flottantes de M."""
+        actives = self.actives
+        analyse = AnalyseComposantes(self.idx_up[actives], self.idx_low[actives], self.nombre_niveaux)
+        penalites = np.bincount(analyse.etiquettes[self._penalises], minlength=analyse.nombre)
+        attendues = np.zeros(analyse.nombre, dtype=np.int64)
+        attendues[analyse.flottantes] = 1
+        return np.array_equal(penalites, attendues)
+
+    def residu_relatif(self, x):
+        """||M x - y|| / ||y|| sur l'ensemble des transitions actives (vérification, en O(m))."""
+        actives = self.actives
+        up, low = self.idx_up[actives], self.idx_low[actives]
+        w, b = self.poids[actives], self.b[actives]
+        Ax = np.where(up >= 0, x[np.maximum(up, 0)], 0) - np.where(low >= 0, x[np.maximum(low, 0)], 0)
+        r = w * (b - Ax)
+        r[up == low] = 0
+        residu = (np.bincount(up[up >= 0], weights=r[up >= 0], minlength=self.nombre_niveaux)
+                  - np.bincount(low[low >= 0], weights=r[low >= 0], minlength=self.nombre_niveaux))
+        y = (np.bincount(up[up >= 0], weights=(w * b)[up >= 0], minlength=self.nombre_niveaux)
+             - np.bincount(low[low >= 0], weights=(w * b)[low >= 0], minlength=self.nombre_niveaux))
+        return np.linalg.norm(residu) / max(np.linalg.norm(y), np.finfo(float).tiny)
+
+    def resoudre(self):
+        """Retourne les énergies à jour, en refactorisant si nécessaire."""
+        if self.rang > self.seuil_rang:
+            print(f"Mise à jour de rang {self.rang} > {self.seuil_rang} : refactorisation complète.")
+            self.refactoriser()
+        if self.rang == 0:
+            return self.u0.copy()
+        if not self._ancrage_valide():
+            print("Composantes flottantes modifiées par la mise à jour : refactorisation complète.")
+            self.refactoriser()
+            return self.u0.copy()
+
+        self._completer_VtZ()
+        k, p = self._maj_c.shape[0], self.nombre_niveaux - self.n0
+        VtZ = self._VtZ[:k, :k]
+        cb = self._maj_c * self._maj_b
+
+        # V1ᵀ u = V1ᵀ (u0 + Z C b) = V1ᵀ u0 + V1ᵀ Z C b : aucune résolution supplémentaire
+        Vtu = self._VtX(self.u0[:, None])[:, 0] + VtZ @ cb
+        V2 = self._V_dense(self.n0, p)
+        systeme = np.zeros((p + k, p + k))
+        systeme[:p, p:] = V2
+        systeme[p:, :p] = V2.T
+        systeme[p:, p:] = -(np.diag(1 / self._maj_c) + VtZ)
+        second_membre = np.concatenate((V2 @ cb, -Vtu))
+
+        # Dérive : un système bordé presque singulier (suppressions qui se compensent,
+        # niveau nouveau mal relié...) fait perdre la précision de la mise à jour ;
+        # les pivots de la factorisation LU, nécessaire de toute façon, suffisent à le voir
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', LinAlgWarning)  # Pivot nul : traité ci-dessous
+            lu, pivots = lu_factor(systeme, check_finite=False)
+        diagonale = np.abs(np.diag(lu))
+        if not diagonale.min() > self.tolerance * diagonale.max():
+            print("Système de mise à jour presque singulier : refactorisation complète.")
+            self.refactoriser()
+            return self.u0.copy()
+        solution = lu_solve((lu, pivots), second_membre, check_finite=False)
+        x2, t = solution[:p], solution[p:]
+
+        # x1 = u - Z t = u0 + M0⁻¹ V1 (C b - t)
+        colonnes, lignes, signes = self._extremites()
+        V1_correction = np.bincount(lignes, weights=signes * (cb - t)[colonnes], minlength=self.n0)
+        return np.concatenate((self.u0 + self.factorisation.resoudre(V1_correction), x2))
+
+
+class EnergiesIncrementales:
+    """Énergies des niveaux de la table transitions, tenues à jour au fil des insertions et suppressions.
+
+    Les niveaux gardent le numéro qu'ils ont reçu à leur première apparition ;
+    les nouveaux niveaux sont numérotés à la suite. Les suppressions sont
+    repérées par le compteur de schema.revision_transitions : chaque ligne
+    supprimée ou modifiée l'incrémente, si bien qu'un écart égal au nombre
+    d'identifiants disparus signifie que la table n'a subi que des
+    suppressions, transmises au solveur comme mises à jour de rang négatif.
+    Si les nouvelles transitions sortent des bornes du codec, si des
+    transitions ont été modifiées ou si le compteur est absent (base d'un
+    schéma antérieur) alors que des lignes ont disparu, tout est reconstruit.
+    """
+
+    def __init__(self, cursor, fondamental, exclure_fondamental=True, seuil_rang=SEUIL_RANG):
+        self.fondamental = fondamental
+        self.exclure_fondamental = exclure_fondamental
+        self.seuil_rang = seuil_rang
+        self.reconstruire(cursor)
+
+    def reconstruire(self, cursor):
+        transitions = lire_transitions(cursor)
+        valide = transitions['valide']
+        self.codec, self.cles_niveaux, idx_up, idx_low = numeroter_niveaux(
+            transitions, fondamental=self.fondamental, exclure_fondamental=self.exclure_fondamental)
+        self.dernier_id = int(transitions['id'].max()) if transitions['id'].shape[0] else 0
+        self.nombre_lignes = transitions['id'].shape[0]
+        # Identifiants de toutes les lignes lues, valides ou non, pour repérer les suppressions
+        self.ids_lus = np.sort(transitions['id'])
+        self.revision = revision_transitions(cursor.connection)
+        references = ()
+        if not self.exclure_fondamental:
+            references = numeros_niveaux(self.codec, self.cles_niveaux, [self.fondamental])
+        self.solveur = SolveurIncremental(transitions['id'][valide], idx_up[valide], idx_low[valide],
+                                          1 / transitions['uncertainty'][valide] ** 2,
+                                          transitions['wavenumber'][valide], self.cles_niveaux.shape[0],
+                                          cles_niveaux=self.cles_niveaux, references=references,
+                                          seuil_rang=self.seuil_rang)
+
+    def _numeroter(self, cles):
+        """Numéros des niveaux de clés données, en ajoutant les niveaux inconnus à la suite."""
+        numeros = numeros_depuis_cles(self.cles_niveaux, cles)
+        inconnues = numeros < 0
+
+        # Nouveaux niveaux, dans l'ordre de première apparition
+        nouvelles, premiere, inverse = np.unique(cles[inconnues], return_index=True, return_inverse=True)
+        ordre = np.argsort(premiere)
+        rang = np.empty_like(ordre)
+        rang[ordre] = np.arange(ordre.shape[0])
+        numeros[inconnues] = self.cles_niveaux.shape[0] + rang[inverse.ravel()]
+        self.cles_niveaux = np.concatenate((self.cles_niveaux, nouvelles[ordre]))
+        return numeros
+
+    def _supprimees(self, cursor, revision):
+        """Identifiants des lignes supprimées depuis le dernier appel, ou None si la table a été modifiée."""
+        if revision is None and self.revision is None:
+            return np.zeros(0, dtype=np.int64)
+        if revision is None or self.revision is None or revision[0] != self.revision[0]:
+            return None
+        if revision[1] == self.revision[1]:
+            return np.zeros(0, dtype=np.int64)
+        restants = np.fromiter((ligne[0] for ligne in cursor.execute(
+            'SELECT id FROM transitions WHERE id <= ?', (self.dernier_id,))), dtype=np.int64)
+        supprimees = np.setdiff1d(self.ids_lus, restants, assume_unique=True)
+        # Une modification incrémente aussi le compteur sans faire disparaître d'identifiant
+        return supprimees if revision[1] - self.revision[1] == supprimees.shape[0] else None
+
+    def actualiser(self, cursor):
+        """Intègre les transitions insérées ou supprimées depuis le dernier appel et retourne les énergies."""
+        debut = time.perf_counter()
+        revision = revision_transitions(cursor.connection)
+        nombre_lignes = cursor.execute('SELECT COUNT(*) FROM transitions').fetchone()[0]
+        supprimees = self._supprimees(cursor, revision)
+        nouvelles = lire_transitions(cursor, REQUETE_NOUVELLES_TRANSITIONS, (self.dernier_id,))
+        if supprimees is None or self.nombre_lignes - supprimees.shape[0] + nouvelles['id'].shape[0] != nombre_lignes:
+            print("La table transitions a changé autrement que par des ajouts et suppressions : "
+                  "reconstruction complète.")
+            self.reconstruire(cursor)
+            return self.solveur.resoudre()
+
+        valide = nouvelles['valide']
+        try:
+            cles_up = self.codec.encoder(nouvelles['qn_up'][valide])
+            cles_low = self.codec.encoder(nouvelles['qn_low'][valide])
+        except ValueError:
+            print("Nouveaux nombres quantiques hors des bornes du codec : reconstruction complète.")
+            self.reconstruire(cursor)
+            return self.solveur.resoudre()
+
+        # Entrelacer up/low pour numéroter les nouveaux niveaux dans l'ordre de première apparition
+        entrelacees = np.empty(2 * cles_up.shape[0], dtype=np.int64)
+        entrelacees[0::2], entrelacees[1::2] = cles_up, cles_low
+        numeros = np.full(entrelacees.shape[0], -1, dtype=np.int64)
+        retenues = np.ones(entrelacees.shape[0], dtype=bool)
+        if self.exclure_fondamental:
+            retenues = entrelacees != self.codec.encoder_tuple(self.fondamental)
+        numeros[retenues] = self._numeroter(entrelacees[retenues])
+
+        if supprimees.shape[0]:
+            self.solveur.supprimer_transitions(supprimees)
+        self.solveur.ajouter_transitions(nouvelles['id'][valide], numeros[0::2], numeros[1::2],
+                                         1 / nouvelles['uncertainty'][valide] ** 2,
+                                         nouvelles['wavenumber'][valide], self.cles_niveaux.shape[0],
+                                         cles_niveaux=self.cles_niveaux)
+        if nouvelles['id'].shape[0]:
+            self.dernier_id = int(nouvelles['id'].max())
+        self.ids_lus = np.concatenate((np.setdiff1d(self.ids_lus, supprimees, assume_unique=True),
+                                       np.sort(nouvelles['id'])))
+        self.nombre_lignes = nombre_lignes
+        self.revision = revision
+        x = self.solveur.resoudre()
+        print(f"{nouvelles['id'].shape[0]} transitions intégrées, {supprimees.shape[0]} supprimées, énergies "
+              f"mises à jour en {(time.perf_counter() - debut) * 1000:.1f} ms.")
+        return x
+
+    def niveaux(self):
+        """Nombres quantiques des niveaux, dans l'ordre des énergies."""
+        return self.codec.decoder(self.cles_niveaux)
+
+    def sauvegarder(self, x, fichier='energies_incrementales.txt'):
+        """Écrit les nombres quantiques et l'énergie de chaque niveau."""
+        colonnes = np.column_stack((self.niveaux(), x))
+        formats = ['%d'] * len(self.codec.noms) + ['%.8f']
+        np.savetxt(fichier, colonnes, fmt=formats, header=' '.join(self.codec.noms + ['energy']), comments='')
@@ -0,0 +1,415 @@
+import argparse
+import json
+import os
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+import schema
+from acces_donnees import connecter
+from ancrage import AnalyseComposantes, resoudre_par_composantes, ANCRAGES
+from assemblage import etiqueter_composantes, numeros_niveaux, MotifNormal
+from bootstrap import bootstrap, MODES_BOOTSTRAP
+from cache_niveaux import CacheSysteme, REPERTOIRE_CACHE
+from cholesky_creux import METHODES_RESOLUTION, FactorisationCholesky
+from codec_niveaux import QNAMES_FILE
+from diagnostics import diagnostics_transitions
+from export_matrices import exporter_matrice, FORMATS_EXPORT, FORMAT_EXPORT_DEFAUT
+from ingestion import inserer_transitions_en_masse
+from instrumentation import etape, profil_demande
+from inversion_selective import inverser_selectivement
+from qr_creux import resoudre_par_qr
+from reponderation import reponderation_robuste
+from resolution_parallele import limiter_threads_blas
+from solveur_iteratif import OperateurNormal, resoudre_iteratif
+
+# Méthodes de résolution du pipeline (celles de choleski.py)
+METHODES_PIPELINE = METHODES_RESOLUTION + ('qr', 'iterative', 'robuste')
+
+# Matrices exportables : design (A), normales (M), poids (diagonale de W)
+MATRICES_EXPORTABLES = ('design', 'normales', 'poids')
+
+# Paramètres du mode itératif
+ALGORITHME_ITERATIF = 'cg'
+PRECONDITIONNEUR = 'arbre'
+TOLERANCE_ITERATIVE = 1e-12
+ITERATIONS_MAX = 5000
+
+
+class Pipeline:
+    """Chaîne non interactive ingestion -> indexation -> assemblage -> résolution -> export pour une base.
+
+    Toutes les options sont des arguments (aucun input()) et les étapes
+    partagent un seul jeu de données chargé en mémoire : la table
+    transitions est lue au plus une fois, par la première étape qui en a
+    besoin (et pas du tout si le cache de CacheSysteme est à jour). Chaque
+    étape peut être appelée séparément, dans l'ordre ; executer() les
+    enchaîne toutes et retourne un résumé sérialisable en JSON.
+
+    Sans fichier_qnames, le Qnames.json du répertoire de la base est utilisé
+    s'il existe (sinon celui du répertoire courant) : chaque molécule peut
+    ainsi avoir son propre répertoire.
+
+    Avec bootstrap > 0, resoudre() estime aussi les incertitudes des niveaux
+    par bootstrap (mode_bootstrap, sur processus_bootstrap processus) ; elles
+    sont ajoutées à niveaux.csv.
+    """
+
+    def __init__(self, fichier_base, fichier_qnames=None, ground_energy_status=0, methode='creuse',
+                 incertitudes=True, exports=(), format_export=FORMAT_EXPORT_DEFAUT, repertoire_sortie='.',
+                 repertoire_cache=REPERTOIRE_CACHE, ancrage='reference', niveaux_reference=(), diagnostics=False,
+                 bootstrap=0, mode_bootstrap='reechantillonnage', processus_bootstrap=1):
+        if ground_energy_status not in (0, 1):
+            raise ValueError("La valeur de ground_energy_status doit être 0 ou 1.")
+        if methode not in METHODES_PIPELINE:
+            raise ValueError(f"La méthode de résolution doit être l'une de {METHODES_PIPELINE}.")
+        if ancrage not in ANCRAGES:
+            raise ValueError(f"L'ancrage doit être l'un de {ANCRAGES}.")
+        if diagnostics and (not incertitudes or methode == 'iterative'):
+            raise ValueError("Les diagnostics des transitions demandent les incertitudes et une méthode directe.")
+        if bootstrap and (not incertitudes or methode == 'iterative'):
+            raise ValueError("Le bootstrap demande les incertitudes et une méthode directe.")
+        if mode_bootstrap not in MODES_BOOTSTRAP:
+            raise ValueError(f"Le mode de bootstrap doit être l'un de {MODES_BOOTSTRAP}.")
+        inconnues = set(exports) - set(MATRICES_EXPORTABLES)
+        if inconnues:
+            raise ValueError(f"Matrices à exporter inconnues : {sorted(inconnues)}. Valeurs possibles : "
+                             f"{MATRICES_EXPORTABLES}")
+        self.fichier_base = fichier_base
+        self.fichier_qnames = fichier_qnames or qnames_de_base(fichier_base)
+        self.ground_energy_status = ground_energy_status
+        self.methode = methode
+        self.incertitudes = incertitudes
+        self.exports = tuple(exports)
+        self.format_export = format_export
+        self.repertoire_sortie = repertoire_sortie
+        self.repertoire_cache = repertoire_cache
+        self.ancrage = ancrage
+        self.niveaux_reference = [tuple(niveau) for niveau in niveaux_reference]
+        self.diagnostics = diagnostics
+        self.repliques_bootstrap = bootstrap
+        self.mode_bootstrap = mode_bootstrap
+        self.processus_bootstrap = processus_bootstrap
+
+        with open(self.fichier_qnames, 'r') as f:
+            qnames_data = json.load(f)
+        self.quantum_names = qnames_data['quantum_names']
+        self.fondamental = tuple(qnames_data['ground_state_numbers'])
+
+        self.conn = None
+        self.cache = None
+        self.analyse = None
+        self.resume = {'base': fichier_base, 'qnames': self.fichier_qnames, 'methode': methode, 'fichiers': []}
+        self.x = None
+        self.sigma = None
+        # Inversion sélective de la dernière factorisation et poids correspondants (diagnostics)
+        self.inversion = None
+        self.poids = None
+        self.sigma_bootstrap = None
+
+    def _connexion(self):
+        if self.conn is None:
+            self.conn = connecter(self.fichier_base)
+            # Création ou migration du schéma : le cache s'appuie alors sur le compteur de révision
+            schema.create_transitions_table(self.conn, self.quantum_names)
+        return self.conn
+
+    def ingerer(self, fichiers_entree=()):
+        """Insère les transitions des fichiers .xlsx/.csv donnés (aucun : la base est utilisée telle quelle)."""
+        conn = self._connexion()
+        inseres = rejetees = 0
+        for chemin in fichiers_entree:
+            with etape('pipeline_ingestion'):
+                df = pd.read_csv(chemin) if chemin.endswith('.csv') else pd.read_excel(chemin)
+                nombre, lignes_rejetees = inserer_transitions_en_masse(conn, df, self.quantum_names)
+            inseres += nombre
+            rejetees += len(lignes_rejetees)
+        self.resume.update(inseres=inseres, rejetees=rejetees)
+
+    def indexer(self):
+        """Lit les transitions (ou les relit du cache) et numérote les niveaux."""
+        with etape('pipeline_indexation'):
+            self.cache = CacheSysteme(self._connexion().cursor(), fondamental=self.fondamental,
+                                      exclure_fondamental=(self.ground_energy_status == 0),
+                                      repertoire=self.repertoire_cache, fichier_qnames=self.fichier_qnames)
+            codec, cles_niveaux, idx_up, idx_low, transitions = self.cache.niveaux()
+            nombre_composantes = compter_composantes(idx_up, idx_low, cles_niveaux.shape[0],
+                                                     fondamental_exclu=(self.ground_energy_status == 0))
+            # Blocs de M et composantes flottantes ; le fondamental, s'il est libre, sert de référence
+            references = numeros_niveaux(codec, cles_niveaux, [self.fondamental] + self.niveaux_reference)
+            self.analyse = AnalyseComposantes(idx_up, idx_low, cles_niveaux.shape[0], cles_niveaux=cles_niveaux,
+                                              references=references, ancrage=self.ancrage)
+        self.resume.update(transitions=int(idx_up.shape[0]), niveaux=int(cles_niveaux.shape[0]),
+                           composantes=int(nombre_composantes),
+                           composantes_flottantes=self.analyse.decrire(codec, cles_niveaux))
+        return codec, cles_niveaux, idx_up, idx_low, transitions
+
+    def assembler(self):
+        """Assemble M = Aᵀ W A et y = Aᵀ W b (ou les relit du cache) ; retourne (M, y)."""
+        with etape('pipeline_assemblage'):
+            M, y = self.cache.equations_normales()
+        self.resume['nnz_M'] = int(M.nnz)
+        return M, y
+
+    def resoudre(self):
+        """Résout le système avec la méthode choisie ; retourne les énergies (et leurs incertitudes si demandées)."""
+        _, cles_niveaux, idx_up, idx_low, transitions = self.cache.niveaux()
+        with etape('pipeline_resolution'):
+            if self.methode in METHODES_RESOLUTION:
+                # Tous les blocs factorisés en une fois, composantes flottantes ancrées
+                M, y = self.assembler()
+                self.x, factorisation = resoudre_par_composantes(M, y, self.analyse, methode=self.methode,
+                                                                 retourner_factorisation=True)
+                self.poids = self.cache.poids()
+            elif self.methode == 'qr':
+                # Moindres carrés par QR de √W A, sans former M
+                self.poids = self.cache.poids()
+                self.x, factorisation = resoudre_par_qr(self.cache.matrice_design(), self.poids,
+                                                        transitions['wavenumber'], self.analyse,
+                                                        retourner_factorisation=True)
+            elif self.methode == 'robuste':
+                motif = MotifNormal(idx_up, idx_low, cles_niveaux.shape[0])
+                self.x, sigma_transitions, historique, factorisation = reponderation_robuste(
+                    motif, transitions['wavenumber'], transitions['uncertainty'], analyse=self.analyse)
+                self.resume['iterations_reponderation'] = len(historique)
+                self.poids = 1 / sigma_transitions ** 2
+            else:
+                operateur = OperateurNormal(idx_up, idx_low, self.cache.poids(), cles_niveaux.shape[0])
+                self.x, historique = resoudre_iteratif(operateur, transitions['wavenumber'],
+                                                       algorithme=ALGORITHME_ITERATIF, tolerance=TOLERANCE_ITERATIVE,
+                                                       iterations_max=ITERATIONS_MAX,
+                                                       preconditionneur=PRECONDITIONNEUR)
+                # M est singulière sur les composantes flottantes : les ramener à la jauge de l'ancrage
+                self.x = self.analyse.fixer_jauge(self.x)
+                self.resume['residu_relatif'] = float(historique[-1])
+            if self.incertitudes and self.methode != 'iterative':
+                self.inversion = inverser_selectivement(factorisation)
+                self.sigma = np.sqrt(self.analyse.corriger_variances(self.inversion.variances()))
+            if self.repliques_bootstrap:
+                self._bootstrap(factorisation, idx_up, idx_low, transitions)
+        return self.x, self.sigma
+
+    def _bootstrap(self, factorisation, idx_up, idx_low, transitions):
+        """Incertitudes bootstrap des niveaux, avec les poids et l'ordonnancement de la résolution."""
+        motif = MotifNormal(idx_up, idx_low, self.x.shape[0])
+        permutation = factorisation.q if isinstance(factorisation, FactorisationCholesky) else None
+        statistiques, rejetees = bootstrap(motif, self.analyse, self.poids, transitions['wavenumber'],
+                                           1 / np.sqrt(self.poids), mode=self.mode_bootstrap,
+                                           nombre_repliques=self.repliques_bootstrap,
+                                           nombre_processus=self.processus_bootstrap, permutation=permutation,
+                                           energies=self.x)
+        self.sigma_bootstrap = statistiques.ecarts_types()
+        self.resume['bootstrap'] = {'mode': self.mode_bootstrap, 'repliques': statistiques.repliques,
+                                    'rejetees': rejetees, 'repliques_min_par_niveau': int(statistiques.nombre.min())}
+
+    def exporter(self):
+        """Écrit les énergies, les niveaux (nombres quantiques, énergie, incertitude) et les matrices demandées."""
+        codec, cles_niveaux, _, _, _ = self.cache.niveaux()
+        os.makedirs(self.repertoire_sortie, exist_ok=True)
+        fichiers = self.resume['fichiers']
+        with etape('pipeline_export'):
+            chemin = os.path.join(self.repertoire_sortie, 'energies.txt')
+            np.savetxt(chemin, self.x)
+            fichiers.append(chemin)
+            if self.sigma is not None:
+                chemin = os.path.join(self.repertoire_sortie, 'incertitudes.txt')
+                np.savetxt(chemin, self.sigma)
+                fichiers.append(chemin)
+
+            niveaux = pd.DataFrame(codec.decoder(cles_niveaux), columns=self.quantum_names)
+            niveaux['composante'] = self.analyse.etiquettes
+            niveaux['energie'] = self.x
+            if self.sigma is not None:
+                niveaux['incertitude'] = self.sigma
+            if self.sigma_bootstrap is not None:
+                niveaux['incertitude_bootstrap'] = self.sigma_bootstrap
+            chemin = os.path.join(self.repertoire_sortie, 'niveaux.csv')
+            niveaux.to_csv(chemin, index=False)
+            fichiers.append(chemin)
+
+            if self.diagnostics:
+                _, _, idx_up, idx_low, transitions = self.cache.niveaux()
+                diagnostics = diagnostics_transitions(idx_up, idx_low, self.poids, transitions['wavenumber'],
+                                                      self.x, self.inversion)
+                diagnostics.insert(0, 'id', np.asarray(transitions['id']))
+                chemin = os.path.join(self.repertoire_sortie, 'diagnostics_transitions.csv')
+                diagnostics.to_csv(chemin, index=False)
+                fichiers.append(chemin)
+                self.resume['transitions_isolees'] = int(diagnostics['isolee'].sum())
+
+            for nom in self.exports:
+                if nom == 'design':
+                    matrice = self.cache.matrice_design()
+                elif nom == 'normales':
+                    matrice, _ = self.cache.equations_normales()
+                else:
+                    matrice = np.asarray(self.cache.poids()).reshape(-1, 1)
+                fichiers.append(exporter_matrice(matrice, os.path.join(self.repertoire_sortie, f'matrice_{nom}'),
+                                                 self.format_export))
+
+    def executer(self, fichiers_entree=()):
+        """Enchaîne toutes les étapes ; retourne le résumé de l'exécution."""
+        if not fichiers_entree and not os.path.exists(self.fichier_base):
+            raise FileNotFoundError(f"La base '{self.fichier_base}' est introuvable.")
+        debut = time.perf_counter()
+        try:
+            self.ingerer(fichiers_entree)
+            self.indexer()
+            self.resoudre()
+            self.exporter()
+        finally:
+            self.fermer()
+        self.resume['cache'] = list(self.cache.succes) if self.cache is not None else []
+        self.resume['duree_s'] = time.perf_counter() - debut
+        return self.resume
+
+    def fermer(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def compter_composantes(idx_up, idx_low, nombre_niveaux, fondamental_exclu=False):
+    """Nombre de composantes connexes du réseau, fondamental compris.
+
+    Un fondamental exclu (indice -1) relie tout de même ses voisins : il est
+    rattaché au graphe comme niveau supplémentaire, et n'est pas compté s'il
+    n'apparaît dans aucune transition.
+    """
+    if not fondamental_exclu:
+        return etiqueter_composantes(idx_up, idx_low, nombre_niveaux)[0]
+    idx_up = np.where(idx_up < 0, nombre_niveaux, idx_up)
+    idx_low = np.where(idx_low < 0, nombre_niveaux, idx_low)
+    nombre, etiquettes, _ = etiqueter_composantes(idx_up, idx_low, nombre_niveaux + 1)
+    return nombre - int(np.all(etiquettes[:nombre_niveaux] != etiquettes[nombre_niveaux]))
+
+
+def qnames_de_base(fichier_base):
+    """Qnames.json du répertoire de la base s'il existe, sinon celui du répertoire courant."""
+    voisin = os.path.join(os.path.dirname(os.path.abspath(fichier_base)), QNAMES_FILE)
+    return voisin if os.path.exists(voisin) else QNAMES_FILE
+
+
+def repertoire_sortie_base(repertoire_sortie, fichier_base, fichiers_bases):
+    """Répertoire des résultats d'une base : repertoire_sortie, ou un sous-répertoire par base s'il y en a plusieurs.
+
+    Le sous-répertoire reprend le chemin de la base relatif au répertoire
+    commun à toutes les bases, sans extension : h2o/marvel.db et
+    co2/marvel.db donnent h2o/marvel et co2/marvel, pas deux fois marvel.
+    """
+    if len(fichiers_bases) <= 1:
+        return repertoire_sortie
+    commun = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in fichiers_bases])
+    relatif = os.path.relpath(os.path.abspath(fichier_base), commun)
+    return os.path.join(repertoire_sortie, os.path.splitext(relatif)[0])
+
+
+def _executer_base(arguments):
+    """Exécute le pipeline d'une base ; retourne (base, resume, erreur) sans jamais lever d'exception."""
+    fichier_base, options, fichiers_entree = arguments
+    try:
+        return fichier_base, Pipeline(fichier_base, **options).executer(fichiers_entree), None
+    except Exception as e:
+        traceback.print_exc()
+        return fichier_base, None, f"{type(e).__name__} : {e}"
+
+
+def executer_bases(fichiers_bases, nombre_processus=1, threads_par_processus=1, fichiers_entree=(),
+                   repertoire_sortie='.', **options):
+    """Exécute le pipeline sur plusieurs bases (une molécule ou un jeu de données par base).
+
+    Avec nombre_processus > 1, les bases sont réparties dans un pool de
+    processus, les plus grosses en premier, chaque processus étant limité à
+    threads_par_processus threads BLAS. Les résultats de chaque base vont
+    dans repertoire_sortie/<chemin de la base sans extension>/, relatif au
+    répertoire commun des bases (directement dans repertoire_sortie s'il
+    n'y a qu'une base). Retourne (resumes, erreurs) : deux dictionnaires
+    indexés par fichier de base.
+
+    Les processus d'un pool ne pouvant pas créer le leur, le bootstrap
+    parallèle (processus_bootstrap > 1) demande de traiter les bases une à
+    une.
+    """
+    plusieurs = len(fichiers_bases) > 1
+    if nombre_processus > 1 and plusieurs and options.get('processus_bootstrap', 1) > 1:
+        raise ValueError("Le bootstrap parallèle ne s'utilise qu'avec des bases traitées une à une (processus = 1).")
+    bases = sorted(fichiers_bases, key=lambda f: -os.path.getsize(f) if os.path.exists(f) else 0)
+    taches = [(fichier_base, dict(options, repertoire_sortie=repertoire_sortie_base(repertoire_sortie, fichier_base,
+                                                                                     fichiers_bases)),
+               fichiers_entree) for fichier_base in bases]
+
+    resumes, erreurs = {}, {}
+    if nombre_processus == 1 or len(taches) == 1:
+        for resultat in map(_executer_base, taches):
+            _ranger(resultat, resumes, erreurs)
+    else:
+        with Pool(min(nombre_processus, len(taches)), initializer=limiter_threads_blas,
+                  initargs=(threads_par_processus,)) as pool:
+            # chunksize=1 : les bases partent dans l'ordre, les plus grosses d'abord
+            for resultat in pool.imap_unordered(_executer_base, taches, chunksize=1):
+                _ranger(resultat, resumes, erreurs)
+    return resumes, erreurs
+
+
+def _ranger(resultat, resumes, erreurs):
+    fichier_base, resume, erreur = resultat
+    if erreur is None:
+        resumes[fichier_base] = resume
+        print(f"{fichier_base} : {resume['niveaux']} niveaux, {resume['transitions']} transitions, "
+              f"{resume['composantes']} composante(s) dont {len(resume['composantes_flottantes'])} flottante(s), "
+              f"{resume['duree_s']:.2f} s.")
+    else:
+        erreurs[fichier_base] = erreur
+        print(f"Erreur pour {fichier_base} : {erreur}")
+
+
+if __name__ == '__main__':
+    profil_demande()
+    parser = argparse.ArgumentParser(
+        description="Pipeline non interactif : ingestion, indexation, assemblage, résolution et export.")
+    parser.add_argument('bases', nargs='*', default=['marvel.db'], help="bases SQLite à traiter (défaut : marvel.db)")
+    parser.add_argument('--entree', nargs='+', default=[], help="fichiers .xlsx/.csv à insérer avant la résolution")
+    parser.add_argument('--qnames', help="Qnames.json à utiliser (défaut : celui du répertoire de chaque base)")
+    parser.add_argument('--ground-energy-status', type=int, choices=(0, 1), default=0,
+                        help="0 : fondamental fixé (défaut), 1 : libre")
+    parser.add_argument('--methode', choices=METHODES_PIPELINE, default='creuse')
+    parser.add_argument('--ancrage', choices=ANCRAGES, default='reference',
+                        help="ancrage des composantes sans transition vers le fondamental")
+    parser.add_argument('--references', nargs='+', default=[], metavar='"Q1 Q2 ..."',
+                        help="niveaux de référence préférés des composantes flottantes (nombres quantiques)")
+    parser.add_argument('--sans-incertitudes', action='store_true', help="ne pas calculer les incertitudes")
+    parser.add_argument('--diagnostics', action='store_true',
+                        help="écrire les leviers et résidus supprimés des transitions")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="incertitudes des niveaux par bootstrap sur N répliques (défaut : 0, désactivé)")
+    parser.add_argument('--mode-bootstrap', choices=MODES_BOOTSTRAP, default='reechantillonnage')
+    parser.add_argument('--processus-bootstrap', type=int, default=1, help="processus calculant les répliques")
+    parser.add_argument('--exports', nargs='*', choices=MATRICES_EXPORTABLES, default=[],
+                        help="matrices à exporter")
+    parser.add_argument('--format', choices=tuple(FORMATS_EXPORT), default=FORMAT_EXPORT_DEFAUT)
+    parser.add_argument('--sortie', default='.', help="répertoire des résultats")
+    parser.add_argument('--processus', type=int, default=1, help="nombre de bases traitées en parallèle")
+    parser.add_argument('--threads', type=int, default=1, help="threads BLAS par processus")
+    parser.add_argument('--resume', help="fichier JSON où écrire le résumé de chaque base")
+    arguments = parser.parse_args()
+    if arguments.entree and len(arguments.bases) > 1:
+        parser.error("--entree ne s'utilise qu'avec une seule base.")
+    if arguments.processus > 1 and arguments.processus_bootstrap > 1 and len(arguments.bases) > 1:
+        parser.error("--processus-bootstrap > 1 ne s'utilise qu'avec --processus 1.")
+
+    resumes, erreurs = executer_bases(
+        arguments.bases, nombre_processus=arguments.processus, threads_par_processus=arguments.threads,
+        fichiers_entree=arguments.entree, repertoire_sortie=arguments.sortie, fichier_qnames=arguments.qnames,
+        ground_energy_status=arguments.ground_energy_status, methode=arguments.methode,
+        incertitudes=not arguments.sans_incertitudes, exports=arguments.exports, format_export=arguments.format,
+        ancrage=arguments.ancrage, niveaux_reference=[tuple(map(int, niveau.split())) for niveau in arguments.references],
+        diagnostics=arguments.diagnostics, bootstrap=arguments.bootstrap, mode_bootstrap=arguments.mode_bootstrap,
+        processus_bootstrap=arguments.processus_bootstrap)
+    if arguments.resume:
+        with open(arguments.resume, 'w') as f:
+            json.dump({'resumes': resumes, 'erreurs': erreurs}, f, indent=1)
+        print(f"Résumé enregistré dans '{arguments.resume}'.")
+    if erreurs:
+        raise SystemExit(1)
@@ -0,0 +1,268 @@
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.sparse import csr_matrix, diags, vstack
+from scipy.sparse.linalg import LinearOperator, lsmr, spsolve_triangular
+
+from ancrage import raffiner
+from cholesky_creux import FactorisationCholesky
+from inversion_selective import InversionSelective
+from instrumentation import etape
+
+# SuiteSparseQR (PySPQR) est utilisé s'il est installé, sinon une QR dense par composante
+try:
+    import sparseqr
+except ImportError:
+    sparseqr = None
+
+# Mémoire maximale (octets) du tableau dense d'une composante factorisée par QR dense ; au-delà, la
+# composante passe par un facteur R creux (Cholesky ordonnancé) raffiné par LSMR sur √W A
+MEMOIRE_MAX_QR = 64 * 1024 ** 2
+
+# Raffinement LSMR des composantes trop grandes pour la QR dense
+TOLERANCE_LSMR = 1e-14
+ITERATIONS_LSMR = 50
+
+
+def systeme_pondere(A, poids, b, analyse):
+    """Retourne (Ã, b̃) : √W A et √W b complétés par les lignes d'ancrage √λ e_j des composantes flottantes.
+
+    ÃᵀÃ est exactement la matrice ancrée analyse.ancrer(Aᵀ W A) : les
+    composantes flottantes sont traitées comme dans la résolution de Cholesky.
+    """
+    racines = np.sqrt(np.asarray(poids, dtype=float))
+    A_pondere = (diags(racines) @ csr_matrix(A)).tocsr()
+    diagonale = np.asarray(A_pondere.multiply(A_pondere).sum(axis=0)).ravel()
+    penalites = analyse.penalites_ancrage(diagonale)
+    ancres = np.flatnonzero(penalites)
+    lignes_ancrage = csr_matrix((np.sqrt(penalites[ancres]), (np.arange(ancres.shape[0]), ancres)),
+                                shape=(ancres.shape[0], A_pondere.shape[1]))
+    return (vstack((A_pondere, lignes_ancrage)).tocsr(),
+            np.concatenate((racines * np.asarray(b, dtype=float), np.zeros(ancres.shape[0]))))
+
+
+class FacteurR:
+    """Facteur triangulaire supérieur creux R d'une QR à permutation de colonnes : (Ã E)ᵀ (Ã E) = Rᵀ R.
+
+    q est le vecteur de la permutation E. Offre la même interface que
+    FactorisationCholesky (resoudre, facteur_LD), avec L = Rᵀ diag(1/r) et
+    d = r², r étant la diagonale de R.
+    """
+
+    def __init__(self, R, q):
+        self.R = csr_matrix(R)
+        self.Rt = self.R.T.tocsr()
+        self.q = np.asarray(q, dtype=np.int64)
+        self.n = self.R.shape[0]
+
+    def resoudre(self, y):
+        """Résout Rᵀ R x = y (dans l'ordre des colonnes de Ã)."""
+        z = spsolve_triangular(self.Rt, np.asarray(y, dtype=float)[self.q], lower=True)
+        x = np.empty(self.n)
+        x[self.q] = spsolve_triangular(self.R, z, lower=False)
+        return x
+
+    def facteur_LD(self):
+        r = self.R.diagonal()
+        return (diags(1 / r) @ self.R).T.tocsc(), r ** 2, self.q
+
+    @property
+    def nnz(self):
+        return self.R.nnz
+
+
+class FactorisationQR:
+    """Moindres carrés pondérés par factorisation QR de √W A, sans former M = Aᵀ W A.
+
+    Former M élève au carré le conditionnement du problème : avec des
+    incertitudes qui s'étalent sur plusieurs ordres de grandeur, les énergies
+    des niveaux mesurés le plus précisément perdent des chiffres. La QR
+    travaille directement sur Ã = √W A (lignes d'ancrage comprises, voir
+    systeme_pondere) et résout R x = Qᵀ b̃ :
+    - avec SuiteSparseQR (paquet sparseqr), en une seule factorisation creuse,
+      colonnes ordonnancées par COLAMD ;
+    - sinon composante par composante (Ã est bloc-diagonale) : QR dense de
+      Householder de [Ã_c | b̃_c] quand ce tableau tient dans memoire_max,
+      Q n'étant jamais formée. Les composantes plus grandes sont regroupées et
+      factorisées par un Cholesky creux (ordonnancement réducteur de
+      remplissage), dont le facteur R = D^½ Lᵀ préconditionne ensuite LSMR sur
+      Ã : le raffinement travaille sur Ã et non sur M.
+
+    resoudre(y) résout ÃᵀÃ x = y (raffinement, covariances hors motif) et
+    inverser() donne les variances et covariances des énergies, à corriger par
+    analyse.corriger_variances comme pour la résolution de Cholesky.
+    """
+
+    def __init__(self, A, poids, b, analyse, memoire_max=MEMOIRE_MAX_QR, ordonnancement='MMD_AT_PLUS_A'):
+        self.n = A.shape[1]
+        self.memoire_max = memoire_max
+        with etape('ancrage_composantes', lignes=A.shape[0]):
+            A_tilde, b_tilde = systeme_pondere(A, poids, b, analyse)
+        self.x = np.zeros(self.n)
+        # Blocs denses (colonnes, R) et groupe creux (colonnes, facteur) ; le groupe creux couvre tout avec sparseqr
+        self.blocs_denses = []
+        self.groupe_creux = None
+
+        with etape('factorisation_qr', lignes=A_tilde.shape[0]) as mesure:
+            if sparseqr is not None:
+                self._factoriser_spqr(A_tilde, b_tilde)
+            else:
+                self._factoriser_par_composantes(A_tilde, b_tilde, analyse, ordonnancement)
+            mesure['nnz'] = self.nnz
+        print(f"Factorisation QR : n = {self.n}, lignes de √W A = {A_tilde.shape[0]}, "
+              f"{len(self.blocs_denses)} composante(s) en QR dense, nnz(R) = {self.nnz}")
+
+    def _factoriser_spqr(self, A_tilde, b_tilde):
+        Z, R, E, rang = sparseqr.rz(A_tilde.tocsc(), b_tilde.reshape(-1, 1))
+        if rang < self.n:
+            raise np.linalg.LinAlgError(f"√W A est de rang {rang} < {self.n} : composante non ancrée ?")
+        facteur = FacteurR(csr_matrix(R)[:self.n], E)
+        self.x[facteur.q] = spsolve_triangular(facteur.R, np.asarray(Z).ravel()[:self.n], lower=False)
+        self.groupe_creux = (np.arange(self.n), facteur)
+
+    def _factoriser_par_composantes(self, A_tilde, b_tilde, analyse, ordonnancement):
+        # Lignes rangées par composante (celle de leur premier niveau), colonnes dans l'ordre bloc-diagonal
+        non_vides = np.diff(A_tilde.indptr) > 0
+        etiquettes_lignes = np.full(A_tilde.shape[0], -1, dtype=np.int64)
+        etiquettes_lignes[non_vides] = analyse.etiquettes[A_tilde.indices[A_tilde.indptr[:-1][non_vides]]]
+        ordre_lignes = np.argsort(etiquettes_lignes, kind='stable')
+        bornes_lignes = np.searchsorted(etiquettes_lignes[ordre_lignes], np.arange(analyse.nombre + 1))
+        A_rangee = A_tilde[ordre_lignes][:, analyse.ordre].tocsr()
+        b_rangee = b_tilde[ordre_lignes]
+
+        grandes = []
+        for c in range(analyse.nombre):
+            l0, l1 = bornes_lignes[c], bornes_lignes[c + 1]
+            c0, c1 = analyse.bornes[c], analyse.bornes[c + 1]
+            if 8 * (l1 - l0) * (c1 - c0 + 1) > self.memoire_max:
+                grandes.append(c)
+                continue
+            colonnes = analyse.ordre[c0:c1]
+            augmentee = np.column_stack((A_rangee[l0:l1, c0:c1].toarray(), b_rangee[l0:l1]))
+            R = np.linalg.qr(augmentee, mode='r')
+            if R.shape[0] < c1 - c0 or np.any(np.abs(np.diag(R)[:c1 - c0]) <= 1e-14 * np.abs(R).max()):
+                raise np.linalg.LinAlgError(f"√W A est de rang déficient sur la composante {c} : composante non ancrée ?")
+            R_c = np.triu(R[:c1 - c0, :c1 - c0])
+            self.x[colonnes] = solve_triangular(R_c, R[:c1 - c0, c1 - c0])
+            self.blocs_denses.append((colonnes, R_c))
+
+        if grandes:
+            lignes = np.concatenate([ordre_lignes[bornes_lignes[c]:bornes_lignes[c + 1]] for c in grandes])
+            colonnes = np.concatenate([analyse.ordre[analyse.bornes[c]:analyse.bornes[c + 1]] for c in grandes])
+            A_groupe = A_tilde[lignes][:, colonnes].tocsc()
+            facteur = FactorisationCholesky((A_groupe.T @ A_groupe).tocsc(), ordonnancement=ordonnancement)
+            x = facteur.resoudre(A_groupe.T @ b_tilde[lignes])
+            self.x[colonnes] = self._raffiner_lsmr(A_groupe, b_tilde[lignes], x, facteur)
+            self.groupe_creux = (colonnes, facteur)
+
+    @staticmethod
+    def _raffiner_lsmr(A_groupe, b_groupe, x, facteur):
+        """Corrige x par LSMR sur min ‖Ã R⁻¹ u - (b̃ - Ã x)‖, préconditionné à droite par R = D^½ Lᵀ."""
+        L, d, q = facteur.facteur_LD()
+        L = L.tocsr()
+        Lt = L.T.tocsr()
+        racines_d = np.sqrt(d)
+
+        def r_inverse(u):
+            v = np.empty_like(u)
+            v[q] = spsolve_triangular(Lt, u / racines_d, lower=False)
+            return v
+
+        def r_inverse_transposee(v):
+            return spsolve_triangular(L, v[q], lower=True) / racines_d
+
+        operateur = LinearOperator(A_groupe.shape, dtype=float,
+                                   matvec=lambda u: A_groupe @ r_inverse(np.ravel(u)),
+                                   rmatvec=lambda v: r_inverse_transposee(A_groupe.T @ np.ravel(v)))
+        resultat = lsmr(operateur, b_groupe - A_groupe @ x, atol=TOLERANCE_LSMR, btol=TOLERANCE_LSMR,
+                        maxiter=ITERATIONS_LSMR)
+        print(f"Raffinement LSMR : arrêt {resultat[1]} après {resultat[2]} itérations.")
+        return x + r_inverse(resultat[0])
+
+    @property
+    def nnz(self):
+        """Éléments non nuls des facteurs R (blocs denses triangulaires et facteur creux)."""
+        total = sum(R.shape[0] * (R.shape[0] + 1) // 2 for _, R in self.blocs_denses)
+        if self.groupe_creux is not None:
+            total += self.groupe_creux[1].nnz
+        return total
+
+    def resoudre(self, y):
+        """Résout ÃᵀÃ x = y, bloc par bloc."""
+        y = np.asarray(y, dtype=float)
+        x = np.zeros(self.n)
+        for colonnes, R in self.blocs_denses:
+            x[colonnes] = solve_triangular(R, solve_triangular(R, y[colonnes], trans='T'))
+        if self.groupe_creux is not None:
+            colonnes, facteur = self.groupe_creux
+            x[colonnes] = facteur.resoudre(y[colonnes])
+        return x
+
+    def inverser(self):
+        return InversionQR(self)
+
+
+class InversionQR:
+    """Variances et covariances (ÃᵀÃ)⁻¹ d'une FactorisationQR, même interface que InversionSelective.
+
+    Pour un bloc dense, (RᵀR)⁻¹ = R⁻¹ R⁻ᵀ : la variance d'un niveau est le
+    carré de la norme de sa ligne de R⁻¹. Le groupe creux passe par
+    l'inversion sélective de son facteur. Deux niveaux de composantes
+    différentes ont une covariance nulle.
+    """
+
+    def __init__(self, factorisation):
+        n = factorisation.n
+        self._variances = np.zeros(n)
+        # Bloc (indice dans blocs_denses, -1 pour le groupe creux) et position locale de chaque niveau
+        self._bloc = np.full(n, -1, dtype=np.int64)
+        self._position = np.zeros(n, dtype=np.int64)
+        self._inverses = []
+        with etape('inversion_qr', lignes=n):
+            for k, (colonnes, R) in enumerate(factorisation.blocs_denses):
+                R_inverse = solve_triangular(R, np.eye(R.shape[0]))
+                self._inverses.append(R_inverse)
+                self._variances[colonnes] = np.einsum('ij,ij->i', R_inverse, R_inverse)
+                self._bloc[colonnes] = k
+                self._position[colonnes] = np.arange(colonnes.shape[0])
+            self._selective = None
+            if factorisation.groupe_creux is not None:
+                colonnes, facteur = factorisation.groupe_creux
+                self._selective = InversionSelective(facteur)
+                self._variances[colonnes] = self._selective.variances()
+                self._position[colonnes] = np.arange(colonnes.shape[0])
+
+    def variances(self):
+        return self._variances.copy()
+
+    def covariances(self, paires):
+        paires = np.asarray(paires, dtype=np.int64).reshape(-1, 2)
+        i, j = paires[:, 0], paires[:, 1]
+        resultat = np.zeros(paires.shape[0])
+        meme_bloc = self._bloc[i] == self._bloc[j]
+        creux = np.flatnonzero(meme_bloc & (self._bloc[i] < 0))
+        if creux.size:
+            locales = np.column_stack((self._position[i[creux]], self._position[j[creux]]))
+            resultat[creux] = self._selective.covariances(locales)
+        for k in np.flatnonzero(meme_bloc & (self._bloc[i] >= 0)):
+            R_inverse = self._inverses[self._bloc[i[k]]]
+            resultat[k] = R_inverse[self._position[i[k]]] @ R_inverse[self._position[j[k]]]
+        return resultat
+
+
+def resoudre_par_qr(A, poids, b, analyse, memoire_max=MEMOIRE_MAX_QR, ordonnancement='MMD_AT_PLUS_A',
+                    retourner_factorisation=False):
+    """Résout les moindres carrés pondérés min ‖√W (A x - b)‖ par QR, composantes flottantes ancrées.
+
+    Pendant de ancrage.resoudre_par_composantes : même ancrage, même
+    correction des variances, mais sans former M.
+    """
+    factorisation = FactorisationQR(A, poids, b, analyse, memoire_max=memoire_max, ordonnancement=ordonnancement)
+    x = factorisation.x
+    if analyse.ancrage == 'regularisation' and analyse.nombre_flottantes:
+        # Tikhonov itéré avec M appliquée sous forme d'opérateur (√W A)ᵀ (√W A)
+        A = csr_matrix(A)
+        poids = np.asarray(poids, dtype=float)
+        M = LinearOperator((A.shape[1], A.shape[1]), dtype=float, matvec=lambda v: A.T @ (poids * (A @ np.ravel(v))))
+        x = raffiner(M, A.T @ (poids * np.asarray(b, dtype=float)), x, factorisation, analyse)
+        analyse.preparer_covariances((A.T @ diags(poids) @ A).tocsr())
+    return (x, factorisation) if retourner_factorisation else x
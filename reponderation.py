@@ -0,0 +1,80 @@
+import time
+import numpy as np
+
+from ancrage import raffiner
+from cholesky_creux import FactorisationCholesky
+
+# Résidu normalisé |b - A x| / σ au-delà duquel une transition est jugée incohérente
+SEUIL_RESIDU = 3.0
+
+# Facteur appliqué à l'incertitude d'une transition incohérente à chaque itération
+FACTEUR_INFLATION = 1.5
+
+# Nombre maximal d'itérations de repondération
+ITERATIONS_MAX = 20
+
+
+def reponderation_robuste(motif, b, incertitudes, seuil=SEUIL_RESIDU, facteur=FACTEUR_INFLATION,
+                          iterations_max=ITERATIONS_MAX, analyse=None):
+    """Résolutions successives avec gonflement des incertitudes des transitions incohérentes.
+
+    À chaque itération, les transitions dont le résidu normalisé (b - A x) / σ
+    dépasse seuil voient leur incertitude multipliée par facteur, puis le
+    système est résolu à nouveau. Le motif de M (MotifNormal) et
+    l'ordonnancement de la factorisation sont calculés une seule fois : chaque
+    itération se réduit à un réassemblage par bincount et à une refactorisation
+    numérique. La boucle s'arrête quand plus aucune transition ne dépasse le
+    seuil.
+
+    Retourne (x, incertitudes, historique, factorisation) : les énergies, les
+    incertitudes repondérées des transitions, une liste de statistiques par
+    itération et la dernière factorisation (pour les incertitudes des niveaux).
+    Avec une AnalyseComposantes, les composantes flottantes sont ancrées à
+    chaque itération (voir ancrage.py) ; ses variances doivent alors passer
+    par analyse.corriger_variances.
+    """
+    b = np.asarray(b, dtype=float)
+    sigma = np.array(incertitudes, dtype=float)
+    nombre_transitions, nombre_niveaux = b.shape[0], motif.nombre_niveaux
+    factorisation = None
+    historique = []
+
+    for iteration in range(1, iterations_max + 1):
+        debut = time.perf_counter()
+        poids = 1 / sigma ** 2
+        M = motif.assembler(poids)
+        M_ancree = (analyse.ancrer(M) if analyse is not None else M).tocsc()
+        if factorisation is None:
+            factorisation = FactorisationCholesky(M_ancree)
+        else:
+            factorisation.refactoriser(M_ancree)
+        y = motif.second_membre(poids, b)
+        x = factorisation.resoudre(y)
+        if analyse is not None and analyse.ancrage == 'regularisation' and analyse.nombre_flottantes:
+            x = raffiner(M, y, x, factorisation, analyse)
+
+        residus = (b - motif.appliquer_A(x)) / sigma
+        incoherentes = np.abs(residus) > seuil
+        statistiques = {
+            'iteration': iteration,
+            'incoherentes': int(np.count_nonzero(incoherentes)),
+            'residu_max': float(np.abs(residus).max()) if nombre_transitions else 0.0,
+            'residu_rms': float(np.sqrt(np.mean(residus ** 2))) if nombre_transitions else 0.0,
+            'chi2_reduit': float(np.sum(residus ** 2) / max(nombre_transitions - nombre_niveaux, 1)),
+            'duree': time.perf_counter() - debut,
+        }
+        historique.append(statistiques)
+        print(f"Itération {iteration} : {statistiques['incoherentes']} transitions au-delà de {seuil} σ, "
+              f"résidu max {statistiques['residu_max']:.3f}, rms {statistiques['residu_rms']:.3f}, "
+              f"χ² réduit {statistiques['chi2_reduit']:.3f} ({statistiques['duree']:.3f} s)")
+
+        if not np.any(incoherentes):
+            break
+        if iteration == iterations_max:
+            print(f"Repondération arrêtée après {iterations_max} itérations sans convergence.")
+            break
+        sigma[incoherentes] *= facteur
+
+    if analyse is not None:
+        analyse.preparer_covariances(M)
+    return x, sigma, historique, factorisation
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+
+from assemblage import numeroter_niveaux, assembler_equations_normales
+from codec_niveaux import CodecNiveaux
+from cholesky_creux import resoudre_equations_normales
+from instrumentation import etape
+from inversion_selective import incertitudes_niveaux
+
+# threadpoolctl (optionnel) limite les threads BLAS déjà chargés dans un processus
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Variables d'environnement lues par les bibliothèques BLAS/OpenMP
+VARIABLES_THREADS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                     'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Nombre de transitions visé par lot : les petites composantes sont regroupées
+# jusqu'à cette taille, les composantes plus grandes forment un lot à elles seules
+TAILLE_LOT = 20000
+
+
+def limiter_threads_blas(nombre_threads=1):
+    """Limite le nombre de threads BLAS/OpenMP du processus courant.
+
+    Les variables d'environnement valent pour les bibliothèques chargées par
+    la suite ; threadpoolctl, s'il est installé, agit aussi sur celles qui le
+    sont déjà (cas d'un processus créé par fork).
+    """
+    for variable in VARIABLES_THREADS:
+        os.environ[variable] = str(nombre_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=nombre_threads)
+
+
+def separer_composantes(transitions, composantes):
+    """Découpe les tableaux de lire_transitions en un dictionnaire {composante: transitions}."""
+    composantes = np.asarray(composantes)
+    ordre = np.argsort(composantes, kind='stable')
+    identifiants, debuts = np.unique(composantes[ordre], return_index=True)
+    fins = np.append(debuts[1:], ordre.shape[0])
+    return {
+        int(identifiant): {cle: valeurs[ordre[debut:fin]] for cle, valeurs in transitions.items()}
+        for identifiant, debut, fin in zip(identifiants, debuts, fins)
+    }
+
+
+def planifier_lots(tailles, taille_lot=TAILLE_LOT):
+    """Ordonne les composantes en lots, les plus grandes en premier.
+
+    tailles est un dictionnaire {composante: nombre de transitions}. Une
+    composante d'au moins taille_lot transitions forme un lot à elle seule ;
+    les autres sont regroupées, par taille décroissante, en lots d'environ
+    taille_lot transitions pour amortir le coût d'envoi aux processus.
+    """
+    lots = []
+    lot, taille = [], 0
+    for composante in sorted(tailles, key=lambda c: tailles[c], reverse=True):
+        if tailles[composante] >= taille_lot:
+            lots.append([composante])
+            continue
+        lot.append(composante)
+        taille += tailles[composante]
+        if taille >= taille_lot:
+            lots.append(lot)
+            lot, taille = [], 0
+    if lot:
+        lots.append(lot)
+    return lots
+
+
+def resoudre_composante(transitions, fondamental, exclure_fondamental, methode='creuse', codec=None):
+    """Construit et résout le système M x = y d'une seule composante connexe.
+
+    codec (CodecNiveaux commun à toutes les composantes) évite de relire
+    Qnames.json pour chaque composante. Retourne (x, incertitudes), les
+    incertitudes étant obtenues par inversion sélective à partir du facteur
+    de Cholesky.
+    """
+    codec, cles_niveaux, idx_up, idx_low = numeroter_niveaux(transitions, fondamental=fondamental,
+                                                             exclure_fondamental=exclure_fondamental, codec=codec)
+    poids = 1 / (transitions['uncertainty'] ** 2)
+    M, y, _ = assembler_equations_normales(idx_up, idx_low, poids, transitions['wavenumber'],
+                                           cles_niveaux.shape[0])
+    x, factorisation = resoudre_equations_normales(M.tocsc(), y, methode=methode, retourner_factorisation=True)
+    return x, incertitudes_niveaux(factorisation)
+
+
+def _initialiser_processus(nombre_threads):
+    limiter_threads_blas(nombre_threads)
+
+
+def _resoudre_lot(arguments):
+    """Résout toutes les composantes d'un lot ; retourne une liste (composante, resultat, erreur)."""
+    lot, fondamental, exclure_fondamental, methode, codec = arguments
+    resultats = []
+    for composante, transitions in lot:
+        try:
+            resultats.append((composante, resoudre_composante(transitions, fondamental,
+                                                              exclure_fondamental, methode, codec), None))
+        except Exception as e:
+            resultats.append((composante, None, str(e)))
+    return resultats
+
+
+def resoudre_composantes_parallele(par_composante, fondamental, exclure_fondamental, methode='creuse',
+                                   nombre_processus=None, taille_lot=TAILLE_LOT, threads_par_processus=1, codec=None):
+    """Résout les composantes connexes dans un pool de processus.
+
+    par_composante est le dictionnaire retourné par separer_composantes. Sans
+    codec, un codec commun est construit ici, une seule fois, à partir de
+    Qnames.json et des nombres quantiques de toutes les composantes. Les
+    lots sont envoyés des plus grands aux plus petits ; chaque processus est
+    limité à threads_par_processus threads BLAS pour ne pas surcharger les
+    cœurs. Retourne (energies, incertitudes, erreurs) : trois dictionnaires
+    indexés par composante, des solutions, de leurs incertitudes et des
+    messages d'erreur.
+    """
+    nombre_processus = nombre_processus or os.cpu_count() or 1
+    tailles = {composante: t['wavenumber'].shape[0] for composante, t in par_composante.items()}
+    lots = planifier_lots(tailles, taille_lot)
+    if codec is None and par_composante:
+        codec = CodecNiveaux.depuis_qnames(*[t[cle][t['valide']] for t in par_composante.values()
+                                             for cle in ('qn_up', 'qn_low')])
+    taches = [([(composante, par_composante[composante]) for composante in lot],
+               fondamental, exclure_fondamental, methode, codec) for lot in lots]
+    print(f"{len(par_composante)} composantes réparties en {len(lots)} lots sur {nombre_processus} processus.")
+
+    energies, incertitudes, erreurs = {}, {}, {}
+    # Avec plusieurs processus, les étapes internes (assemblage, factorisation) sont mesurées dans les
+    # processus fils et n'apparaissent pas ici : seule la durée totale de la résolution est enregistrée
+    with etape('resolution_composantes', lignes=sum(tailles.values())):
+        if nombre_processus == 1:
+            for resultats in map(_resoudre_lot, taches):
+                _ranger(resultats, energies, incertitudes, erreurs)
+        else:
+            with Pool(nombre_processus, initializer=_initialiser_processus, initargs=(threads_par_processus,)) as pool:
+                # chunksize=1 : les lots partent dans l'ordre, les plus grands d'abord
+                for resultats in pool.imap_unordered(_resoudre_lot, taches, chunksize=1):
+                    _ranger(resultats, energies, incertitudes, erreurs)
+    return energies, incertitudes, erreurs
+
+
+def _ranger(resultats, energies, incertitudes, erreurs):
+    for composante, resultat, erreur in resultats:
+        if erreur is None:
+            energies[composante], incertitudes[composante] = resultat
+        else:
+            erreurs[composante] = erreur
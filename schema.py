@@ -0,0 +1,192 @@
+import re
+import json
+import uuid
+
+from acces_donnees import connecter
+
+# Nom du fichier JSON contenant les noms des nombres quantiques
+QNAMES_FILE = 'Qnames.json'
+
+# Version 1 : nombres quantiques en TEXT JSON uniquement
+# Version 2 : une colonne INTEGER par nombre quantique (up_<nom>, low_<nom>) et index
+# Version 3 : table revision_transitions, incrémentée à chaque modification ou suppression
+SCHEMA_VERSION = 3
+
+
+def noms_colonnes_quantiques(quantum_names):
+    """Retourne (colonnes_up, colonnes_low) pour les noms de Qnames.json.
+
+    Un nom qui n'est pas un identifiant SQL valide est remplacé par q<position>.
+    """
+    noms = [nom if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', nom) else f'q{i + 1}'
+            for i, nom in enumerate(quantum_names)]
+    return [f'up_{nom}' for nom in noms], [f'low_{nom}' for nom in noms]
+
+
+def charger_noms_quantiques(fichier=QNAMES_FILE):
+    """Charge les noms des nombres quantiques depuis Qnames.json."""
+    with open(fichier, 'r') as f:
+        return json.load(f)['quantum_names']
+
+
+def version_schema(conn):
+    """Version du schéma de la base (PRAGMA user_version, 1 pour une base existante non migrée)."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0 and conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transitions'").fetchone():
+        return 1
+    return version
+
+
+def colonnes_transitions(conn):
+    """Liste des colonnes de la table transitions."""
+    return [ligne[1] for ligne in conn.execute('PRAGMA table_info(transitions)')]
+
+
+# Index de la table transitions (schéma version 2)
+INDEX_TRANSITIONS = ('idx_transitions_up', 'idx_transitions_low', 'idx_transitions_wavenumber')
+
+
+def creer_index(conn, colonnes_up, colonnes_low):
+    """Crée les index sur les niveaux supérieur/inférieur et sur wavenumber."""
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_transitions_up ON transitions ({", ".join(colonnes_up)})')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_transitions_low ON transitions ({", ".join(colonnes_low)})')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transitions_wavenumber ON transitions (wavenumber)')
+
+
+def supprimer_index(conn):
+    """Supprime les index de la table transitions (avant une ingestion massive)."""
+    for nom in INDEX_TRANSITIONS:
+        conn.execute(f'DROP INDEX IF EXISTS {nom}')
+
+
+def _creer_index_et_declencheurs(conn, colonnes_up, colonnes_low):
+    creer_index(conn, colonnes_up, colonnes_low)
+
+    # Les écrivains qui ne renseignent que le JSON gardent les colonnes entières à jour
+    affectations = ', '.join(
+        [f"{colonne} = json_extract(NEW.quantum_numbers_up, '$[{i}]')" for i, colonne in enumerate(colonnes_up)]
+        + [f"{colonne} = json_extract(NEW.quantum_numbers_low, '$[{i}]')" for i, colonne in enumerate(colonnes_low)]
+    )
+    conn.execute('DROP TRIGGER IF EXISTS transitions_colonnes_insert')
+    conn.execute('DROP TRIGGER IF EXISTS transitions_colonnes_update')
+    conn.execute(f'''
+        CREATE TRIGGER transitions_colonnes_insert AFTER INSERT ON transitions
+        WHEN NEW.{colonnes_up[0]} IS NULL
+        BEGIN
+            UPDATE transitions SET {affectations} WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER transitions_colonnes_update AFTER UPDATE OF quantum_numbers_up, quantum_numbers_low ON transitions
+        BEGIN
+            UPDATE transitions SET {affectations} WHERE id = NEW.id;
+        END
+    ''')
+
+
+def creer_revision(conn):
+    """Crée la table revision_transitions (un jeton par base et un compteur) et ses déclencheurs.
+
+    Seules les modifications et suppressions incrémentent le compteur : une
+    insertion change toujours COUNT(*), ce qui évite un déclencheur par ligne
+    pendant les ingestions massives. Le triplet (jeton, revision, COUNT(*))
+    identifie donc le contenu de la table transitions.
+
+    Les colonnes entières ne sont pas surveillées : elles sont dérivées des
+    colonnes JSON, et le déclencheur transitions_colonnes_insert les remplit
+    par un UPDATE après chaque insertion qui ne renseigne que le JSON. Les
+    surveiller ferait compter ces insertions comme des modifications.
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS revision_transitions (jeton TEXT, revision INTEGER)')
+    if conn.execute('SELECT COUNT(*) FROM revision_transitions').fetchone()[0] == 0:
+        conn.execute('INSERT INTO revision_transitions VALUES (?, 0)', (uuid.uuid4().hex,))
+    colonnes = ', '.join(['id', 'wavenumber', 'uncertainty', 'quantum_numbers_up', 'quantum_numbers_low'])
+    conn.execute('DROP TRIGGER IF EXISTS transitions_revision_update')
+    conn.execute('DROP TRIGGER IF EXISTS transitions_revision_delete')
+    conn.execute(f'''
+        CREATE TRIGGER transitions_revision_update AFTER UPDATE OF {colonnes} ON transitions
+        BEGIN
+            UPDATE revision_transitions SET revision = revision + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER transitions_revision_delete AFTER DELETE ON transitions
+        BEGIN
+            UPDATE revision_transitions SET revision = revision + 1;
+        END
+    ''')
+
+
+def revision_transitions(conn):
+    """Retourne (jeton, revision, nombre de transitions), ou None pour une base sans table revision_transitions."""
+    if version_schema(conn) < 3:
+        return None
+    jeton, revision = conn.execute('SELECT jeton, revision FROM revision_transitions').fetchone()
+    return jeton, revision, conn.execute('SELECT COUNT(*) FROM transitions').fetchone()[0]
+
+
+def create_transitions_table(conn, quantum_names):
+    """Crée la table transitions (schéma version 2) si elle n'existe pas, sinon la migre."""
+    if 0 < version_schema(conn) < SCHEMA_VERSION:
+        migrer_base(conn, quantum_names)
+        return
+
+    colonnes_up, colonnes_low = noms_colonnes_quantiques(quantum_names)
+    colonnes_entieres = ''.join(f',\n            {colonne} INTEGER' for colonne in colonnes_up + colonnes_low)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS transitions (
+            id INTEGER PRIMARY KEY,
+            wavenumber REAL,
+            uncertainty REAL,
+            quantum_numbers_up TEXT,
+            quantum_numbers_low TEXT,
+            line_status INTEGER,
+            src_status INTEGER,
+            src TEXT{colonnes_entieres}
+        )
+    ''')
+    _creer_index_et_declencheurs(conn, colonnes_up, colonnes_low)
+    creer_revision(conn)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+
+
+def migrer_base(conn, quantum_names):
+    """Migre une base existante vers le schéma version 3, en SQL pur et en une transaction.
+
+    Pour une base version 1, les colonnes entières sont ajoutées puis remplies
+    depuis les colonnes JSON avec json_extract ; les colonnes JSON sont
+    conservées pour les scripts qui les lisent encore. La table
+    revision_transitions est créée en dernier.
+    """
+    version = version_schema(conn)
+    if version >= SCHEMA_VERSION:
+        return False
+
+    colonnes_up, colonnes_low = noms_colonnes_quantiques(quantum_names)
+    existantes = set(colonnes_transitions(conn))
+    if not conn.in_transaction:
+        conn.execute('BEGIN')  # ALTER TABLE et UPDATE dans la même transaction
+    with conn:
+        if version < 2:
+            for colonne in colonnes_up + colonnes_low:
+                if colonne not in existantes:
+                    conn.execute(f'ALTER TABLE transitions ADD COLUMN {colonne} INTEGER')
+            affectations = ', '.join(
+                [f"{colonne} = json_extract(quantum_numbers_up, '$[{i}]')" for i, colonne in enumerate(colonnes_up)]
+                + [f"{colonne} = json_extract(quantum_numbers_low, '$[{i}]')" for i, colonne in enumerate(colonnes_low)]
+            )
+            conn.execute(f'UPDATE transitions SET {affectations} WHERE json_valid(quantum_numbers_up) AND json_valid(quantum_numbers_low)')
+            _creer_index_et_declencheurs(conn, colonnes_up, colonnes_low)
+        creer_revision(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    print(f"Base migrée vers le schéma version {SCHEMA_VERSION} (colonnes entières, index et révision).")
+    return True
+
+if __name__ == '__main__':
+    # Migration explicite de marvel.db
+    connexion = connecter('marvel.db')
+    if not migrer_base(connexion, charger_noms_quantiques()):
+        print(f"La base est déjà au schéma version {version_schema(connexion)}.")
+    connexion.close()
@@ -0,0 +1,188 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.sparse.linalg import LinearOperator, lsqr
+
+from cholesky_creux import FactorisationCholesky
+
+# Préconditionneurs disponibles pour le gradient conjugué
+PRECONDITIONNEURS = ('jacobi', 'arbre', 'aucun')
+
+# Algorithmes itératifs disponibles
+ALGORITHMES = ('cg', 'lsqr')
+
+
+class OperateurNormal:
+    """Applique A, Aᵀ W et M = Aᵀ W A sans jamais former ces matrices.
+
+    Chaque transition i relie le niveau idx_up[i] (coefficient +1) au niveau
+    idx_low[i] (coefficient -1) ; un indice -1 désigne un niveau exclu.
+    """
+
+    def __init__(self, idx_up, idx_low, poids, nombre_niveaux):
+        self.idx_up = np.asarray(idx_up, dtype=np.int64)
+        self.idx_low = np.asarray(idx_low, dtype=np.int64)
+        self.poids = np.asarray(poids, dtype=float)
+        self.n = int(nombre_niveaux)
+        self._up = self.idx_up >= 0
+        self._low = self.idx_low >= 0
+
+    def appliquer_A(self, x):
+        """Retourne A x (différences d'énergie prédites pour chaque transition)."""
+        resultat = np.zeros(self.idx_up.shape[0])
+        resultat[self._up] += x[self.idx_up[self._up]]
+        resultat[self._low] -= x[self.idx_low[self._low]]
+        return resultat
+
+    def appliquer_AtW(self, r):
+        """Retourne Aᵀ W r."""
+        wr = self.poids * r
+        return (np.bincount(self.idx_up[self._up], weights=wr[self._up], minlength=self.n)
+                - np.bincount(self.idx_low[self._low], weights=wr[self._low], minlength=self.n))
+
+    def appliquer_M(self, x):
+        """Retourne M x = Aᵀ W A x."""
+        return self.appliquer_AtW(self.appliquer_A(x))
+
+    def diagonale(self):
+        """Diagonale de M : somme des poids des transitions touchant chaque niveau."""
+        return (np.bincount(self.idx_up[self._up], weights=self.poids[self._up], minlength=self.n)
+                + np.bincount(self.idx_low[self._low], weights=self.poids[self._low], minlength=self.n))
+
+
+def preconditionneur_jacobi(operateur):
+    """Préconditionneur diagonal : x -> x / diag(M)."""
+    diagonale = operateur.diagonale()
+    if np.any(diagonale <= 0):
+        raise ValueError("Certains niveaux ne sont reliés à aucune transition pondérée.")
+    inverse = 1.0 / diagonale
+    return lambda r: inverse * r
+
+
+def preconditionneur_arbre(operateur):
+    """Préconditionneur par arbre couvrant de poids maximal.
+
+    On conserve les transitions de plus fort poids formant un arbre couvrant du
+    réseau ; le Laplacien pondéré de cet arbre se factorise sans remplissage et
+    approche M pour les graphes de type Laplacien. Les niveaux reliés seulement
+    à un niveau exclu reçoivent leur terme diagonal pour rester ancrés.
+    """
+    n = operateur.n
+    deux_niveaux = operateur._up & operateur._low
+    up = operateur.idx_up[deux_niveaux]
+    low = operateur.idx_low[deux_niveaux]
+    poids = operateur.poids[deux_niveaux]
+
+    # Arbre couvrant de poids maximal = arbre minimal sur des poids inversés
+    graphe = coo_matrix((poids, (np.minimum(up, low), np.maximum(up, low))), shape=(n, n)).tocsr()
+    graphe.data = 1.0 / graphe.data  # Les transitions multiples sont d'abord cumulées
+    arbre = minimum_spanning_tree(graphe).tocoo()
+    poids_arbre = 1.0 / arbre.data
+
+    # Termes d'ancrage : transitions vers un niveau exclu (fondamental fixé)
+    ancrage = np.zeros(n)
+    seul_up = operateur._up & ~operateur._low
+    seul_low = operateur._low & ~operateur._up
+    np.add.at(ancrage, operateur.idx_up[seul_up], operateur.poids[seul_up])
+    np.add.at(ancrage, operateur.idx_low[seul_low], operateur.poids[seul_low])
+
+    lignes = np.concatenate([arbre.row, arbre.col, arbre.row, arbre.col, np.arange(n)])
+    colonnes = np.concatenate([arbre.col, arbre.row, arbre.row, arbre.col, np.arange(n)])
+    valeurs = np.concatenate([-poids_arbre, -poids_arbre, poids_arbre, poids_arbre, ancrage])
+    laplacien = coo_matrix((valeurs, (lignes, colonnes)), shape=(n, n)).tocsc()
+
+    # Un terme diagonal minimal garantit une factorisation même si l'arbre ne couvre pas tout
+    laplacien = laplacien + coo_matrix((np.full(n, 1e-12 * operateur.diagonale().max()),
+                                        (np.arange(n), np.arange(n))), shape=(n, n)).tocsc()
+    factorisation = FactorisationCholesky(laplacien)
+    return factorisation.resoudre
+
+
+def gradient_conjugue_preconditionne(operateur, y, x0=None, tolerance=1e-10, iterations_max=1000,
+                                     preconditionneur='jacobi'):
+    """Résout M x = y par gradient conjugué préconditionné.
+
+    Retourne (x, historique) où historique contient le résidu relatif
+    ||y - M x|| / ||y|| à chaque itération.
+    """
+    if preconditionneur == 'jacobi':
+        appliquer_P = preconditionneur_jacobi(operateur)
+    elif preconditionneur == 'arbre':
+        appliquer_P = preconditionneur_arbre(operateur)
+    elif preconditionneur == 'aucun':
+        appliquer_P = lambda r: r
+    else:
+        raise ValueError(f"Préconditionneur inconnu : {preconditionneur}. Valeurs possibles : {PRECONDITIONNEURS}")
+
+    x = np.zeros(operateur.n) if x0 is None else np.array(x0, dtype=float)
+    norme_y = np.linalg.norm(y)
+    if norme_y == 0:
+        return np.zeros(operateur.n), [0.0]
+
+    r = y - operateur.appliquer_M(x)
+    z = appliquer_P(r)
+    p = z.copy()
+    rz = r @ z
+    historique = [np.linalg.norm(r) / norme_y]
+
+    for _ in range(iterations_max):
+        if historique[-1] <= tolerance:
+            break
+        Mp = operateur.appliquer_M(p)
+        alpha = rz / (p @ Mp)
+        x += alpha * p
+        r -= alpha * Mp
+        historique.append(np.linalg.norm(r) / norme_y)
+        z = appliquer_P(r)
+        rz_nouveau = r @ z
+        p = z + (rz_nouveau / rz) * p
+        rz = rz_nouveau
+
+    if historique[-1] > tolerance:
+        print(f"Attention : gradient conjugué non convergé après {len(historique) - 1} itérations "
+              f"(résidu relatif {historique[-1]:.3e}).")
+    else:
+        print(f"Gradient conjugué ({preconditionneur}) : convergence en {len(historique) - 1} itérations.")
+    return x, historique
+
+
+def lsqr_pondere(operateur, b, x0=None, tolerance=1e-10, iterations_max=1000):
+    """Résout min ||√W (A x - b)|| par LSQR avec mise à l'échelle des colonnes (Jacobi).
+
+    Retourne (x, historique) ; LSQR ne fournissant pas de rappel par itération,
+    l'historique contient le résidu relatif initial et final des équations normales.
+    """
+    racine_poids = np.sqrt(operateur.poids)
+    echelle = 1.0 / np.sqrt(operateur.diagonale())
+    nombre_transitions = operateur.idx_up.shape[0]
+
+    # Opérateur √W A D^{-1/2} et son adjoint
+    A_pondere = LinearOperator(
+        (nombre_transitions, operateur.n), dtype=float,
+        matvec=lambda z: racine_poids * operateur.appliquer_A(echelle * np.ravel(z)),
+        rmatvec=lambda r: echelle * operateur.appliquer_AtW(np.ravel(r) / racine_poids),
+    )
+    y = operateur.appliquer_AtW(b)
+    norme_y = np.linalg.norm(y)
+    x_initial = np.zeros(operateur.n) if x0 is None else np.asarray(x0, dtype=float)
+    historique = [np.linalg.norm(y - operateur.appliquer_M(x_initial)) / norme_y]
+
+    resultat = lsqr(A_pondere, racine_poids * b, atol=tolerance, btol=tolerance,
+                    iter_lim=iterations_max, x0=x_initial / echelle)
+    x = echelle * resultat[0]
+    historique.append(np.linalg.norm(y - operateur.appliquer_M(x)) / norme_y)
+    print(f"LSQR : arrêt {resultat[1]} après {resultat[2]} itérations.")
+    return x, historique
+
+
+def resoudre_iteratif(operateur, b, algorithme='cg', x0=None, tolerance=1e-10, iterations_max=1000,
+                      preconditionneur='jacobi'):
+    """Résout le problème des moindres carrés pondérés sans former M."""
+    if algorithme == 'cg':
+        y = operateur.appliquer_AtW(b)
+        return gradient_conjugue_preconditionne(operateur, y, x0=x0, tolerance=tolerance,
+                                                iterations_max=iterations_max,
+                                                preconditionneur=preconditionneur)
+    if algorithme == 'lsqr':
+        return lsqr_pondere(operateur, b, x0=x0, tolerance=tolerance, iterations_max=iterations_max)
+    raise ValueError(f"Algorithme itératif inconnu : {algorithme}. Valeurs possibles : {ALGORITHMES}")
@@ -1,10 +1,14 @@
-import sqlite3
+from acces_donnees import connecter
 import networkx as nx
 from pyvis.network import Network
 import ast
+from instrumentation import etape, profil_demande
+
+# Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+profil_demande()
 
 # Connexion à la base de données
-conn = sqlite3.connect("marvel.db")
+conn = connecter('marvel.db')
 cursor = conn.cursor()
 
 # Récupérer les transitions
@@ -108,7 +112,8 @@ net.toggle_physics(True)
 net.show_buttons(filter_=['physics'])
 
 # Génération et affichage
-net.write_html("spectroscopic_network.html")
+with etape('graphe_pyvis', lignes=len(transitions)):
+    net.write_html("spectroscopic_network.html")
 print("\n✅ Graphe généré : ouvrez spectroscopic_network.html dans un navigateur.")
 
 
@@ -1,10 +1,16 @@
-import sqlite3
+from acces_donnees import connecter
 import networkx as nx
 from pyvis.network import Network
-import ast
+import time
+import numpy as np
+from assemblage import lire_transitions, numeroter_niveaux, etiqueter_composantes, enregistrer_composantes
+from instrumentation import etape, profil_demande
+
+# Rapport de durée et de mémoire par étape à la fin de l'exécution (option --profile)
+profil_demande()
 
 # Connexion à la base de données
-conn = sqlite3.connect("marvel.db")
+conn = connecter('marvel.db')
 cursor = conn.cursor()
 
 # Créer la table components si elle n'existe pas
@@ -23,48 +29,34 @@ CREATE TABLE IF NOT EXISTS components (
 """)
 conn.commit()
 
-# Récupérer les transitions
-cursor.execute("SELECT id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src FROM transitions")
-transitions = cursor.fetchall()
+# Récupérer les transitions en une seule lecture, partagée par le graphe, l'étiquetage et la table components
+donnees_transitions = lire_transitions(cursor)
+nombre_transitions = donnees_transitions['id'].shape[0]
 
 # Vérification des données
-if not transitions:
+if not nombre_transitions:
     print("\n❌ Aucune transition trouvée dans la base de données.")
     conn.close()
     exit()
 else:
-    print(f"\n✅ {len(transitions)} transitions récupérées.")
+    print(f"\n✅ {nombre_transitions} transitions récupérées.")
 
 # Créer un graphe orienté
 G = nx.DiGraph()
 
-# Ajouter les transitions au graphe
-for transition in transitions:
-    id_transition, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src = transition
-    
-    # Convertir les nombres quantiques en tuples (si nécessaire)
-    try:
-        quantum_numbers_low = ast.literal_eval(quantum_numbers_low)
-        quantum_numbers_up = ast.literal_eval(quantum_numbers_up)
-        
-        # Convertir les listes en tuples
-        if isinstance(quantum_numbers_low, list):
-            quantum_numbers_low = tuple(quantum_numbers_low)
-        if isinstance(quantum_numbers_up, list):
-            quantum_numbers_up = tuple(quantum_numbers_up)
-    except (ValueError, SyntaxError):
-        pass  # Garder sous forme de chaîne en cas d'échec
-    
-    # Convertir en chaînes pour PyVis
-    quantum_numbers_low_str = str(quantum_numbers_low)
-    quantum_numbers_up_str = str(quantum_numbers_up)
-    
+# Ajouter les transitions au graphe (nœuds nommés par le tuple des nombres quantiques)
+valide = donnees_transitions['valide']
+etiquettes_up = [str(tuple(qn)) for qn in donnees_transitions['qn_up'][valide].tolist()]
+etiquettes_low = [str(tuple(qn)) for qn in donnees_transitions['qn_low'][valide].tolist()]
+for id_transition, wavenumber, quantum_numbers_up_str, quantum_numbers_low_str in zip(
+        donnees_transitions['id'][valide].tolist(), donnees_transitions['wavenumber'][valide].tolist(),
+        etiquettes_up, etiquettes_low):
     # Ajouter les nœuds
     if quantum_numbers_low_str not in G:
         G.add_node(quantum_numbers_low_str, label=quantum_numbers_low_str)
     if quantum_numbers_up_str not in G:
         G.add_node(quantum_numbers_up_str, label=quantum_numbers_up_str)
-    
+
     # Ajouter l'arête avec poids et ID de transition
     G.add_edge(quantum_numbers_low_str, quantum_numbers_up_str, weight=wavenumber, id=id_transition)
 
@@ -82,13 +74,20 @@ if noeuds_isoles:
 else:
     print("\n✅ Aucun nœud isolé détecté.")
 
-# Vérification de la connectivité
-composantes_connexes = list(nx.weakly_connected_components(G))
-print("\nNombre de composantes connexes :", len(composantes_connexes))
-if len(composantes_connexes) > 1:
+# Vérification de la connectivité : étiquetage des composantes avec scipy.sparse.csgraph,
+# sur les numéros entiers des niveaux (clés int64 du codec)
+debut = time.perf_counter()
+codec, cles_niveaux, idx_up, idx_low = numeroter_niveaux(donnees_transitions)
+nombre_composantes, etiquettes_niveaux, etiquettes_transitions = etiqueter_composantes(idx_up, idx_low,
+                                                                                       cles_niveaux.shape[0])
+print(f"\nNombre de composantes connexes : {nombre_composantes} (calculé en {time.perf_counter() - debut:.3f} s)")
+if nombre_composantes > 1:
     print("⚠️ Le réseau n'est pas entièrement connexe.")
 else:
     print("✅ Le réseau est connexe.")
+transitions_ignorees = int(np.count_nonzero(etiquettes_transitions < 0))
+if transitions_ignorees:
+    print(f"⚠️ {transitions_ignorees} transitions aux nombres quantiques illisibles ne sont rattachées à aucune composante.")
 
 # Détection des cycles
 try:
@@ -125,25 +124,13 @@ net.toggle_physics(True)
 net.show_buttons(filter_=['physics'])
 
 # Génération et affichage
-net.write_html("spectroscopic_network.html")
+with etape('graphe_pyvis', lignes=nombre_transitions):
+    net.write_html("spectroscopic_network.html")
 print("\n✅ Graphe généré : ouvrez spectroscopic_network.html dans un navigateur.")
 
-# Peupler la table components avec les composantes connexes
-for component_id, component in enumerate(composantes_connexes, start=1):
-    for node in component:
-        # Récupérer les transitions associées à ce nœud
-        edges = G.edges(node, data=True)
-        for edge in edges:
-            transition_id = edge[2]["id"]
-            # Récupérer les données de la transition
-            cursor.execute("SELECT * FROM transitions WHERE id = ?", (transition_id,))
-            transition_data = cursor.fetchone()
-            # Insérer dans la table components
-            cursor.execute("""
-            INSERT INTO components (id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src, component)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (*transition_data, component_id))
-conn.commit()
+# Peupler la table components avec les composantes connexes (numérotées à partir de 1),
+# en une seule requête ensembliste à partir d'une table temporaire des étiquettes
+enregistrer_composantes(conn, donnees_transitions['id'], etiquettes_transitions)
 print("\n✅ Table components peuplée avec les composantes connexes.")
 
 # Fermer la connexion à la base de données
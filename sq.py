@@ -1,7 +1,8 @@
 import pandas as pd
-import sqlite3
+from acces_donnees import connecter
 import json
 import os
+from ingestion import inserer_transitions_en_masse
 
 # Nom du fichier JSON contenant les noms des nombres quantiques
 QNAMES_FILE = 'Qnames.json'
@@ -30,60 +31,12 @@ if not quantum_numbers_names:
 df = pd.read_excel('transitions.xlsx')
 
 # Créer ou se connecter à la base de données SQLite
-conn = sqlite3.connect('marvel.db')
-cursor = conn.cursor()
+conn = connecter('marvel.db')
 
-# Créer la table dans la base de données SQLite avec la nouvelle structure
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transitions (
-        id INTEGER PRIMARY KEY,
-        wavenumber REAL,
-        uncertainty REAL,
-        quantum_numbers_up TEXT,
-        quantum_numbers_low TEXT,
-        line_status INTEGER,
-        src_status INTEGER,
-        src TEXT
-    )
-''')
-
-# Fonction pour transformer les nombres quantiques en JSON sans associer les noms
-def convert_to_json(quantum_numbers_str):
-    """Convertit une chaîne de nombres quantiques en JSON."""
-    if not quantum_numbers_str or pd.isna(quantum_numbers_str):  # Vérifie si la chaîne est vide ou NaN
-        return json.dumps([])  # Retourne une liste vide sous forme de JSON
-    try:
-        quantum_numbers = list(map(int, quantum_numbers_str.split(' ')))
-        return json.dumps(quantum_numbers)  # Stocker les nombres quantiques sous forme de liste JSON
-    except ValueError:
-        print(f"Erreur : Impossible de convertir '{quantum_numbers_str}' en nombres quantiques.")
-        return json.dumps([])  # Retourne une liste vide en cas d'erreur
-
-# Insertion des données dans la base SQLite
-for index, row in df.iterrows():
-    # Extraire l'ID si la colonne existe, sinon laisser SQLite l'auto-générer
-    id_value = row.get('id')  # Si la colonne 'id' existe dans le fichier Excel
-    wavenumber = row['wavenumber']
-    uncertainty = row.get('uncertainty', 0.0)  # Valeur par défaut si la colonne n'existe pas
-    quantum_numbers_up = convert_to_json(row.get('quantum_numbers_up', ''))  # Gère les valeurs manquantes
-    quantum_numbers_low = convert_to_json(row.get('quantum_numbers_low', ''))  # Gère les valeurs manquantes
-    line_status = row.get('line_status', 0)  # Valeur par défaut si la colonne n'existe pas
-    src_status = row.get('src_status', 0)  # Valeur par défaut si la colonne n'existe pas
-    src = row.get('src', '')  # Valeur par défaut si la colonne n'existe pas
-    
-    if id_value is not None:  # Si l'ID est fourni dans le fichier Excel
-        cursor.execute('''
-            INSERT INTO transitions (id, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (id_value, wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src))
-    else:  # Si l'ID n'est pas fourni, laisser SQLite l'auto-générer
-        cursor.execute('''
-            INSERT INTO transitions (wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (wavenumber, uncertainty, quantum_numbers_up, quantum_numbers_low, line_status, src_status, src))
+# Créer la table si nécessaire puis insérer les données en une seule transaction
+nombre_inseres, lignes_rejetees = inserer_transitions_en_masse(conn, df, quantum_numbers_names)
 
 # Sauvegarder et fermer la connexion
-conn.commit()
 conn.close()
 
-print("Données insérées avec succès !")
+print(f"{nombre_inseres} transitions insérées avec succès ({len(lignes_rejetees)} lignes ignorées) !")
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import etape
+
+# Base SQLite des tâches, séparée de marvel.db : une ingestion qui verrouille
+# marvel.db ne bloque pas le suivi des tâches
+FICHIER_TACHES = 'taches.db'
+
+# Nombre de tâches exécutées en parallèle ; leurs écritures dans marvel.db sont
+# sérialisées par l'écrivain unique d'AccesDonnees
+NOMBRE_TRAVAILLEURS = 2
+
+# Statuts successifs d'une tâche
+STATUTS = ('en_attente', 'en_cours', 'terminee', 'echouee', 'interrompue')
+
+REQUETE_CREATION = '''
+    CREATE TABLE IF NOT EXISTS taches (
+        id INTEGER PRIMARY KEY,
+        type TEXT,
+        statut TEXT,
+        progression REAL,
+        message TEXT,
+        parametres TEXT,
+        resultat TEXT,
+        cree REAL,
+        debut REAL,
+        fin REAL
+    )
+'''
+
+COLONNES = ('id', 'type', 'statut', 'progression', 'message', 'parametres', 'resultat', 'cree', 'debut', 'fin')
+
+
+class FileTaches:
+    """Exécute des tâches en arrière-plan et enregistre leur état dans une table SQLite.
+
+    Chaque type de tâche est une fonction fonction(rapporter, **parametres)
+    qui retourne un résultat sérialisable en JSON ; rapporter(progression,
+    message) publie l'avancement (progression entre 0 et 1). Les tâches
+    restées en cours lors d'un arrêt du serveur sont marquées 'interrompue'
+    au démarrage suivant.
+    """
+
+    def __init__(self, fichier=FICHIER_TACHES, nombre_travailleurs=NOMBRE_TRAVAILLEURS):
+        self.fichier = fichier
+        self._types = {}
+        self._executeur = ThreadPoolExecutor(max_workers=nombre_travailleurs, thread_name_prefix='taches')
+        self._verrou = threading.Lock()
+        self._executer_sql(REQUETE_CREATION)
+        self._executer_sql("UPDATE taches SET statut = 'interrompue', fin = ? WHERE statut IN ('en_attente', 'en_cours')",
+                           (time.time(),))
+
+    def _connexion(self):
+        return sqlite3.connect(self.fichier, timeout=30)
+
+    def _executer_sql(self, requete, parametres=()):
+        conn = self._connexion()
+        try:
+            with conn:
+                curseur = conn.execute(requete, parametres)
+                return curseur.lastrowid, curseur.fetchall()
+        finally:
+            conn.close()
+
+    def enregistrer_type(self, type_tache, fonction):
+        """Associe une fonction à un type de tâche."""
+        self._types[type_tache] = fonction
+
+    def soumettre(self, type_tache, **parametres):
+        """Enregistre une tâche 'en_attente' et la confie aux travailleurs ; retourne son identifiant."""
+        if type_tache not in self._types:
+            raise ValueError(f"Type de tâche inconnu : {type_tache}")
+        fonction = self._types[type_tache]
+        id_tache, _ = self._executer_sql(
+            'INSERT INTO taches (type, statut, progression, message, parametres, cree) VALUES (?, ?, 0, ?, ?, ?)',
+            (type_tache, 'en_attente', 'En attente', json.dumps(parametres), time.time()))
+        self._executeur.submit(self._executer, id_tache, type_tache, fonction, parametres)
+        return id_tache
+
+    def soumettre_unique(self, type_tache, **parametres):
+        """Comme soumettre, mais retourne la tâche de même type et mêmes paramètres encore en attente ou en cours."""
+        with self._verrou:
+            _, lignes = self._executer_sql(
+                "SELECT id FROM taches WHERE type = ? AND parametres = ? AND statut IN ('en_attente', 'en_cours') "
+                "ORDER BY id DESC LIMIT 1", (type_tache, json.dumps(parametres)))
+            if lignes:
+                return lignes[0][0]
+            return self.soumettre(type_tache, **parametres)
+
+    def _mettre_a_jour(self, id_tache, **champs):
+        affectations = ', '.join(f'{colonne} = ?' for colonne in champs)
+        self._executer_sql(f'UPDATE taches SET {affectations} WHERE id = ?', (*champs.values(), id_tache))
+
+    def _executer(self, id_tache, type_tache, fonction, parametres):
+        self._mettre_a_jour(id_tache, statut='en_cours', message='En cours', debut=time.time())
+
+        def rapporter(progression, message=None):
+            champs = {'progression': float(progression)}
+            if message is not None:
+                champs['message'] = message
+            self._mettre_a_jour(id_tache, **champs)
+
+        try:
+            with etape(f'tache:{type_tache}'):
+                resultat = fonction(rapporter, **parametres)
+        except Exception as e:
+            traceback.print_exc()
+            self._mettre_a_jour(id_tache, statut='echouee', message=f"{type(e).__name__} : {e}", fin=time.time())
+            return
+        self._mettre_a_jour(id_tache, statut='terminee', progression=1.0, resultat=json.dumps(resultat),
+                            message='Terminée', fin=time.time())
+
+    @staticmethod
+    def _decoder(ligne):
+        tache = dict(zip(COLONNES, ligne))
+        tache['parametres'] = json.loads(tache['parametres']) if tache['parametres'] else {}
+        tache['resultat'] = json.loads(tache['resultat']) if tache['resultat'] else None
+        return tache
+
+    def tache(self, id_tache):
+        """État d'une tâche (dictionnaire), ou None si elle n'existe pas."""
+        _, lignes = self._executer_sql(f'SELECT {", ".join(COLONNES)} FROM taches WHERE id = ?', (id_tache,))
+        return self._decoder(lignes[0]) if lignes else None
+
+    def taches(self, limite=20, type_tache=None):
+        """Les dernières tâches soumises, de la plus récente à la plus ancienne."""
+        filtre, parametres = ('WHERE type = ?', (type_tache,)) if type_tache else ('', ())
+        _, lignes = self._executer_sql(
+            f'SELECT {", ".join(COLONNES)} FROM taches {filtre} ORDER BY id DESC LIMIT ?', (*parametres, limite))
+        return [self._decoder(ligne) for ligne in lignes]
+
+    def arreter(self, attendre=True):
+        """Arrête les travailleurs après les tâches en cours."""
+        self._executeur.shutdown(wait=attendre)